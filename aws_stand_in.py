@@ -0,0 +1,871 @@
+"""
+Local stand-in for the Lambda, API Gateway and CloudWatch Logs operations
+that deploy.py uses. Functions go through the Pending and InProgress states
+like they do on AWS and every call can be slowed down, throttled or failed,
+so deploys can be measured without an AWS account. Every region has its own
+state. Invokes do not run the code, they report a simulated init duration
+the first time a version is invoked. boto3 is pointed at it with
+AWS_ENDPOINT_URL=http://127.0.0.1:PORT
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+DEFAULT_PORT = 4566
+REGION = 'us-west-2'
+ACCOUNT_ID = '384060451980'
+# functions that exist before the first deploy, the failure lambdas get
+# the log permissions of every deployed function
+SEED_FUNCTIONS = ['LambdaFailure-6', 'apiGatewayFailure']
+POLICY_SIZE_LIMIT = 20480
+MAX_RESOURCES_PAGE = 500
+LOGS_TARGET_PREFIX = 'Logs_20140328.'
+STAND_IN_PATH = '/_stand_in/'
+FUNCTION_PATH = r'/2015-03-31/functions/(?P<function>[^/]+)'
+LAYER_VERSIONS_PATH = r'/2018-10-31/layers/(?P<layer>[^/]+)/versions'
+PROVISIONED_PATH = r'/2019-09-30/functions/(?P<function>[^/]+)/provisioned-concurrency'
+RESOURCE_PATH = r'/restapis/(?P<api>[^/]+)/resources/(?P<resource>[^/]+)/methods/(?P<method>[^/]+)'
+# service: [(http method, path pattern, operation)]
+ROUTES = {
+    'lambda': [
+        ('GET', FUNCTION_PATH + '/configuration', 'get_function_configuration'),
+        ('GET', FUNCTION_PATH, 'get_function'),
+        ('POST', r'/2015-03-31/functions', 'create_function'),
+        ('PUT', FUNCTION_PATH + '/configuration', 'update_function_configuration'),
+        ('PUT', FUNCTION_PATH + '/code', 'update_function_code'),
+        ('POST', FUNCTION_PATH + '/versions', 'publish_version'),
+        ('GET', FUNCTION_PATH + '/aliases', 'list_aliases'),
+        ('POST', FUNCTION_PATH + '/aliases', 'create_alias'),
+        ('PUT', FUNCTION_PATH + '/aliases/(?P<alias>[^/]+)', 'update_alias'),
+        ('GET', FUNCTION_PATH + '/policy', 'get_policy'),
+        ('POST', FUNCTION_PATH + '/policy', 'add_permission'),
+        ('DELETE', FUNCTION_PATH + '/policy/(?P<statement>[^/]+)', 'remove_permission'),
+        ('POST', FUNCTION_PATH + '/invocations', 'invoke'),
+        ('GET', PROVISIONED_PATH, 'get_provisioned_concurrency_config'),
+        ('PUT', PROVISIONED_PATH, 'put_provisioned_concurrency_config'),
+        ('GET', LAYER_VERSIONS_PATH, 'list_layer_versions'),
+        ('POST', LAYER_VERSIONS_PATH, 'publish_layer_version'),
+    ],
+    'apigateway': [
+        ('GET', r'/restapis/(?P<api>[^/]+)', 'get_rest_api'),
+        ('PUT', r'/restapis/(?P<api>[^/]+)', 'put_rest_api'),
+        ('GET', r'/restapis/(?P<api>[^/]+)/resources', 'get_resources'),
+        ('POST', r'/restapis/(?P<api>[^/]+)/resources/(?P<parent>[^/]+)', 'create_resource'),
+        ('PUT', RESOURCE_PATH, 'put_method'),
+        ('PUT', RESOURCE_PATH + '/integration', 'put_integration'),
+        ('PUT', RESOURCE_PATH + '/responses/(?P<status>[^/]+)', 'put_method_response'),
+        ('PUT', RESOURCE_PATH + '/integration/responses/(?P<status>[^/]+)',
+         'put_integration_response'),
+        ('POST', r'/restapis/(?P<api>[^/]+)/deployments', 'create_deployment'),
+        ('GET', r'/restapis/(?P<api>[^/]+)/deployments/(?P<deployment>[^/]+)', 'get_deployment'),
+        ('GET', r'/restapis/(?P<api>[^/]+)/stages/(?P<stage>[^/]+)', 'get_stage'),
+    ],
+}
+# operations slowed down by the upload speed option
+UPLOAD_OPERATIONS = ('create_function', 'update_function_code', 'publish_layer_version')
+LOGS_OPERATIONS = {
+    'DescribeSubscriptionFilters': 'describe_subscription_filters',
+    'PutSubscriptionFilter': 'put_subscription_filter',
+}
+THROTTLING_CODES = {
+    'lambda': 'TooManyRequestsException',
+    'apigateway': 'TooManyRequestsException',
+    'logs': 'ThrottlingException',
+}
+
+
+class StandInOptions:
+    """Latency, throttling and failures injected by the stand-in, times in ms"""
+
+    def __init__(self, latency=20, jitter=10, pending=500, update=300, rate=0,
+                 throttle=0.0, failure=0.0, update_failure=0.0, upload_speed=0, init=250,
+                 duration=5, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.pending = pending
+        self.update = update
+        # requests per second every service accepts, 0 is unlimited
+        self.rate = rate
+        self.throttle = throttle
+        self.failure = failure
+        self.update_failure = update_failure
+        # MB per second code uploads are received with, 0 is unlimited
+        self.upload_speed = upload_speed
+        # init duration of a cold start, every KB of code adds 1 ms
+        self.init = init
+        self.duration = duration
+        self.seed = seed
+
+
+class StandInError(Exception):
+    """An AWS error response"""
+
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+class TokenBucket:
+    """Requests per second a service accepts before it throttles"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def not_found(message):
+    return StandInError(404, 'ResourceNotFoundException', message)
+
+
+def split_function_name(function_name, qualifier=None):
+    """Returns the name and qualifier of a function name, arn or partial arn"""
+    parts = unquote(function_name).split(':')
+    if parts[0] == 'arn':
+        parts = parts[6:]
+    elif len(parts) >= 3:
+        parts = parts[2:]
+    return parts[0], (parts[1] if len(parts) > 1 else qualifier)
+
+
+class AwsStandIn:
+    """In memory lambdas, rest apis and log groups along with the call counts"""
+
+    def __init__(self, options=None, region=REGION):
+        self.options = options or StandInOptions()
+        self.region = region
+        self.random = random.Random(self.options.seed)
+        self.lock = threading.RLock()
+        self.buckets = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.functions = {}
+            self.layers = {}
+            self.rest_apis = {}
+            self.log_groups = {}
+            self.calls = Counter()
+            self.throttled = Counter()
+            self.failed = Counter()
+            for function_name in SEED_FUNCTIONS:
+                self.add_function({'FunctionName': function_name, 'Runtime': 'python3.11',
+                                   'Role': f"arn:aws:iam::{ACCOUNT_ID}:role/stand-in",
+                                   'Handler': 'lambda_function.lambda_handler',
+                                   'Timeout': 3, 'MemorySize': 128}, b'', ready=True)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'calls': {f"{service}.{operation}": count
+                          for (service, operation), count in sorted(self.calls.items())},
+                'total_calls': sum(self.calls.values()),
+                'throttled': sum(self.throttled.values()),
+                'failed': sum(self.failed.values()),
+            }
+
+    def handle(self, service, operation, params, body):
+        """
+        Runs an operation with the injected latency, throttling and failures,
+        operations return the status, the body and optionally headers
+        """
+        options = self.options
+        delay = options.latency + self.random.uniform(0, options.jitter)
+        if operation in UPLOAD_OPERATIONS and options.upload_speed:
+            delay += len(json.dumps(body)) / (options.upload_speed * 1024 * 1024) * 1000
+        time.sleep(delay / 1000)
+
+        with self.lock:
+            self.calls[(service, operation)] += 1
+            if options.rate and not self.get_bucket(service).take() or \
+                    self.random.random() < options.throttle:
+                self.throttled[(service, operation)] += 1
+                raise StandInError(429 if service != 'logs' else 400,
+                                   THROTTLING_CODES[service], 'Rate exceeded')
+            if self.random.random() < options.failure:
+                self.failed[(service, operation)] += 1
+                raise StandInError(500, 'ServiceException', 'Injected failure')
+            return getattr(self, operation)(params, body)
+
+    def get_bucket(self, service):
+        if service not in self.buckets:
+            self.buckets[service] = TokenBucket(self.options.rate)
+        return self.buckets[service]
+
+    # Lambda
+
+    def get_function_arn(self, function_name, qualifier=None):
+        arn = f"arn:aws:lambda:{self.region}:{ACCOUNT_ID}:function:{function_name}"
+        return f"{arn}:{qualifier}" if qualifier else arn
+
+    def add_function(self, data, code, ready=False):
+        function_name, _ = split_function_name(data['FunctionName'])
+        now = time.monotonic()
+        configuration = {
+            'FunctionName': function_name,
+            'FunctionArn': self.get_function_arn(function_name),
+            'Runtime': data.get('Runtime'),
+            'Role': data.get('Role'),
+            'Handler': data.get('Handler'),
+            'Timeout': data.get('Timeout', 3),
+            'MemorySize': data.get('MemorySize', 128),
+            'Layers': [{'Arn': arn, 'CodeSize': 0} for arn in data.get('Layers', [])],
+            'CodeSize': len(code),
+            'CodeSha256': base64.b64encode(hashlib.sha256(code).digest()).decode('UTF-8'),
+            'Version': '$LATEST',
+            'RevisionId': str(uuid.uuid4()),
+        }
+        self.functions[function_name] = {
+            'configuration': configuration,
+            'versions': {},
+            'aliases': {},
+            'policies': {},
+            'warm_versions': set(),
+            'provisioned': {},
+            'ready_at': now if ready else now + self.options.pending / 1000,
+            'update_done_at': None,
+            'update_failed': False,
+        }
+        self.log_groups.setdefault('/aws/lambda/' + function_name, {})
+        return self.get_configuration(self.functions[function_name])
+
+    def get_function_data(self, function_name):
+        name, qualifier = split_function_name(function_name)
+        if name not in self.functions:
+            raise not_found(f"Function not found: {self.get_function_arn(name)}")
+        return self.functions[name], qualifier
+
+    def get_configuration(self, function):
+        configuration = dict(function['configuration'])
+        now = time.monotonic()
+        configuration['State'] = 'Pending' if now < function['ready_at'] else 'Active'
+        if function['update_done_at'] is None:
+            configuration['LastUpdateStatus'] = 'Successful'
+        elif now < function['update_done_at']:
+            configuration['LastUpdateStatus'] = 'InProgress'
+        elif function['update_failed']:
+            configuration['LastUpdateStatus'] = 'Failed'
+            configuration['LastUpdateStatusReason'] = 'Injected update failure'
+        else:
+            configuration['LastUpdateStatus'] = 'Successful'
+        return configuration
+
+    def get_qualified_configuration(self, function, qualifier):
+        if qualifier in (None, '$LATEST'):
+            return self.get_configuration(function)
+        version = function['aliases'].get(qualifier, {}).get('FunctionVersion', qualifier)
+        if version not in function['versions']:
+            raise not_found(f"Function not found: {self.get_function_arn(function['configuration']['FunctionName'], qualifier)}")
+        return dict(function['versions'][version])
+
+    def check_ready(self, function):
+        """Modifying a function that is pending or being updated conflicts, like on AWS"""
+        configuration = self.get_configuration(function)
+        if configuration['State'] == 'Pending' or configuration['LastUpdateStatus'] == 'InProgress':
+            raise StandInError(409, 'ResourceConflictException',
+                               'The operation cannot be performed at this time. '
+                               + 'An update is in progress for resource: '
+                               + configuration['FunctionArn'])
+
+    def start_update(self, function):
+        function['configuration']['RevisionId'] = str(uuid.uuid4())
+        function['update_done_at'] = time.monotonic() + self.options.update / 1000
+        function['update_failed'] = self.random.random() < self.options.update_failure
+
+    def get_function_configuration(self, params, body):
+        function, qualifier = self.get_function_data(params['function'])
+        return 200, self.get_qualified_configuration(function, params.get('Qualifier', qualifier))
+
+    def get_function(self, params, body):
+        function, qualifier = self.get_function_data(params['function'])
+        configuration = self.get_qualified_configuration(function, params.get('Qualifier', qualifier))
+        return 200, {'Configuration': configuration, 'Code': {'RepositoryType': 'S3'}}
+
+    def create_function(self, params, body):
+        function_name, _ = split_function_name(body['FunctionName'])
+        if function_name in self.functions:
+            raise StandInError(409, 'ResourceConflictException',
+                               f"Function already exist: {function_name}")
+        code = base64.b64decode(body.get('Code', {}).get('ZipFile', ''))
+        return 201, self.add_function(body, code)
+
+    def update_function_configuration(self, params, body):
+        function, _ = self.get_function_data(params['function'])
+        self.check_ready(function)
+        configuration = function['configuration']
+        for field in ('Runtime', 'Role', 'Handler', 'Timeout', 'MemorySize'):
+            if field in body:
+                configuration[field] = body[field]
+        if 'Layers' in body:
+            configuration['Layers'] = [{'Arn': arn, 'CodeSize': 0} for arn in body['Layers']]
+        self.start_update(function)
+        return 200, self.get_configuration(function)
+
+    def update_function_code(self, params, body):
+        function, _ = self.get_function_data(params['function'])
+        self.check_ready(function)
+        code = base64.b64decode(body.get('ZipFile', ''))
+        function['configuration']['CodeSize'] = len(code)
+        function['configuration']['CodeSha256'] = \
+            base64.b64encode(hashlib.sha256(code).digest()).decode('UTF-8')
+        self.start_update(function)
+        return 200, self.get_configuration(function)
+
+    def publish_version(self, params, body):
+        function, _ = self.get_function_data(params['function'])
+        self.check_ready(function)
+        configuration = self.get_configuration(function)
+        # publishing unchanged code and configuration returns the last version
+        for version in function['versions'].values():
+            if version['RevisionId'] == configuration['RevisionId']:
+                return 201, dict(version)
+        version_number = str(len(function['versions']) + 1)
+        configuration.update({
+            'Version': version_number,
+            'FunctionArn': self.get_function_arn(configuration['FunctionName'], version_number),
+            'Description': body.get('Description', ''),
+        })
+        function['versions'][version_number] = configuration
+        return 201, dict(configuration)
+
+    def get_alias(self, function, name):
+        alias = dict(function['aliases'][name])
+        alias['AliasArn'] = self.get_function_arn(function['configuration']['FunctionName'], name)
+        return alias
+
+    def list_aliases(self, params, body):
+        function, _ = self.get_function_data(params['function'])
+        return 200, {'Aliases': [self.get_alias(function, name) for name in function['aliases']]}
+
+    def create_alias(self, params, body):
+        function, _ = self.get_function_data(params['function'])
+        if body['Name'] in function['aliases']:
+            raise StandInError(409, 'ResourceConflictException', f"Alias already exists: {body['Name']}")
+        if body['FunctionVersion'] not in function['versions']:
+            raise not_found(f"Version not found: {body['FunctionVersion']}")
+        function['aliases'][body['Name']] = {'Name': body['Name'],
+                                             'FunctionVersion': body['FunctionVersion']}
+        return 201, self.get_alias(function, body['Name'])
+
+    def update_alias(self, params, body):
+        function, _ = self.get_function_data(params['function'])
+        if params['alias'] not in function['aliases']:
+            raise not_found(f"Alias not found: {params['alias']}")
+        if body.get('FunctionVersion') not in function['versions']:
+            raise not_found(f"Version not found: {body.get('FunctionVersion')}")
+        function['aliases'][params['alias']]['FunctionVersion'] = body['FunctionVersion']
+        return 200, self.get_alias(function, params['alias'])
+
+    def get_function_policy(self, params):
+        function, qualifier = self.get_function_data(params['function'])
+        qualifier = params.get('Qualifier', qualifier)
+        if qualifier and qualifier not in function['aliases'] and qualifier not in function['versions']:
+            raise not_found(f"Function not found: {qualifier}")
+        return function['policies'].setdefault(qualifier, []), function, qualifier
+
+    def get_policy(self, params, body):
+        statements, _, _ = self.get_function_policy(params)
+        if not statements:
+            raise not_found('The resource you requested does not exist.')
+        policy = {'Version': '2012-10-17', 'Id': 'default', 'Statement': statements}
+        return 200, {'Policy': json.dumps(policy), 'RevisionId': str(uuid.uuid4())}
+
+    def add_permission(self, params, body):
+        statements, function, qualifier = self.get_function_policy(params)
+        if any(statement['Sid'] == body['StatementId'] for statement in statements):
+            raise StandInError(409, 'ResourceConflictException',
+                               f"The statement id ({body['StatementId']}) provided already exists.")
+        principal = body['Principal']
+        statement = {
+            'Sid': body['StatementId'],
+            'Effect': 'Allow',
+            'Principal': {'Service': principal} if principal.endswith('.amazonaws.com') else principal,
+            'Action': body['Action'],
+            'Resource': self.get_function_arn(function['configuration']['FunctionName'], qualifier),
+        }
+        if body.get('SourceArn'):
+            statement['Condition'] = {'ArnLike': {'AWS:SourceArn': body['SourceArn']}}
+        if len(json.dumps(statements + [statement])) > POLICY_SIZE_LIMIT:
+            raise StandInError(400, 'PolicyLengthExceededException',
+                               'The final policy size is bigger than the limit.')
+        statements.append(statement)
+        return 201, {'Statement': json.dumps(statement)}
+
+    def remove_permission(self, params, body):
+        statements, _, _ = self.get_function_policy(params)
+        remaining = [statement for statement in statements if statement['Sid'] != params['statement']]
+        if len(remaining) == len(statements):
+            raise not_found(f"Statement {params['statement']} is not found in resource policy.")
+        statements[:] = remaining
+        return 204, None
+
+    def invoke(self, params, body):
+        """
+        Returns the log tail of the invoke like LogType=Tail does, the first
+        invoke of a version that has no provisioned concurrency is a cold start
+        """
+        function, qualifier = self.get_function_data(params['function'])
+        qualifier = params.get('Qualifier', qualifier)
+        configuration = self.get_qualified_configuration(function, qualifier)
+        version = configuration['Version']
+        provisioned = function['provisioned'].get(qualifier)
+        report = (f"REPORT RequestId: {uuid.uuid4()}\t"
+                  + f"Duration: {self.options.duration * self.random.uniform(0.8, 1.2):.2f} ms\t"
+                  + f"Memory Size: {configuration['MemorySize']} MB\t")
+        if version not in function['warm_versions'] and not \
+                (provisioned and time.monotonic() >= provisioned['ready_at']):
+            function['warm_versions'].add(version)
+            init_duration = (self.options.init + configuration['CodeSize'] / 1024) \
+                * self.random.uniform(0.95, 1.05)
+            report += f"Init Duration: {init_duration:.2f} ms\t"
+        headers = {
+            'X-Amz-Executed-Version': version,
+            'X-Amz-Log-Result': base64.b64encode(f"START\n{report}\n".encode('UTF-8')).decode('UTF-8'),
+        }
+        return 200, {'statusCode': 200, 'body': 'stand-in'}, headers
+
+    def get_provisioned_config(self, function, qualifier):
+        provisioned = function['provisioned'].get(qualifier)
+        if provisioned is None:
+            raise StandInError(404, 'ProvisionedConcurrencyConfigNotFoundException',
+                               'No Provisioned Concurrency Config found for this function')
+        ready = time.monotonic() >= provisioned['ready_at']
+        return {
+            'RequestedProvisionedConcurrentExecutions': provisioned['requested'],
+            'AllocatedProvisionedConcurrentExecutions': provisioned['requested'] if ready else 0,
+            'Status': 'READY' if ready else 'IN_PROGRESS',
+        }
+
+    def get_provisioned_concurrency_config(self, params, body):
+        function, _ = self.get_function_data(params['function'])
+        return 200, self.get_provisioned_config(function, params['Qualifier'])
+
+    def put_provisioned_concurrency_config(self, params, body):
+        function, _ = self.get_function_data(params['function'])
+        if params['Qualifier'] not in function['aliases']:
+            raise not_found(f"Alias not found: {params['Qualifier']}")
+        function['provisioned'][params['Qualifier']] = {
+            'requested': body['ProvisionedConcurrentExecutions'],
+            'ready_at': time.monotonic() + self.options.update / 1000,
+        }
+        return 202, self.get_provisioned_config(function, params['Qualifier'])
+
+    # Lambda layers
+
+    def list_layer_versions(self, params, body):
+        versions = sorted(self.layers.get(params['layer'], []),
+                          key=lambda version: version['Version'], reverse=True)
+        return 200, {'LayerVersions': [dict(version) for version in versions]}
+
+    def publish_layer_version(self, params, body):
+        versions = self.layers.setdefault(params['layer'], [])
+        code = base64.b64decode(body.get('Content', {}).get('ZipFile', ''))
+        layer_arn = f"arn:aws:lambda:{self.region}:{ACCOUNT_ID}:layer:{params['layer']}"
+        version = {
+            'LayerVersionArn': f"{layer_arn}:{len(versions) + 1}",
+            'Version': len(versions) + 1,
+            'Description': body.get('Description', ''),
+            'CreatedDate': time.strftime('%Y-%m-%dT%H:%M:%S.000+0000', time.gmtime()),
+            'CompatibleRuntimes': body.get('CompatibleRuntimes', []),
+        }
+        versions.append(version)
+        return 201, dict(version, LayerArn=layer_arn, Content={
+            'CodeSha256': base64.b64encode(hashlib.sha256(code).digest()).decode('UTF-8'),
+            'CodeSize': len(code),
+        })
+
+    # API Gateway
+
+    def get_api_data(self, api_id):
+        """Rest apis exist from their first use on, with a root resource"""
+        if api_id not in self.rest_apis:
+            root_id = uuid.uuid4().hex[:10]
+            self.rest_apis[api_id] = {
+                'resources': {root_id: {'id': root_id, 'path': '/'}},
+                'deployments': [],
+                'stages': {},
+            }
+        return self.rest_apis[api_id]
+
+    def get_path_resource(self, rest_api, path):
+        """Returns the resource of a path, creating the missing resources along it"""
+        resources = {resource['path']: resource for resource in rest_api['resources'].values()}
+        parent = resources['/']
+        for path_part in path.strip('/').split('/'):
+            resource_path = parent['path'].rstrip('/') + '/' + path_part
+            if resource_path not in resources:
+                resource_id = uuid.uuid4().hex[:10]
+                rest_api['resources'][resource_id] = resources[resource_path] = {
+                    'id': resource_id, 'parentId': parent['id'], 'pathPart': path_part,
+                    'path': resource_path}
+            parent = resources[resource_path]
+        return parent
+
+    def get_rest_api(self, params, body):
+        self.get_api_data(params['api'])
+        return 200, {'id': params['api'], 'name': params['api']}
+
+    def put_rest_api(self, params, body):
+        """Merges the paths of a swagger document, the methods it lists are replaced"""
+        if params.get('mode', 'merge') != 'merge':
+            raise StandInError(400, 'BadRequestException', 'Only merge mode is supported')
+        rest_api = self.get_api_data(params['api'])
+        for path, methods in body.get('paths', {}).items():
+            resource = self.get_path_resource(rest_api, path)
+            for method, definition in methods.items():
+                integration = dict(definition.get('x-amazon-apigateway-integration', {}))
+                responses = integration.pop('responses', {})
+                integration['integrationResponses'] = {
+                    response['statusCode']: dict(response) for response in responses.values()}
+                resource.setdefault('resourceMethods', {})[method.upper()] = {
+                    'httpMethod': method.upper(),
+                    'authorizationType': 'NONE',
+                    'methodResponses': {status: {'statusCode': status}
+                                        for status in definition.get('responses', {})},
+                    'methodIntegration': integration,
+                }
+        return 200, {'id': params['api'], 'name': body.get('info', {}).get('title')}
+
+    def get_resource(self, params):
+        rest_api = self.get_api_data(params['api'])
+        if params['resource'] not in rest_api['resources']:
+            raise StandInError(404, 'NotFoundException', 'Invalid Resource identifier specified')
+        return rest_api['resources'][params['resource']]
+
+    def get_resources(self, params, body):
+        resources = list(self.get_api_data(params['api'])['resources'].values())
+        limit = min(int(params.get('limit', 25)), MAX_RESOURCES_PAGE)
+        position = int(params.get('position', 0))
+        # the api gateway wire format lists the items under item
+        response = {'item': [dict(resource) for resource in resources[position:position + limit]]}
+        if position + limit < len(resources):
+            response['position'] = str(position + limit)
+        return 200, response
+
+    def create_resource(self, params, body):
+        rest_api = self.get_api_data(params['api'])
+        parent = rest_api['resources'].get(params['parent'])
+        if parent is None:
+            raise StandInError(404, 'NotFoundException', 'Invalid Resource identifier specified')
+        path = parent['path'].rstrip('/') + '/' + body['pathPart']
+        if any(resource['path'] == path for resource in rest_api['resources'].values()):
+            raise StandInError(409, 'ConflictException', 'Another resource with the same parent '
+                               + 'already has this name: ' + body['pathPart'])
+        resource_id = uuid.uuid4().hex[:10]
+        rest_api['resources'][resource_id] = {'id': resource_id, 'parentId': parent['id'],
+                                              'pathPart': body['pathPart'], 'path': path}
+        return 201, dict(rest_api['resources'][resource_id])
+
+    def put_method(self, params, body):
+        resource = self.get_resource(params)
+        method = dict(body, httpMethod=params['method'])
+        resource.setdefault('resourceMethods', {})[params['method']] = method
+        return 201, method
+
+    def get_method(self, params):
+        method = self.get_resource(params).get('resourceMethods', {}).get(params['method'])
+        if method is None:
+            raise StandInError(404, 'NotFoundException', 'Invalid Method identifier specified')
+        return method
+
+    def put_integration(self, params, body):
+        self.get_method(params)['methodIntegration'] = dict(body)
+        return 201, dict(body)
+
+    def put_method_response(self, params, body):
+        responses = self.get_method(params).setdefault('methodResponses', {})
+        responses[params['status']] = dict(body, statusCode=params['status'])
+        return 201, responses[params['status']]
+
+    def put_integration_response(self, params, body):
+        integration = self.get_method(params).get('methodIntegration')
+        if integration is None:
+            raise StandInError(404, 'NotFoundException', 'Invalid Integration identifier specified')
+        responses = integration.setdefault('integrationResponses', {})
+        responses[params['status']] = dict(body, statusCode=params['status'])
+        return 201, responses[params['status']]
+
+    def create_deployment(self, params, body):
+        """Snapshots the methods of every resource, the stage serves the snapshot"""
+        rest_api = self.get_api_data(params['api'])
+        deployment = {'id': uuid.uuid4().hex[:6], 'createdDate': int(time.time())}
+        api_summary = {}
+        for resource in rest_api['resources'].values():
+            for method, item in resource.get('resourceMethods', {}).items():
+                api_summary.setdefault(resource['path'], {})[method] = {
+                    'authorizationType': item.get('authorizationType', 'NONE')}
+        rest_api['deployments'].append(dict(deployment, stageName=body.get('stageName'),
+                                            apiSummary=api_summary))
+        if body.get('stageName'):
+            rest_api['stages'][body['stageName']] = {
+                'stageName': body['stageName'], 'deploymentId': deployment['id'],
+                'lastUpdatedDate': deployment['createdDate']}
+            self.log_groups.setdefault(
+                f"API-Gateway-Execution-Logs_{params['api']}/{body['stageName']}", {})
+        return 201, deployment
+
+    def get_deployment(self, params, body):
+        rest_api = self.get_api_data(params['api'])
+        deployment = next((item for item in rest_api['deployments']
+                           if item['id'] == params['deployment']), None)
+        if deployment is None:
+            raise StandInError(404, 'NotFoundException', 'Invalid Deployment identifier specified')
+        response = {'id': deployment['id'], 'createdDate': deployment['createdDate']}
+        if 'apisummary' in params.get('embed', ''):
+            response['apiSummary'] = deployment['apiSummary']
+        return 200, response
+
+    def get_stage(self, params, body):
+        stage = self.get_api_data(params['api'])['stages'].get(params['stage'])
+        if stage is None:
+            raise StandInError(404, 'NotFoundException', 'Invalid Stage identifier specified')
+        return 200, dict(stage)
+
+    # CloudWatch Logs
+
+    def describe_subscription_filters(self, params, body):
+        if body['logGroupName'] not in self.log_groups:
+            raise StandInError(400, 'ResourceNotFoundException', 'The specified log group does not exist.')
+        prefix = body.get('filterNamePrefix', '')
+        filters = [dict(item) for name, item in self.log_groups[body['logGroupName']].items()
+                   if name.startswith(prefix)]
+        return 200, {'subscriptionFilters': filters}
+
+    def put_subscription_filter(self, params, body):
+        log_group = self.log_groups.setdefault(body['logGroupName'], {})
+        log_group[body['filterName']] = {key: body.get(key) for key in
+                                         ('logGroupName', 'filterName', 'filterPattern',
+                                          'destinationArn')}
+        return 200, None
+
+
+class RegionalStandIn:
+    """
+    A stand-in per region, like on AWS the lambdas, rest apis and rate
+    limits of a region are apart from the other regions
+    """
+
+    def __init__(self, options=None):
+        self.options = options or StandInOptions()
+        self.regions = {}
+        self.lock = threading.Lock()
+
+    def get(self, region):
+        with self.lock:
+            if region not in self.regions:
+                self.regions[region] = AwsStandIn(self.options, region)
+            return self.regions[region]
+
+    def reset(self):
+        with self.lock:
+            self.regions = {}
+
+    def get_stats(self):
+        """Returns the stats of all the regions added up, with the calls of every region"""
+        with self.lock:
+            regions = dict(self.regions)
+        stats = {'calls': Counter(), 'total_calls': 0, 'throttled': 0, 'failed': 0, 'regions': {}}
+        for region, stand_in in sorted(regions.items()):
+            region_stats = stand_in.get_stats()
+            stats['calls'].update(region_stats['calls'])
+            for key in ('total_calls', 'throttled', 'failed'):
+                stats[key] += region_stats[key]
+            stats['regions'][region] = region_stats['total_calls']
+        stats['calls'] = dict(sorted(stats['calls'].items()))
+        return stats
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Routes the requests of boto3 clients to the operations of the stand-in"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def do_PUT(self):
+        self.handle_request()
+
+    def do_DELETE(self):
+        self.handle_request()
+
+    def get_credential_scope(self):
+        """Returns the region and service of the credential scope of the signature"""
+        match = re.search(r'Credential=[^/]+/[^/]+/([^/]+)/([^/]+)/',
+                          self.headers.get('Authorization', ''))
+        return match.groups() if match else (None, None)
+
+    def get_service(self):
+        service = self.get_credential_scope()[1]
+        if service:
+            return service
+        if self.headers.get('X-Amz-Target'):
+            return 'logs'
+        return 'apigateway' if self.path.startswith('/restapis') else 'lambda'
+
+    def route(self, service, path):
+        if service == 'logs':
+            target = self.headers.get('X-Amz-Target', '')
+            operation = LOGS_OPERATIONS.get(target[len(LOGS_TARGET_PREFIX):])
+            return operation, {}
+        for method, pattern, operation in ROUTES.get(service, []):
+            match = re.fullmatch(pattern, path)
+            if method == self.command and match:
+                return operation, match.groupdict()
+        return None, {}
+
+    def handle_request(self):
+        stand_in = self.server.stand_in
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        raw_body = self.rfile.read(length) if length else b''
+
+        if url.path.startswith(STAND_IN_PATH):
+            if url.path == STAND_IN_PATH + 'reset':
+                stand_in.reset()
+            self.send_json(200, stand_in.get_stats())
+            return
+
+        service = self.get_service()
+        operation, params = self.route(service, url.path)
+        if operation is None:
+            self.send_error_response(service, StandInError(
+                400, 'UnknownOperationException', f"{self.command} {url.path} is not supported"))
+            return
+        params.update({key: values[0] for key, values in parse_qs(url.query).items()})
+        try:
+            region = self.get_credential_scope()[0] or REGION
+            result = stand_in.get(region).handle(service, operation, params,
+                                                 json.loads(raw_body or b'{}'))
+        except StandInError as error:
+            self.send_error_response(service, error)
+            return
+        self.send_json(*result)
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('UTF-8') if body is not None else b''
+        self.send_response(status)
+        content_type = 'application/x-amz-json-1.1' if self.headers.get('X-Amz-Target') \
+            else 'application/json'
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('x-amzn-RequestId', str(uuid.uuid4()))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_response(self, service, error):
+        if service == 'logs':
+            self.send_json(error.status, {'__type': error.code, 'message': error.message})
+        else:
+            self.send_json(error.status, {'message': error.message, 'Type': 'User'},
+                           {'x-amzn-ErrorType': error.code})
+
+
+class StandInServer:
+    """Runs the stand-in on a background thread"""
+
+    def __init__(self, options=None, host='127.0.0.1', port=0):
+        self.stand_in = RegionalStandIn(options)
+        self.server = ThreadingHTTPServer((host, port), StandInHandler)
+        self.server.daemon_threads = True
+        self.server.stand_in = self.stand_in
+        self.thread = None
+
+    @property
+    def endpoint_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.endpoint_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def get_options(args):
+    return StandInOptions(latency=args.latency, jitter=args.jitter, pending=args.pending,
+                          update=args.update, rate=args.rate, throttle=args.throttle,
+                          failure=args.failure, update_failure=args.update_failure,
+                          upload_speed=args.upload_speed, init=args.init,
+                          duration=args.duration, seed=args.seed)
+
+
+def add_option_arguments(parser):
+    """Adds the arguments of StandInOptions to a parser"""
+    parser.add_argument('-latency', type=float, default=20, help="Latency of every call in ms")
+    parser.add_argument('-jitter', type=float, default=10, help="Random latency added in ms")
+    parser.add_argument('-pending', type=float, default=500,
+                        help="Time a created function stays Pending in ms")
+    parser.add_argument('-update', type=float, default=300,
+                        help="Time an update stays InProgress in ms")
+    parser.add_argument('-rate', type=float, default=0,
+                        help="Requests per second every service accepts, 0 is unlimited")
+    parser.add_argument('-throttle', type=float, default=0.0,
+                        help="Share of calls that are throttled")
+    parser.add_argument('-failure', type=float, default=0.0,
+                        help="Share of calls that fail with a service error")
+    parser.add_argument('-update_failure', type=float, default=0.0,
+                        help="Share of updates that end in the Failed state")
+    parser.add_argument('-upload_speed', type=float, default=0,
+                        help="MB per second code is uploaded with, 0 is unlimited")
+    parser.add_argument('-init', type=float, default=250,
+                        help="Init duration of a cold start in ms, every KB of code adds 1 ms")
+    parser.add_argument('-duration', type=float, default=5,
+                        help="Duration of an invoke in ms")
+    parser.add_argument('-seed', type=int, help="Seed of the injected randomness")
+
+
+def validate_arguments():
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument('-host', type=str, default='127.0.0.1')
+    parser.add_argument('-port', type=int, default=DEFAULT_PORT)
+    add_option_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = validate_arguments()
+    server = StandInServer(get_options(args), args.host, args.port)
+    print(f"AWS stand-in listening, run deploy.py with AWS_ENDPOINT_URL={server.endpoint_url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,575 @@
 import argparse
+import ast
+import base64
+import contextlib
+import fnmatch
+import functools
+import hashlib
+import importlib.util
+import io
 import json
+import marshal
 import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pprint import pprint
-from zipfile import ZipFile
-import boto3
-import uuid
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
 from botocore.exceptions import ClientError
 
-CLIENT = boto3.client('lambda')
 CONFIGURATION_FILE = 'configurations.json'
-API_FAILURE_LAMBDA_ARN = 'arn:aws:lambda:us-west-2:384060451980:function:apiGatewayFailure'
-LAMBDA_FAILURE_LAMBDA_ARN = 'arn:aws:lambda:us-west-2:384060451980:function:LambdaFailure-6'
+# field: (type, required) of a lambda in the configuration file
+CONFIGURATION_SCHEMA = {
+    'FunctionArn': (str, True),
+    'Runtime': (str, True),
+    'Role': (str, True),
+    'Timeout': (int, True),
+    'MemorySize': (int, True),
+    'layers': (list, False),
+    'shared_layers': (list, False),
+    'ApiId': (str, False),
+    'logs': (bool, False),
+    'warmup_payloads': (list, False),
+    'provisioned_concurrency': (int, False),
+    'targets': (list, False),
+    'environments': (dict, False),
+}
+# field: (type, required) of a deploy target, the other fields of a target
+# override the lambda configuration in its region
+TARGET_SCHEMA = {
+    'region': (str, True),
+    'account': (str, True),
+    'profile': (str, False),
+}
+# Target of the lambdas that do not list targets
+DEFAULT_REGION = 'us-west-2'
+DEFAULT_ACCOUNT = '384060451980'
+# Lambdas that every target has, cloudwatch logs sends the failures to them
+API_FAILURE_LAMBDA = 'apiGatewayFailure'
+LAMBDA_FAILURE_LAMBDA = 'LambdaFailure-6'
+API_PERMISSION_STATEMENT_ID = '13e9d442-455f-4f17-9b73-616d9cbee339'
+# header: value of the CORS headers the OPTIONS method of a lambda resource answers with
+API_CORS_HEADERS = {
+    'Access-Control-Allow-Headers': "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'",
+    'Access-Control-Allow-Methods': "'POST,OPTIONS'",
+    'Access-Control-Allow-Origin': "'*'",
+}
+# failure lambda: (statement id, log group pattern) of the wildcard statement
+# that replaces the per function statements when its policy is compacted
+FAILURE_POLICY_WILDCARDS = {
+    LAMBDA_FAILURE_LAMBDA: ('logs-lambda-log-groups', '/aws/lambda/*:*'),
+    API_FAILURE_LAMBDA: ('logs-api-execution-logs', 'API-Gateway-Execution-Logs_*/production:*'),
+}
+LAMBDA_HANDLER = 'lambda_function.lambda_handler'
+# Shared layers built from local modules and requirements, the lambdas
+# that list a layer in shared_layers get it attached
+LAYERS_FILE = 'layers.json'
+# name: (type, required) of a layer in the layers file
+LAYER_SCHEMA = {
+    'modules': (list, False),
+    'requirements': (list, False),
+    'runtimes': (list, True),
+}
+MAX_LAYERS = 5
+# The content hash of a layer version is kept in its description
+LAYER_HASH_PREFIX = 'content-sha256:'
+LAYER_PLATFORM = 'manylinux2014_x86_64'
+LAYER_ZIP_LIMIT = 50 * 1024 * 1024
+DEFAULT_CONCURRENCY = 8
+# boto3 keeps 10 connections per client by default, the pool is sized for
+# the deploy concurrency plus the waiter poller and the api batch
+MIN_POOL_CONNECTIONS = 10
+POOL_HEADROOM = 2
+RETRY_MODE = 'adaptive'
+RETRY_MAX_ATTEMPTS = 10
+# Number of stages that can use a service at the same time, API Gateway
+# rejects concurrent modifications of the same rest api so it gets one
+SERVICE_CONCURRENCY = {
+    'lambda': 8,
+    'apigateway': 1,
+    'logs': 4,
+    'bundle': 4,
+    'wait': 32,
+    'invoke': 8,
+}
+# Backoff used while waiting for a lambda to become ready, in seconds
+WAIT_BASE_DELAY = 1
+WAIT_MAX_DELAY = 20
+WAIT_TIMEOUT = 900
+THROTTLING_ERRORS = ('TooManyRequestsException', 'ThrottlingException', 'Throttling')
+# Fixed timestamp of bundle entries so identical code gives identical zips
+BUNDLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+HANDLER_FILE = 'lambda_function.py'
+# Local module replaced by a constant through change_env_in_code
+ENVIRONMENT_MODULE = 'environment'
+PRINT_LOCK = threading.Lock()
+PROGRESS = threading.local()
+TIMELINE_FILE = 'deploy_timeline.json'
+# Init and invoke durations measured by the warm-up of every deployed version
+WARMUP_HISTORY_FILE = 'warmup_history.json'
+WARMUP_HISTORY_LENGTH = 20
+# A duration regressed when it is both this share and this many ms slower
+# than the previous version, so the noise of a single cold start is ignored
+WARMUP_REGRESSION_RATIO = 0.2
+WARMUP_REGRESSION_MS = 50
+# Stages completed by every function of the last deploy run, -resume
+# continues an interrupted run from it
+DEPLOY_JOURNAL_FILE = 'deploy_journal.json'
+# Seconds between two polls of the watched sources, a batch of changes is
+# deployed once a poll finds no further change
+WATCH_INTERVAL = 0.3
+
+
+class DeployTelemetry:
+    """
+    Timeline of a deploy run: the stages of every function and every AWS
+    call made while they ran. Calls are attributed to the function and stage
+    running on the calling thread
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.stages = []
+        self.calls = []
+        self.lock = threading.Lock()
+        self.context = threading.local()
+
+    def set_context(self, function_name, stage):
+        self.context.function_name = function_name
+        self.context.stage = stage
+
+    def get_context(self):
+        return getattr(self.context, 'function_name', None), getattr(self.context, 'stage', None)
+
+    @contextlib.contextmanager
+    def stage(self, function_name, stage, service, queued_since=None):
+        """Records a stage, queued_since is when it started waiting for its service"""
+        start_time = time.time()
+        previous = self.get_context()
+        self.set_context(function_name, stage)
+        status = 'succeeded'
+        try:
+            yield
+        except Exception:
+            status = 'failed'
+            raise
+        finally:
+            self.set_context(*previous)
+            with self.lock:
+                self.stages.append({
+                    'function': function_name,
+                    'stage': stage,
+                    'service': service,
+                    'start': round(start_time - self.start_time, 4),
+                    'queued': round(start_time - (queued_since or start_time), 4),
+                    'duration': round(time.time() - start_time, 4),
+                    'status': status,
+                })
+
+    def instrument(self, client):
+        """Registers the botocore hooks that record the calls of a client"""
+        events = client.meta.events
+        events.register('before-call', self.before_call)
+        events.register('needs-retry', self.needs_retry)
+        events.register('after-call', self.after_call)
+        events.register('after-call-error', self.after_call_error)
+        return client
+
+    def before_call(self, model, context, **kwargs):
+        function_name, stage = self.get_context()
+        context['telemetry'] = {
+            'function': function_name,
+            'stage': stage,
+            'service': model.service_model.service_name,
+            'operation': model.name,
+            'start': time.time(),
+            'throttles': 0,
+        }
+
+    def needs_retry(self, response, request_dict, **kwargs):
+        record = request_dict.get('context', {}).get('telemetry')
+        if record is not None and response is not None:
+            if response[1].get('Error', {}).get('Code') in THROTTLING_ERRORS:
+                record['throttles'] += 1
+
+    def after_call(self, parsed, context, **kwargs):
+        # error responses are parsed too, the ClientError is raised after this event
+        error = parsed.get('Error', {}).get('Code')
+        self.finish_call(context, parsed.get('ResponseMetadata', {}), error)
+
+    def after_call_error(self, exception, context, **kwargs):
+        response = getattr(exception, 'response', None) or {}
+        error = response.get('Error', {}).get('Code') or type(exception).__name__
+        self.finish_call(context, response.get('ResponseMetadata', {}), error)
+
+    def finish_call(self, context, metadata, error):
+        record = context.pop('telemetry', None)
+        if record is None:
+            return
+        start_time = record.pop('start')
+        record['start'] = round(start_time - self.start_time, 4)
+        record['duration'] = round(time.time() - start_time, 4)
+        record['retries'] = metadata.get('RetryAttempts', 0)
+        record['error'] = error
+        with self.lock:
+            self.calls.append(record)
+
+    def get_functions(self):
+        """Aggregates stage time and calls per function and stage"""
+        functions = {}
+
+        def get_entry(function_name, stage):
+            stages = functions.setdefault(function_name or 'run', {})
+            return stages.setdefault(stage or 'other', {
+                'duration': 0, 'queued': 0, 'calls': 0, 'api_time': 0,
+                'retries': 0, 'throttles': 0, 'errors': 0,
+            })
+
+        for item in self.stages:
+            entry = get_entry(item['function'], item['stage'])
+            entry['duration'] += item['duration']
+            entry['queued'] += item['queued']
+        for call in self.calls:
+            entry = get_entry(call['function'], call['stage'])
+            entry['calls'] += 1
+            entry['api_time'] += call['duration']
+            entry['retries'] += call['retries']
+            entry['throttles'] += call['throttles']
+            entry['errors'] += 1 if call['error'] else 0
+        return functions
+
+    def get_report(self):
+        return {
+            'start_time': self.start_time,
+            'duration': round(time.time() - self.start_time, 4),
+            'functions': self.get_functions(),
+            'stages': sorted(self.stages, key=lambda item: item['start']),
+            'calls': sorted(self.calls, key=lambda item: item['start']),
+        }
+
+    def write_report(self, file_name):
+        with open(file_name, 'w', encoding='UTF-8') as file_obj:
+            json.dump(self.get_report(), file_obj, indent=2)
+
+    def display_summary(self):
+        """Prints a table of where the time of every function went"""
+        print(f"{'function':<32} {'stage s':>8} {'queued s':>9} {'calls':>6} {'api s':>7} "
+              + f"{'retries':>8} {'throttles':>10}  slowest stage")
+        for function_name, stages in self.get_functions().items():
+            total = {key: sum(entry[key] for entry in stages.values())
+                     for key in ('duration', 'queued', 'calls', 'api_time', 'retries', 'throttles')}
+            slowest = max(stages, key=lambda stage: stages[stage]['duration'] + stages[stage]['api_time'])
+            print(f"{function_name:<32} {total['duration']:>8.2f} {total['queued']:>9.2f} "
+                  + f"{total['calls']:>6} {total['api_time']:>7.2f} {total['retries']:>8} "
+                  + f"{total['throttles']:>10}  {slowest}")
+
+
+TELEMETRY = DeployTelemetry()
+
+
+class DeployTarget:
+    """A region and account lambdas are deployed to, along with the arns that depend on them"""
+
+    def __init__(self, region, account, profile=None):
+        self.region = region
+        self.account = account
+        self.profile = profile
+
+    @property
+    def key(self):
+        return (self.region, self.account, self.profile)
+
+    def __eq__(self, other):
+        return isinstance(other, DeployTarget) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __str__(self):
+        return f"{self.region} ({self.account})"
+
+    @property
+    def logs_principal(self):
+        return f"logs.{self.region}.amazonaws.com"
+
+    def get_function_arn(self, function_name, qualifier=None):
+        arn = f"arn:aws:lambda:{self.region}:{self.account}:function:{function_name}"
+        return f"{arn}:{qualifier}" if qualifier else arn
+
+    def get_log_group_arn(self, log_group_name):
+        return f"arn:aws:logs:{self.region}:{self.account}:log-group:{log_group_name}"
+
+    def get_lambda_uri(self, function_name, qualifier):
+        """Returns the uri an api gateway integration invokes a lambda with"""
+        return (f"arn:aws:apigateway:{self.region}:lambda:path/2015-03-31/functions/"
+                + f"{self.get_function_arn(function_name, qualifier)}/invocations")
+
+    def get_execute_api_arn(self, api_id, resource):
+        return f"arn:aws:execute-api:{self.region}:{self.account}:{api_id}/{resource}"
+
+
+DEFAULT_TARGET = DeployTarget(DEFAULT_REGION, DEFAULT_ACCOUNT)
+
+
+class ClientPool:
+    """
+    boto3 clients shared by the whole run, one per service and target. A
+    client is created on first use, with a connection pool sized for the
+    deploy concurrency and adaptive retries, and its calls are recorded in
+    the deploy timeline. Calls go to the target set on the calling thread
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        self.concurrency = concurrency
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.context = threading.local()
+
+    def configure(self, concurrency):
+        """Sets the concurrency the clients that are not created yet are sized for"""
+        self.concurrency = concurrency
+
+    def get_target(self):
+        return getattr(self.context, 'target', None) or DEFAULT_TARGET
+
+    @contextlib.contextmanager
+    def use(self, target):
+        """Sends the calls of the current thread to a target"""
+        previous = getattr(self.context, 'target', None)
+        self.context.target = target
+        try:
+            yield
+        finally:
+            self.context.target = previous
+
+    def get(self, service):
+        target = self.get_target()
+        with self.lock:
+            if (service, target) not in self.clients:
+                self.clients[(service, target)] = TELEMETRY.instrument(self.create(service, target))
+            return self.clients[(service, target)]
+
+    def create(self, service, target):
+        # boto3 takes longer to import than the rest of the deployer, it is
+        # only imported once a client is needed
+        import boto3
+        from botocore.config import Config
+
+        config = Config(
+            max_pool_connections=max(MIN_POOL_CONNECTIONS, self.concurrency + POOL_HEADROOM),
+            retries={'mode': RETRY_MODE, 'max_attempts': RETRY_MAX_ATTEMPTS},
+        )
+        session = boto3.Session(profile_name=target.profile) if target.profile else boto3
+        return session.client(service, region_name=target.region, config=config)
+
+
+CLIENTS = ClientPool()
+
+
+def get_client(service):
+    """Returns the shared client of an AWS service for the target of the calling thread"""
+    return CLIENTS.get(service)
+
+
+def get_target():
+    return CLIENTS.get_target()
+
+
 class LambdaStates:
     """This class contains constant states of a lambda function"""
     PENDING = 'Pending'
     IN_PROGRESS = 'InProgress'
+    FAILED = 'Failed'
+
+
+class DeployWaitError(Exception):
+    """Raised when a lambda fails or times out while we wait for it"""
+
+
+class WaitRequest:
+    """A lambda that a deploy stage is waiting on"""
+
+    def __init__(self, function_name, deadline):
+        self.function_name = function_name
+        self.target = get_target()
+        self.label = TELEMETRY.get_context()[0] or function_name
+        self.deadline = deadline
+        self.attempt = 0
+        self.next_poll = time.time()
+        self.done = threading.Event()
+        self.error = None
+        self.configuration = None
+
+
+class LambdaWaiter:
+    """
+    Waits for lambdas to leave the Pending and InProgress states. A single
+    poller thread polls all the lambdas that are waited on in rounds, every
+    lambda backs off exponentially with jitter until it is ready, failed
+    or its deadline has passed
+    """
+
+    def __init__(self, client=None, base_delay=WAIT_BASE_DELAY, max_delay=WAIT_MAX_DELAY):
+        self.client = client
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = []
+        self.condition = threading.Condition()
+        self.poller = None
+
+    def wait(self, function_name, timeout=WAIT_TIMEOUT):
+        """Blocks until the lambda is ready and returns its configuration"""
+        request = WaitRequest(function_name, time.time() + timeout)
+        with self.condition:
+            self.requests.append(request)
+            if self.poller is None:
+                self.poller = threading.Thread(target=self.poll, daemon=True)
+                self.poller.start()
+            self.condition.notify()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.configuration
+
+    def poll(self):
+        while True:
+            with self.condition:
+                self.requests = [request for request in self.requests if not request.done.is_set()]
+                if not self.requests:
+                    self.poller = None
+                    return
+                delay = min(request.next_poll for request in self.requests) - time.time()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                now = time.time()
+                due = [request for request in self.requests if request.next_poll <= now]
+
+            for request in due:
+                TELEMETRY.set_context(request.label, 'wait')
+                try:
+                    with CLIENTS.use(request.target):
+                        self.poll_request(request)
+                except Exception as error:
+                    self.finish(request, error)
+
+    def poll_request(self, request):
+        try:
+            client = self.client or get_client('lambda')
+            response = client.get_function_configuration(
+                FunctionName=request.function_name,
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] in THROTTLING_ERRORS:
+                self.schedule(request)
+                return
+            raise
+
+        if response.get('State') == LambdaStates.FAILED:
+            self.finish(request, DeployWaitError(
+                f"{request.function_name} is in Failed state: {response.get('StateReason')}"))
+        elif response.get('LastUpdateStatus') == LambdaStates.FAILED:
+            self.finish(request, DeployWaitError(
+                f"{request.function_name} update failed: {response.get('LastUpdateStatusReason')}"))
+        elif response.get('State') == LambdaStates.PENDING or \
+                response.get('LastUpdateStatus') == LambdaStates.IN_PROGRESS:
+            self.schedule(request)
+        else:
+            request.configuration = response
+            request.done.set()
+
+    def schedule(self, request):
+        """Schedules the next poll of a lambda that is not ready yet"""
+        if time.time() >= request.deadline:
+            self.finish(request, DeployWaitError(
+                f"Timed out waiting for {request.function_name} to become ready"))
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** request.attempt)
+        request.next_poll = min(request.deadline, time.time() + random.uniform(delay / 2, delay))
+        request.attempt += 1
+
+    def finish(self, request, error):
+        request.error = error
+        request.done.set()
+
+
+WAITER = LambdaWaiter()
+
+
+class ApiResourceIndex:
+    """
+    Resources of a rest api keyed by path, listed once with full pagination
+    and updated in place when resources are created
+    """
+
+    def __init__(self, client, api_gateway_id):
+        self.client = client
+        self.api_gateway_id = api_gateway_id
+        self.resources = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.resources is None:
+                resources = {}
+                paginator = self.client.get_paginator('get_resources')
+                for page in paginator.paginate(restApiId=self.api_gateway_id,
+                                               PaginationConfig={'PageSize': 500}):
+                    for item in page['items']:
+                        resources[item['path']] = item
+                self.resources = resources
+        return self.resources
+
+    def get(self, path):
+        return self.load().get(path)
+
+    def add(self, resource):
+        self.load()
+        with self.lock:
+            self.resources[resource['path']] = resource
+
+    def reset(self):
+        """Drops the listed resources, they are listed again on the next use"""
+        with self.lock:
+            self.resources = None
+
+
+def get_cors_headers(method_type):
+    """Returns the CORS response headers of a method, the preflight answers all of them"""
+    if method_type == 'OPTIONS':
+        return API_CORS_HEADERS
+    return {'Access-Control-Allow-Origin': API_CORS_HEADERS['Access-Control-Allow-Origin']}
+
+
+def get_api_method_definition(integration, headers):
+    """
+    Returns the swagger definition of a method that answers 200 with the
+    given response headers, integration is its x-amazon-apigateway-integration
+    without the responses
+    """
+    return {
+        'produces': ['application/json'],
+        'responses': {
+            '200': {
+                'description': '200 response',
+                'schema': {'$ref': '#/definitions/Empty'},
+                'headers': {name: {'type': 'string'} for name in headers},
+            },
+        },
+        'x-amazon-apigateway-integration': dict(integration, responses={
+            'default': {
+                'statusCode': '200',
+                'responseParameters': {f"method.response.header.{name}": value
+                                       for name, value in headers.items()},
+                'responseTemplates': {'application/json': ''},
+            },
+        }),
+    }
 
 
 class ApiGateway:
@@ -23,29 +578,43 @@ class ApiGateway:
     to deploy the api resource with a lambda function
     """
 
-    CLIENT = boto3.client('apigateway')
+    # one resource index per rest api, shared by every function of a deploy
+    RESOURCE_INDEXES = {}
+    INDEX_LOCK = threading.Lock()
 
     def __init__(self, api_gateway_id):
         self.api_gateway_id = api_gateway_id
+        self.target = get_target()
+        index_key = (self.target, api_gateway_id)
+        with self.INDEX_LOCK:
+            if index_key not in self.RESOURCE_INDEXES:
+                self.RESOURCE_INDEXES[index_key] = ApiResourceIndex(self.client, api_gateway_id)
+            self.resource_index = self.RESOURCE_INDEXES[index_key]
+
+    @property
+    def client(self):
+        return get_client('apigateway')
 
     def create_api_resource(self, path_part):
         """This function will create the api resource with function name"""
         parent_id = self.get_parent_resource_id()
-        self.CLIENT.create_resource(
+        resource = self.client.create_resource(
             restApiId=self.api_gateway_id,
             parentId= parent_id,
             pathPart=path_part
         )
+        self.resource_index.add(resource)
+
+    def get_resource_id(self, resource_name):
+        """Returns the id of the resource with the function name"""
+        resource = self.resource_index.get('/' + resource_name)
+        return resource['id'] if resource else None
 
     def create_resource_method(self, resource_name, method_type):
         """This function will create resource method request"""
-        response = self.get_api_resource()
-        resource_id = None
-        for resource in response['items']:
-            if resource['path'] == ('/' + resource_name):
-                resource_id = resource['id']
+        resource_id = self.get_resource_id(resource_name)
 
-        self.CLIENT.put_method(
+        self.client.put_method(
             restApiId=self.api_gateway_id,
             resourceId=resource_id,
             httpMethod=method_type,
@@ -54,15 +623,10 @@ class ApiGateway:
 
     def create_method_integration(self, resource_name, method_type):
         """This function will create resource integration request"""
-        response = self.get_api_resource()
-        
-        resource_id = None
-        for resource in response['items']:
-            if resource['path'] == ('/' + resource_name):
-                resource_id = resource['id']
+        resource_id = self.get_resource_id(resource_name)
 
         if method_type == 'OPTIONS':
-            self.CLIENT.put_integration(
+            self.client.put_integration(
                 restApiId=self.api_gateway_id,
                 resourceId=resource_id,
                 httpMethod='OPTIONS',
@@ -72,8 +636,8 @@ class ApiGateway:
                 }
             )
         else:
-            lambda_uri = f"arn:aws:apigateway:us-west-2:lambda:path/2015-03-31/functions/arn:aws:lambda:us-west-2:384060451980:function:{resource_name}:${{stageVariables.lambdaAlias}}/invocations"
-            self.CLIENT.put_integration(
+            lambda_uri = self.target.get_lambda_uri(resource_name, '${stageVariables.lambdaAlias}')
+            self.client.put_integration(
                 restApiId=self.api_gateway_id,
                 resourceId=resource_id,
                 httpMethod=method_type,
@@ -84,119 +648,117 @@ class ApiGateway:
 
     def create_method_response(self, resource_name, method_type):
         """This function will create resource method response"""
-        response = self.get_api_resource()
-        
-        resource_id = None
-        for resource in response['items']:
-            if resource['path'] == ('/' + resource_name):
-                resource_id = resource['id']
+        resource_id = self.get_resource_id(resource_name)
 
-        if method_type == 'OPTIONS':
-            self.CLIENT.put_method_response(
-                restApiId=self.api_gateway_id,
-                resourceId=resource_id,
-                httpMethod=method_type,
-                statusCode='200',
-                responseParameters={
-                    'method.response.header.Access-Control-Allow-Headers': False,
-                    'method.response.header.Access-Control-Allow-Origin': False,
-                    'method.response.header.Access-Control-Allow-Methods': False
-                },
-                responseModels={
-                    'application/json': 'Empty'
-                }
-            )
-        else:
-            self.CLIENT.put_method_response(
-                restApiId=self.api_gateway_id,
-                resourceId=resource_id,
-                httpMethod=method_type,
-                statusCode='200',
-                responseParameters={
-                    'method.response.header.Access-Control-Allow-Origin': False
-                },
-                responseModels={
-                    'application/json': 'Empty'
-                }
-            )
+        self.client.put_method_response(
+            restApiId=self.api_gateway_id,
+            resourceId=resource_id,
+            httpMethod=method_type,
+            statusCode='200',
+            responseParameters={f"method.response.header.{name}": False
+                                for name in get_cors_headers(method_type)},
+            responseModels={
+                'application/json': 'Empty'
+            }
+        )
 
     def create_integration_response(self, resource_name, method_type):
         """This function will create resource integration request"""
-        response = self.get_api_resource()
-        
-        resource_id = None
-        for resource in response['items']:
-            if resource['path'] == ('/' + resource_name):
-                resource_id = resource['id']
+        resource_id = self.get_resource_id(resource_name)
 
-        if method_type == 'OPTIONS':
-            self.CLIENT.put_integration_response(
-                restApiId=self.api_gateway_id,
-                resourceId=resource_id,
-                httpMethod=method_type,
-                statusCode='200',
-                responseParameters={
-                    'method.response.header.Access-Control-Allow-Headers': '\'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token\'',
-                    'method.response.header.Access-Control-Allow-Methods': '\'POST,OPTIONS\'',
-                    'method.response.header.Access-Control-Allow-Origin': '\'*\''
-                },
-                responseTemplates={
-                    'application/json': ''
-                }
-            )
-        else:
-            self.CLIENT.put_integration_response(
-                restApiId=self.api_gateway_id,
-                resourceId=resource_id,
-                httpMethod=method_type,
-                statusCode='200',
-                responseParameters={
-                    'method.response.header.Access-Control-Allow-Origin': '\'*\''
-                },
-                responseTemplates={
-                    'application/json': ''
-                }
-            )
+        self.client.put_integration_response(
+            restApiId=self.api_gateway_id,
+            resourceId=resource_id,
+            httpMethod=method_type,
+            statusCode='200',
+            responseParameters={f"method.response.header.{name}": value
+                                for name, value in get_cors_headers(method_type).items()},
+            responseTemplates={
+                'application/json': ''
+            }
+        )
 
     def set_api_gateway_permissions(self, lambda_name, env):
         """This function is resposible for the permissions of api gateway"""
-        client = boto3.client('lambda')
-        client.add_permission(
-            FunctionName= f"arn:aws:lambda:us-west-2:384060451980:function:{lambda_name}:{env}",
-            SourceArn= f"arn:aws:execute-api:us-west-2:384060451980:{self.api_gateway_id}/*/POST/{lambda_name}",
+        get_client('lambda').add_permission(
+            FunctionName= self.target.get_function_arn(lambda_name, env),
+            SourceArn= self.target.get_execute_api_arn(self.api_gateway_id, f"*/POST/{lambda_name}"),
             Principal= "apigateway.amazonaws.com",
-            StatementId = "13e9d442-455f-4f17-9b73-616d9cbee339",
+            StatementId = API_PERMISSION_STATEMENT_ID,
             Action= "lambda:InvokeFunction"
         )
+
+    def has_permission(self, policy_index):
+        """Checks if api gateway can already invoke the alias the policy index was loaded from"""
+        return policy_index.has_statement(API_PERMISSION_STATEMENT_ID)
         
     def get_parent_resource_id(self):
         """This function will get the resource parent id and return it"""
-        parent_id = None
-        response = self.get_api_resource()
-        resources = response["items"]
-        for item in resources:
-            if item['path'] == '/':
-                parent_id = item['id']
-        return parent_id
+        parent = self.resource_index.get('/')
+        return parent['id'] if parent else None
 
     def check_api_existence(self, lambda_name):
         """this function will check if resource already exists"""
-        response = self.get_api_resource()
-        resources = response["items"]
-        for item in resources:
-            if 'pathPart' in item and item['pathPart'] == lambda_name:
-                return True
-        return False
+        return self.resource_index.get('/' + lambda_name) is not None
 
-    def get_api_resource(self):
-        response = self.CLIENT.get_resources(
-            restApiId= self.api_gateway_id,
-            limit=500,
-        )
-        return response
+    def get_stage_summary(self, stage_name):
+        """
+        Returns the methods of every path in the deployment a stage serves,
+        None when the api was never deployed to the stage
+        """
+        try:
+            stage = self.client.get_stage(restApiId=self.api_gateway_id, stageName=stage_name)
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'NotFoundException':
+                return None
+            raise
+        deployment = self.client.get_deployment(restApiId=self.api_gateway_id,
+                                                deploymentId=stage['deploymentId'],
+                                                embed=['apisummary'])
+        return deployment.get('apiSummary', {})
+
+    def is_resource_deployed(self, stage_summary, lambda_name):
+        """Checks if the stage serves the methods of the lambda resource"""
+        methods = (stage_summary or {}).get('/' + lambda_name, {})
+        return all(method in methods for method in ['POST', 'OPTIONS'])
     
+    def get_api_definition(self, api_name, resource_names):
+        """
+        Returns the swagger document of the resources with the POST and CORS
+        OPTIONS methods that create_api_resource and the put methods give
+        a single resource
+        """
+        paths = {}
+        for resource_name in resource_names:
+            lambda_uri = self.target.get_lambda_uri(resource_name, '${stageVariables.lambdaAlias}')
+            post_integration = {'type': 'aws', 'httpMethod': 'POST', 'uri': lambda_uri,
+                                'passthroughBehavior': 'when_no_match'}
+            options_integration = {'type': 'mock', 'passthroughBehavior': 'when_no_match',
+                                   'requestTemplates': {'application/json': '{"statusCode": 200}'}}
+            paths['/' + resource_name] = {
+                'post': get_api_method_definition(post_integration, get_cors_headers('POST')),
+                'options': get_api_method_definition(options_integration, get_cors_headers('OPTIONS')),
+            }
+        return {
+            'swagger': '2.0',
+            'info': {'title': api_name, 'version': '1.0'},
+            'paths': paths,
+            'definitions': {'Empty': {'type': 'object', 'title': 'Empty Schema'}},
+        }
+
+    def merge_api_definition(self, resource_names):
+        """
+        Adds the resources and their methods to the rest api with a single
+        put_rest_api merge, the other resources of the api are kept
+        """
+        api_name = self.client.get_rest_api(restApiId=self.api_gateway_id)['name']
+        definition = self.get_api_definition(api_name, resource_names)
+        self.client.put_rest_api(restApiId=self.api_gateway_id, mode='merge',
+                                 body=json.dumps(definition).encode())
+        self.resource_index.reset()
+
     def deploy_api(self, stage_name):
-        response = self.CLIENT.create_deployment(
+        response = self.client.create_deployment(
                 restApiId=self.api_gateway_id, 
                 stageName=stage_name
         )
@@ -209,45 +771,38 @@ class LambdaCloudWatchLogs:
     LambdaLogger function, which will send an email in case of any failure in 
     the lambda
     """
-    LOG_CLIENT = boto3.client('logs')
-    
     def __init__(self, function_name):
         self.function_name = function_name
+        self.target = get_target()
+        self.failure_lambda_arn = self.target.get_function_arn(LAMBDA_FAILURE_LAMBDA)
+
+    @property
+    def log_client(self):
+        return get_client('logs')
     
-    def is_permission_added(self):
-        function_name = '/aws/lambda/' + self.function_name
-        try:
-            res = CLIENT.get_policy(
-                FunctionName= LAMBDA_FAILURE_LAMBDA_ARN
-            )
-        except ClientError as error:
-            if (error.response['Error']['Code'] == 'ResourceNotFoundException'):
-                return False
-        policy = res['Policy']
-        permissions = json.loads(policy)['Statement']
-        for permission in permissions:
-            sourceArn = permission['Condition']['ArnLike']['AWS:SourceArn']
-            if function_name in sourceArn.split(':'):
-                return True
-        return False
+    def get_source_arn(self):
+        return self.target.get_log_group_arn('/aws/lambda/' + self.function_name + ':*')
+
+    def has_permission(self, policy_index):
+        return policy_index.allows(self.get_source_arn())
     
     def add_permission(self):
-        res = CLIENT.add_permission(
-            FunctionName= LAMBDA_FAILURE_LAMBDA_ARN,
-            StatementId= 'lambda-' + str(uuid.uuid4()),
-            Action='lambda:InvokeFunction',
-            Principal= 'logs.us-west-2.amazonaws.com',
-            SourceArn= 'arn:aws:logs:us-west-2:384060451980:log-group:/aws/lambda/'
-            + self.function_name +':*',
-        )
+        add_log_permission(self.failure_lambda_arn, 'logs-' + self.function_name,
+                           self.get_source_arn())
         
+    def get_subscription_filter(self):
+        return {
+            'logGroupName': '/aws/lambda/' + self.function_name,
+            'filterName': self.function_name + '-Log-Trigger',
+            'filterPattern': "?ERROR ?\"Task timed out\"",
+            'destinationArn': self.failure_lambda_arn,
+        }
+
+    def is_subscription_filter_added(self):
+        return is_subscription_filter_added(self.log_client, self.get_subscription_filter())
+
     def add_subscription_filter(self, version_num):
-        res = self.LOG_CLIENT.put_subscription_filter(
-        logGroupName= '/aws/lambda/' + self.function_name,
-        filterName= self.function_name + '-Log-Trigger',
-        filterPattern= "?ERROR ?\"Task timed out\"",
-        destinationArn= LAMBDA_FAILURE_LAMBDA_ARN,
-        )
+        self.log_client.put_subscription_filter(**self.get_subscription_filter())
     
 class APICloudWatchLogs:
     """
@@ -255,100 +810,352 @@ class APICloudWatchLogs:
     apiGatewayfailure function, which will send an email in case of any failure in 
     the api gateway
     """
-    LAMBDA_CLIENT = boto3.client('lambda')
-    LOG_CLIENT = boto3.client('logs')
-    
     def __init__(self, apigateway_id):
         self.apigateway_id = apigateway_id
+        self.target = get_target()
+        self.failure_lambda_arn = self.target.get_function_arn(API_FAILURE_LAMBDA)
+
+    @property
+    def log_client(self):
+        return get_client('logs')
     
-    def is_permission_added(self):
-        try:
-            res = CLIENT.get_policy(
-                FunctionName= API_FAILURE_LAMBDA_ARN
-            )
-        except ClientError as error:
-            if (error.response['Error']['Code'] == 'ResourceNotFoundException'):
-                return False
-        policy = res['Policy']
-        permissions = json.loads(policy)['Statement']
-        for permission in permissions:
-            sourceArn = permission['Condition']['ArnLike']['AWS:SourceArn']
-            if self.apigateway_id in sourceArn:
-                return True
-        return False
+    def get_source_arn(self):
+        return self.target.get_log_group_arn(
+            'API-Gateway-Execution-Logs_' + self.apigateway_id + '/production:*')
+
+    def has_permission(self, policy_index):
+        return policy_index.allows(self.get_source_arn())
     
     def add_permission(self):
-        CLIENT.add_permission(
-            FunctionName= API_FAILURE_LAMBDA_ARN,
-            StatementId= 'lambda-' + str(uuid.uuid4()),
-            Action='lambda:InvokeFunction',
-            Principal= 'logs.us-west-2.amazonaws.com',
-            SourceArn= 'arn:aws:logs:us-west-2:384060451980:log-group:API-Gateway-Execution-Logs_'
-             + self.apigateway_id + '/production:*'
-        )
+        add_log_permission(self.failure_lambda_arn, 'logs-api-' + self.apigateway_id,
+                           self.get_source_arn())
         
+    def get_subscription_filter(self):
+        return {
+            'logGroupName': 'API-Gateway-Execution-Logs_' + self.apigateway_id + '/production',
+            'filterName': self.apigateway_id + '-Api-Trigger',
+            'filterPattern': "",
+            'destinationArn': self.failure_lambda_arn,
+        }
+
+    def is_subscription_filter_added(self):
+        return is_subscription_filter_added(self.log_client, self.get_subscription_filter())
+
     def add_subscription_filter(self):
-        res = self.LOG_CLIENT.put_subscription_filter(
-        logGroupName= 'API-Gateway-Execution-Logs_'+ self.apigateway_id +'/production',
-        filterName=  self.apigateway_id + '-Api-Trigger',
-        filterPattern= "",
-        destinationArn= API_FAILURE_LAMBDA_ARN,
+        self.log_client.put_subscription_filter(**self.get_subscription_filter())
+
+
+def get_policy_statements(function_name, qualifier=None):
+    """Returns the statements of the resource policy of a lambda"""
+    params = {'FunctionName': function_name}
+    if qualifier:
+        params['Qualifier'] = qualifier
+    try:
+        response = get_client('lambda').get_policy(**params)
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ResourceNotFoundException':
+            return []
+        raise
+    return json.loads(response['Policy'])['Statement']
+
+
+def get_source_arn(permission):
+    return permission.get('Condition', {}).get('ArnLike', {}).get('AWS:SourceArn', '')
+
+
+class PolicyIndex:
+    """
+    Statements of a lambda resource policy keyed by their source arn, wildcard
+    source arns are kept apart so a check only matches against them
+    """
+
+    def __init__(self, statements):
+        self.statements = statements
+        self.source_arns = {}
+        for statement in statements:
+            self.source_arns.setdefault(get_source_arn(statement), []).append(statement)
+        # every log group arn ends with :* for its log streams
+        self.wildcards = [source_arn for source_arn in self.source_arns
+                          if '*' in source_arn.removesuffix(':*')]
+
+    @classmethod
+    def load(cls, function_name, qualifier=None):
+        return cls(get_policy_statements(function_name, qualifier))
+
+    def allows(self, source_arn):
+        return source_arn in self.source_arns or \
+            any(fnmatch.fnmatchcase(source_arn, wildcard) for wildcard in self.wildcards)
+
+    def has_statement(self, statement_id):
+        return any(statement.get('Sid') == statement_id for statement in self.statements)
+
+
+def add_log_permission(function_arn, statement_id, source_arn):
+    """
+    Allows cloudwatch logs to invoke a failure lambda, the statement id is
+    derived from the source so a permission is never added twice
+    """
+    try:
+        get_client('lambda').add_permission(
+            FunctionName=function_arn,
+            StatementId=statement_id,
+            Action='lambda:InvokeFunction',
+            Principal=get_target().logs_principal,
+            SourceArn=source_arn,
         )
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'ResourceConflictException':
+            raise
+
+
+def compact_failure_policy(function_name, apply=True):
+    """
+    Replaces the per function statements of a failure lambda of the current
+    target that its wildcard statement covers with that single statement
+    """
+    target = get_target()
+    function_arn = target.get_function_arn(function_name)
+    statement_id, log_group_pattern = FAILURE_POLICY_WILDCARDS[function_name]
+    wildcard_arn = target.get_log_group_arn(log_group_pattern)
+    policy_index = PolicyIndex.load(function_arn)
+    covered = [statement for statement in policy_index.statements
+               if statement.get('Sid') != statement_id
+               and statement.get('Principal', {}).get('Service') == target.logs_principal
+               and fnmatch.fnmatchcase(get_source_arn(statement), wildcard_arn)]
+    print(f"{function_arn}: {len(policy_index.statements)} statements, "
+          + f"{len(covered)} covered by {wildcard_arn}")
+    if not apply or not covered:
+        return
+
+    # the wildcard is added first so logs can invoke the lambda throughout
+    if not policy_index.has_statement(statement_id):
+        add_log_permission(function_arn, statement_id, wildcard_arn)
+    for statement in covered:
+        get_client('lambda').remove_permission(
+            FunctionName=function_arn,
+            StatementId=statement['Sid'],
+        )
+    print(f"{function_arn}: compacted to {len(policy_index.statements) - len(covered) + 1} statements")
+
+
+def compact_failure_policies(targets, apply=True):
+    for target in targets:
+        with CLIENTS.use(target):
+            for function_name in FAILURE_POLICY_WILDCARDS:
+                compact_failure_policy(function_name, apply)
+
+
+def is_subscription_filter_added(log_client, subscription_filter):
+    """Checks if the log group already has the same subscription filter"""
+    try:
+        response = log_client.describe_subscription_filters(
+            logGroupName=subscription_filter['logGroupName'],
+            filterNamePrefix=subscription_filter['filterName'],
+        )
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ResourceNotFoundException':
+            return False
+        raise
+    for item in response.get('subscriptionFilters', []):
+        if all(item.get(key) == value for key, value in subscription_filter.items()):
+            return True
+    return False
+
         
+class ConfigurationError(Exception):
+    """Raised when a lambda in the configuration file is invalid"""
+
+
+class LambdaConfig:
+    """Validated configuration of a single lambda for one environment and target"""
+
+    def __init__(self, name, data, target=None):
+        self.name = name
+        self.target = target or DEFAULT_TARGET
+        self.function_arn = data['FunctionArn']
+        self.runtime = data['Runtime']
+        self.role = data['Role']
+        self.timeout = data['Timeout']
+        self.memory_size = data['MemorySize']
+        self.configured_layers = data.get('layers') or []
+        self.layers = list(self.configured_layers)
+        self.shared_layers = data.get('shared_layers') or []
+        self.api_id = data.get('ApiId') or ''
+        self.logs = bool(data.get('logs'))
+        self.warmup_payloads = data.get('warmup_payloads') or []
+        self.provisioned_concurrency = data.get('provisioned_concurrency')
+        self.targets = data.get('targets') or []
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+    def with_shared_layers(self, layer_arns):
+        """Returns a copy with the arns of its shared layers attached after the configured ones"""
+        lambda_data = LambdaConfig(self.name, self.data, self.target)
+        lambda_data.layers = self.configured_layers + list(layer_arns)
+        return lambda_data
+
+    def get_target_configs(self):
+        """Returns the configuration of the lambda in each of its targets"""
+        if not self.targets:
+            return [self]
+        target_configs = []
+        for target_data in self.targets:
+            data = dict(self.data)
+            data.update({key: value for key, value in target_data.items() if key not in TARGET_SCHEMA})
+            target = DeployTarget(target_data['region'], target_data['account'],
+                                  target_data.get('profile'))
+            target_configs.append(LambdaConfig(self.name, data, target))
+        return target_configs
+
+
+def get_schema_errors(data, schema):
+    """Returns the missing fields and the fields of the wrong type"""
+    errors = []
+    for field, (field_type, required) in schema.items():
+        if field not in data:
+            if required:
+                errors.append(f"{field} is missing")
+            continue
+        value = data[field]
+        if not isinstance(value, field_type) or (field_type is int and isinstance(value, bool)):
+            errors.append(f"{field} should be of type {field_type.__name__}")
+    return errors
+
+
+def validate_lambda_config(data):
+    """Returns the schema errors of a lambda configuration"""
+    errors = get_schema_errors(data, CONFIGURATION_SCHEMA)
+    if not errors:
+        if not 1 <= data['Timeout'] <= 900:
+            errors.append("Timeout should be between 1 and 900 seconds")
+        if not 128 <= data['MemorySize'] <= 10240:
+            errors.append("MemorySize should be between 128 and 10240 MB")
+        if not all(isinstance(layer, str) for layer in data.get('layers', [])):
+            errors.append("layers should be a list of layer arns")
+        if not all(isinstance(layer, str) for layer in data.get('shared_layers', [])):
+            errors.append("shared_layers should be a list of layer names")
+        elif len(data.get('layers', [])) + len(data.get('shared_layers', [])) > MAX_LAYERS:
+            errors.append(f"a lambda can have at most {MAX_LAYERS} layers")
+        if not all(isinstance(payload, (dict, str)) for payload in data.get('warmup_payloads', [])):
+            errors.append("warmup_payloads should be a list of events or json file names")
+        if data.get('provisioned_concurrency', 1) < 1:
+            errors.append("provisioned_concurrency should be at least 1")
+        errors.extend(validate_targets(data))
+    return errors
+
+
+def validate_targets(data):
+    """Returns the errors of the targets of a lambda and of its configuration in each of them"""
+    errors = []
+    regions = set()
+    for target_data in data.get('targets', []):
+        if not isinstance(target_data, dict):
+            errors.append("targets should be a list of objects")
+            continue
+        target_errors = get_schema_errors(target_data, TARGET_SCHEMA)
+        overrides = {key: value for key, value in target_data.items() if key not in TARGET_SCHEMA}
+        unknown = [key for key in overrides
+                   if key not in CONFIGURATION_SCHEMA or key in ('targets', 'environments')]
+        if unknown:
+            target_errors.append("unknown fields " + ', '.join(unknown))
+        if not target_errors:
+            if target_data['region'] in regions:
+                target_errors.append("region is listed twice")
+            regions.add(target_data['region'])
+            target_config = {key: value for key, value in data.items() if key != 'targets'}
+            target_errors.extend(validate_lambda_config(dict(target_config, **overrides)))
+        errors.extend(f"target {target_data.get('region')}: {error}" for error in target_errors)
+    if data.get('targets') and data['FunctionArn'].startswith('arn:'):
+        errors.append("FunctionArn should be a function name when targets are listed")
+    return errors
+
+
+class ConfigurationStore:
+    """
+    The configuration file loaded and validated once, every lambda gets the
+    overlay of the deploy environment from its environments field applied
+    """
+
+    def __init__(self, env, file_name=CONFIGURATION_FILE):
+        with open(file_name, 'r', encoding='UTF-8') as file_obj:
+            lambdas_data = json.load(file_obj)
+
+        self.lambdas = {}
+        self.errors = {}
+        for name, data in lambdas_data.items():
+            if not isinstance(data, dict):
+                self.errors[name] = ["configuration should be an object"]
+                continue
+            config = {key: value for key, value in data.items() if key != 'environments'}
+            overlay = data.get('environments', {})
+            if isinstance(overlay, dict):
+                config.update(overlay.get(env, {}))
+            errors = validate_lambda_config(dict(config, environments=overlay))
+            if errors:
+                self.errors[name] = errors
+            else:
+                self.lambdas[name] = LambdaConfig(name, config)
+
+    def get_targets(self):
+        """Returns every target of the valid lambdas"""
+        targets = []
+        for lambda_data in self.lambdas.values():
+            for target_config in lambda_data.get_target_configs():
+                if target_config.target not in targets:
+                    targets.append(target_config.target)
+        return targets
+
+    def get(self, name):
+        """Returns the configuration of a lambda, None if it is not in the file"""
+        if name in self.errors:
+            raise ConfigurationError(f"{name}: " + ', '.join(self.errors[name]))
+        return self.lambdas.get(name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_configuration(env):
+    """Returns the configuration store of the env, it is loaded once per run"""
+    return ConfigurationStore(env)
+
+
 def display_lambda_data(lambda_data, func_name, env, description):
     """This function will display the details of a lambda function"""
     print("Lambda function details:\nFunction Name: " + func_name +
           "\nEnvironment: " + env + "\nDescription: " + description)
-    pprint(lambda_data)
+    pprint(lambda_data.to_dict())
     print("---------------------------------------------------")
 
-def retain_original_code(func_name):
-    """
-    As we change the code while deploying so we also need to revert it back on
-    our local machine after we have deployed it on aws, this function will do
-    that
-    """
-    file_obj = open(f"{func_name}-temp.py", "r", encoding='UTF-8')
-    code_list = file_obj.readlines()
-
-    with open(func_name + ".py", "w", encoding='UTF-8') as write_file:
-        write_file.writelines(code_list)
-
-    write_file.close()
-
 def display_json_lambda_data(lambdas_data, env):
     """
     this function will display the data of all lambdas when we will
     use json file for the lambdas deployment
     """
     for data in lambdas_data:
-        lambda_data = get_lambda_data(data.get('name'))
+        lambda_data = get_lambda_data(data.get('name'), env)
         display_lambda_data(lambda_data, data.get('name'), env,
                             data.get('description'))
 
 
 def update_lambda_configuration(lambda_data):
-    CLIENT.update_function_configuration(
-        FunctionName=lambda_data.get('FunctionArn'),
-        Handler= "lambda_function.lambda_handler",
-        Runtime=lambda_data.get('Runtime'),
-        Role=lambda_data.get('Role'),
-        Timeout=lambda_data.get('Timeout'),
-        MemorySize=lambda_data.get('MemorySize'),
+    get_client('lambda').update_function_configuration(
+        FunctionName=lambda_data.function_arn,
+        Handler= LAMBDA_HANDLER,
+        Runtime=lambda_data.runtime,
+        Role=lambda_data.role,
+        Timeout=lambda_data.timeout,
+        MemorySize=lambda_data.memory_size,
     )
 
-def change_env_in_code(function_name, env):
+def change_env_in_code(source, env):
     """
-    This function removes the env_constant import and change the env
-    to the provided env
+    This function removes the env_constant import from the source and
+    change the env to the provided env, the source file is not modified
     """
     env_statement = f"ENVIRONMENT = '{env}'\n"
-    file_obj = open(function_name + ".py", "r", encoding='UTF-8')
-    code_list = file_obj.readlines()
+    code_list = source.splitlines(keepends=True)
 
-    with open(function_name + "-temp.py", "w", encoding='UTF-8') as write_file:
-        write_file.writelines(code_list)
-    
     env_const_line = -1
     env_line = -1
     index = 0
@@ -367,230 +1174,1676 @@ def change_env_in_code(function_name, env):
     if env_const_line != -1:
         code_list.pop(env_const_line)
 
-    with open(function_name + ".py", "w", encoding='UTF-8') as write_file:
-        write_file.writelines(code_list)
+    return ''.join(code_list)
+
+def get_lambda_data(func_name, env):
+    """
+    Using this function we can get the data of our lambda store in
+    the configuration file for the env
+    """
+    return get_configuration(env).get(func_name)
+
+
+class LambdaBundle:
+    """The zip of a lambda function along with what went into it"""
+
+    def __init__(self, data, sources, external_modules, bytecode_note):
+        self.data = data
+        self.sources = sources
+        self.external_modules = external_modules
+        self.bytecode_note = bytecode_note
+        self.code_sha = get_code_sha256(data)
+
+    def get_report(self, import_times=None):
+        """Returns the size and import report lines of the bundle"""
+        source_size = sum(len(source.encode('UTF-8')) for source in self.sources.values())
+        files = ', '.join(f"{name} ({len(source.encode('UTF-8')) / 1024:.1f} KB)"
+                          for name, source in sorted(self.sources.items()))
+        lines = [f"Bundle {len(self.data) / 1024:.1f} KB zipped, {source_size / 1024:.1f} KB source: {files}",
+                 f"Bytecode: {self.bytecode_note}"]
+        if self.external_modules:
+            modules = []
+            for module in self.external_modules:
+                import_time = (import_times or {}).get(module)
+                modules.append(module if import_time is None else f"{module} ({import_time:.0f} ms import)")
+            lines.append("Imported from runtime/layers: " + ', '.join(modules))
+        return lines
+
+
+def find_local_module(module_name, base_dir):
+    """
+    Returns the files of a module and its parent packages when the module
+    is in the base dir, None otherwise
+    """
+    parts = module_name.split('.')
+    files = []
+    for index in range(1, len(parts)):
+        package_init = '/'.join(parts[:index]) + '/__init__.py'
+        if not os.path.isfile(os.path.join(base_dir, package_init)):
+            return None
+        files.append(package_init)
+
+    module_path = '/'.join(parts)
+    if os.path.isfile(os.path.join(base_dir, module_path + '.py')):
+        files.append(module_path + '.py')
+    elif os.path.isfile(os.path.join(base_dir, module_path, '__init__.py')):
+        files.append(module_path + '/__init__.py')
+    else:
+        return None
+    return files
 
 
-def get_lambda_bundle_as_zip(function_name):
+def get_imported_modules(source, file_name):
+    """
+    Returns the absolute names of the modules imported by a source file,
+    names imported from a module are also returned as they can be submodules
+    """
+    package = file_name.split('/')[:-1]
+    modules = []
+    for node in ast.walk(ast.parse(source, file_name)):
+        if isinstance(node, ast.Import):
+            modules.extend((alias.name, True) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module
+            if node.level:
+                parent = package[:len(package) - node.level + 1]
+                module = '.'.join(parent + ([node.module] if node.module else []))
+            if module:
+                modules.append((module, True))
+            modules.extend((f"{module}.{alias.name}" if module else alias.name, False)
+                           for alias in node.names)
+    return modules
+
+
+def is_layer_module(module_name, layer_modules):
+    return any(module_name == name or module_name.startswith(name + '.') for name in layer_modules)
+
+
+def collect_lambda_sources(function_name, env, base_dir='.', layer_modules=()):
     """
-    it will create a zip file of the lambda function and return that in
-    bytes
+    Walks the imports of the lambda and returns the sources of the local
+    modules it needs with the env applied, along with the top level names
+    of the non standard modules that have to come from the runtime or layers.
+    The local modules of its shared layers are left out of the sources
     """
-    create_lambda_bundle(function_name)
-    with open(function_name + '.zip', 'rb') as file_data:
-        lambda_code = file_data.read()
-    return lambda_code
+    sources = {}
+    external_modules = set()
+    queue = [(HANDLER_FILE, function_name + '.py')]
+    while queue:
+        file_name, path = queue.pop()
+        if file_name in sources:
+            continue
+        with open(os.path.join(base_dir, path), 'r', encoding='UTF-8') as file_obj:
+            sources[file_name] = change_env_in_code(file_obj.read(), env)
+
+        for module, is_module in get_imported_modules(sources[file_name], file_name):
+            if module.split('.')[0] == ENVIRONMENT_MODULE:
+                continue
+            if is_layer_module(module, layer_modules):
+                if is_module:
+                    external_modules.add(module.split('.')[0])
+                continue
+            local_files = find_local_module(module, base_dir)
+            if local_files:
+                queue.extend((local_file, local_file) for local_file in local_files)
+            elif is_module and module.split('.')[0] not in sys.stdlib_module_names:
+                external_modules.add(module.split('.')[0])
+    return sources, sorted(external_modules)
+
+
+def compile_bytecode(source, file_name):
+    """
+    Compiles a source to an unchecked hash based pyc, the runtime loads it
+    without looking at the source and the output only depends on the source
+    """
+    source_bytes = source.encode('UTF-8')
+    code = compile(source_bytes, file_name, 'exec', dont_inherit=True)
+    flags = (1).to_bytes(4, 'little')
+    return importlib.util.MAGIC_NUMBER + flags + importlib.util.source_hash(source_bytes) + marshal.dumps(code)
+
+
+def get_bytecode_file_name(file_name):
+    directory, base_name = os.path.split(file_name)
+    cache_name = f"__pycache__/{base_name[:-3]}.{sys.implementation.cache_tag}.pyc"
+    return f"{directory}/{cache_name}" if directory else cache_name
+
 
-def get_lambda_data(func_name):
+def add_bundle_entry(zip_obj, file_name, content):
+    zip_info = ZipInfo(file_name, date_time=BUNDLE_DATE_TIME)
+    zip_info.compress_type = ZIP_DEFLATED
+    zip_info.external_attr = 0o644 << 16
+    zip_obj.writestr(zip_info, content)
+
+
+def create_lambda_bundle(function_name, env, runtime=None, bytecode=False, layer_modules=()):
     """
-    Using this function we can get the data of our lambda store in
-    the configuration file
+    this function will create the zip of our lambda function and the local
+    modules it imports in memory with the env applied, entries are sorted
+    and have a fixed timestamp so the same sources always give the same bytes.
+    With bytecode the pyc files are added when the local python matches the
+    lambda runtime
+    """
+    sources, external_modules = collect_lambda_sources(function_name, env,
+                                                       layer_modules=layer_modules)
+
+    local_runtime = f"python{sys.version_info.major}.{sys.version_info.minor}"
+    bytecode_note = 'not requested'
+    if bytecode and runtime != local_runtime:
+        bytecode = False
+        bytecode_note = f"skipped, {runtime} needs a matching local python (found {local_runtime})"
+    elif bytecode:
+        bytecode_note = f"included for {sys.implementation.cache_tag}"
+
+    entries = dict(sources)
+    if bytecode:
+        for file_name, source in sources.items():
+            entries[get_bytecode_file_name(file_name)] = compile_bytecode(source, file_name)
+
+    buffer = io.BytesIO()
+    with ZipFile(buffer, 'w') as zip_obj:
+        for file_name in sorted(entries):
+            add_bundle_entry(zip_obj, file_name, entries[file_name])
+    return LambdaBundle(buffer.getvalue(), sources, external_modules, bytecode_note)
+
+
+@functools.lru_cache(maxsize=None)
+def measure_import_time(module_name):
+    """
+    Returns the import time of an installed module in ms using
+    python -X importtime, None if it can not be imported locally
     """
-    lambda_data = None
-    file_data = open(CONFIGURATION_FILE, 'r', encoding='UTF-8')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module_name}"],
+                            capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        return None
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module_name:
+            return int(fields[1]) / 1000
+    return None
+
+
+def get_code_sha256(bundle):
+    """Returns the hash of a bundle in the format lambda uses for CodeSha256"""
+    return base64.b64encode(hashlib.sha256(bundle).digest()).decode('UTF-8')
+
+
+class LayerBuildError(Exception):
+    """Raised when a shared layer can not be built"""
+
+
+def get_relative_path(path, base_dir):
+    return os.path.relpath(path, base_dir).replace(os.sep, '/')
+
+
+def get_module_files(module_name, base_dir='.'):
+    """Returns the files of a local module, with every file of the package for a package"""
+    files = find_local_module(module_name, base_dir)
+    if files and files[-1].endswith('/__init__.py'):
+        package_dir = os.path.join(base_dir, files[-1][:-len('/__init__.py')])
+        for directory, _, file_names in os.walk(package_dir):
+            files.extend(get_relative_path(os.path.join(directory, file_name), base_dir)
+                         for file_name in file_names if file_name.endswith('.py'))
+    return sorted(set(files)) if files else None
+
+
+class SharedLayer:
+    """A layer of the layers file, built from local modules and pinned requirements"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.modules = data.get('modules') or []
+        self.requirements = data.get('requirements') or []
+        self.runtimes = data['runtimes']
+
+    def get_sources(self, base_dir='.'):
+        """
+        Returns the sources of the layer modules and of the local modules they
+        import. A layer is shared by every env so its sources are shipped as
+        they are and can not import the environment module
+        """
+        queue = []
+        for module in self.modules:
+            files = get_module_files(module, base_dir)
+            if not files:
+                raise ConfigurationError(f"layer {self.name}: module {module} not found")
+            queue.extend(files)
+
+        sources = {}
+        while queue:
+            file_name = queue.pop()
+            if file_name in sources:
+                continue
+            with open(os.path.join(base_dir, file_name), 'r', encoding='UTF-8') as file_obj:
+                sources[file_name] = file_obj.read()
+            for module, _ in get_imported_modules(sources[file_name], file_name):
+                if module.split('.')[0] == ENVIRONMENT_MODULE:
+                    raise ConfigurationError(f"layer {self.name}: {file_name} imports the "
+                                             + f"{ENVIRONMENT_MODULE} module")
+                queue.extend(find_local_module(module, base_dir) or [])
+        return sources
+
+    def get_content_hash(self, sources):
+        """
+        Hashes what the layer is built from rather than the zip, so an
+        unchanged layer is recognized without installing its requirements
+        """
+        digest = hashlib.sha256()
+        for file_name in sorted(sources):
+            digest.update(f"{file_name}\0{sources[file_name]}\0".encode('UTF-8'))
+        digest.update(json.dumps([sorted(self.requirements), sorted(self.runtimes),
+                                  LAYER_PLATFORM]).encode('UTF-8'))
+        return digest.hexdigest()
+
+    def install_requirements(self, target_dir):
+        """Installs the lambda platform wheels of the requirements, picked for the first runtime"""
+        python_version = self.runtimes[0][len('python'):]
+        result = subprocess.run([sys.executable, '-m', 'pip', 'install', '--quiet', '--no-compile',
+                                 '--target', target_dir, '--platform', LAYER_PLATFORM,
+                                 '--implementation', 'cp', '--python-version', python_version,
+                                 '--only-binary=:all:'] + self.requirements,
+                                capture_output=True, text=True, check=False)
+        if result.returncode != 0:
+            raise LayerBuildError(f"pip could not install the requirements of {self.name}: "
+                                  + result.stderr.strip()[-500:])
+
+    def build(self, sources):
+        """
+        Returns the zip of the layer, everything goes under python/ where the
+        runtime looks for layer modules. Like the lambda bundles the entries
+        are sorted and have a fixed timestamp
+        """
+        entries = {'python/' + file_name: source for file_name, source in sources.items()}
+        with tempfile.TemporaryDirectory(prefix='layer_') as target_dir:
+            if self.requirements:
+                self.install_requirements(target_dir)
+            for directory, dir_names, file_names in os.walk(target_dir):
+                dir_names[:] = [dir_name for dir_name in dir_names if dir_name != '__pycache__']
+                for file_name in file_names:
+                    path = os.path.join(directory, file_name)
+                    with open(path, 'rb') as file_obj:
+                        entries['python/' + get_relative_path(path, target_dir)] = file_obj.read()
+
+        buffer = io.BytesIO()
+        with ZipFile(buffer, 'w') as zip_obj:
+            for file_name in sorted(entries):
+                add_bundle_entry(zip_obj, file_name, entries[file_name])
+        return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=None)
+def get_shared_layers(file_name=LAYERS_FILE):
+    """Returns the layers of the layers file by name, it is loaded once per run"""
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name, 'r', encoding='UTF-8') as file_obj:
+        layers_data = json.load(file_obj)
+
+    layers = {}
+    for name, data in layers_data.items():
+        errors = get_schema_errors(data, LAYER_SCHEMA) if isinstance(data, dict) \
+            else ["layer should be an object"]
+        if not errors:
+            if not data.get('modules') and not data.get('requirements'):
+                errors.append("modules or requirements are needed")
+            items = data.get('modules', []) + data.get('requirements', [])
+            if not all(isinstance(item, str) for item in items):
+                errors.append("modules and requirements should be lists of strings")
+            runtimes = data['runtimes']
+            if not runtimes or not all(isinstance(runtime, str) and runtime.startswith('python')
+                                       for runtime in runtimes):
+                errors.append("runtimes should be a list of python runtimes")
+        if errors:
+            raise ConfigurationError(f"layer {name}: " + ', '.join(errors))
+        layers[name] = SharedLayer(name, data)
+    return layers
+
+
+class LayerPlan:
+    """The published version of a shared layer in a target that matches its content, if any"""
+
+    def __init__(self, name, target=None):
+        self.name = name
+        self.target = target or DEFAULT_TARGET
+        self.label = f"layer {name}"
+        self.layer = None
+        self.sources = None
+        self.content_hash = None
+        self.arn = None
+        self.error = None
+
+    @property
+    def needs_publish(self):
+        return self.error is None and self.arn is None
+
+    def get_arn(self):
+        """The arn to attach, a placeholder until the new version is published"""
+        return self.arn or f"{self.name}:<new {(self.content_hash or '')[:12]}>"
+
+    def get_status(self):
+        if self.error:
+            return f"could not be planned, {self.error}"
+        if self.arn:
+            return f"up to date, {self.arn}"
+        return (f"publish new version, {len(self.sources)} local files, "
+                + f"{len(self.layer.requirements)} requirements, content {self.content_hash[:12]}")
+
+
+def find_layer_version(layer_name, content_hash):
+    """Returns the arn of the layer version built from the same content, None if there is none"""
+    params = {'LayerName': layer_name}
+    while True:
+        response = get_client('lambda').list_layer_versions(**params)
+        for version in response['LayerVersions']:
+            if version.get('Description') == LAYER_HASH_PREFIX + content_hash:
+                return version['LayerVersionArn']
+        if not response.get('NextMarker'):
+            return None
+        params['Marker'] = response['NextMarker']
+
+
+def plan_shared_layer(layer_plan, contents):
+    """contents keeps the sources and hash of every layer, they are the same in every target"""
+    try:
+        with TELEMETRY.stage(layer_plan.label, 'read_state', 'lambda'), CLIENTS.use(layer_plan.target):
+            if layer_plan.name not in contents:
+                layer = get_shared_layers().get(layer_plan.name)
+                if layer is None:
+                    raise ConfigurationError(f"layer {layer_plan.name} is not in {LAYERS_FILE}")
+                sources = layer.get_sources()
+                contents[layer_plan.name] = (layer, sources, layer.get_content_hash(sources))
+            layer_plan.layer, layer_plan.sources, layer_plan.content_hash = contents[layer_plan.name]
+            layer_plan.arn = find_layer_version(layer_plan.name, layer_plan.content_hash)
+    except Exception as error:
+        layer_plan.error = f"{type(error).__name__}: {error}"
+
+
+def plan_shared_layers(plans):
+    """
+    Plans the shared layers of the lambdas once per batch and target and
+    attaches them to the lambda configurations. A layer is only rebuilt and
+    published when no published version has its content hash, until then
+    the lambdas get a placeholder arn so the layer change shows up in their plan
+    """
+    layer_plans = {}
+    contents = {}
+    for plan in plans:
+        for name in plan.lambda_data.shared_layers:
+            if (name, plan.target) not in layer_plans:
+                layer_plan = LayerPlan(name, plan.target)
+                if plan.label != plan.function_name:
+                    layer_plan.label += f"@{plan.target.region}"
+                plan_shared_layer(layer_plan, contents)
+                layer_plans[(name, plan.target)] = layer_plan
+
+    for plan in plans:
+        plan.layer_plans = [layer_plans[(name, plan.target)] for name in plan.lambda_data.shared_layers]
+        failed = [layer_plan for layer_plan in plan.layer_plans if layer_plan.error]
+        if failed:
+            plan.error = f"shared layer {failed[0].name}: {failed[0].error}"
+            continue
+        plan.layer_modules = [module for layer_plan in plan.layer_plans
+                              for module in layer_plan.layer.modules]
+        plan.lambda_data = plan.lambda_data.with_shared_layers(
+            layer_plan.get_arn() for layer_plan in plan.layer_plans)
+
+
+def get_layer_plans(plans):
+    """Returns the shared layer plans of the lambda plans without duplicates"""
+    layer_plans = {}
+    for plan in plans:
+        for layer_plan in plan.layer_plans:
+            layer_plans.setdefault((layer_plan.name, layer_plan.target), layer_plan)
+    return list(layer_plans.values())
+
+
+def publish_shared_layer(layer_plan, builds):
+    """builds keeps the zip of every layer content, it is built once for all the targets"""
+    with TELEMETRY.stage(layer_plan.label, 'publish_layer', 'lambda'), CLIENTS.use(layer_plan.target):
+        if layer_plan.content_hash not in builds:
+            builds[layer_plan.content_hash] = layer_plan.layer.build(layer_plan.sources)
+        data = builds[layer_plan.content_hash]
+        if len(data) > LAYER_ZIP_LIMIT:
+            raise LayerBuildError(f"{len(data) / 1024 / 1024:.1f} MB zipped, a direct upload "
+                                  + f"allows {LAYER_ZIP_LIMIT // 1024 // 1024} MB")
+        response = get_client('lambda').publish_layer_version(
+            LayerName=layer_plan.name,
+            Description=LAYER_HASH_PREFIX + layer_plan.content_hash,
+            Content={'ZipFile': data},
+            CompatibleRuntimes=layer_plan.layer.runtimes,
+        )
+    layer_plan.arn = response['LayerVersionArn']
+    print(f"Layer {layer_plan.name} published as version {response['Version']} in "
+          + f"{layer_plan.target}, {len(data) / 1024:.1f} KB zipped")
 
-    lambdas_data = json.load(file_data)
-    if func_name in lambdas_data:
-        lambda_data = lambdas_data.get(func_name)
 
-    return lambda_data
+def publish_shared_layers(plans):
+    """
+    Publishes the changed layers of the plans and attaches the published
+    versions, returns the plans whose layers are all published
+    """
+    builds = {}
+    for layer_plan in get_layer_plans(plans):
+        if layer_plan.needs_publish:
+            try:
+                publish_shared_layer(layer_plan, builds)
+            except Exception as error:
+                layer_plan.error = f"{type(error).__name__}: {error}"
+                print(f"Layer {layer_plan.name} could not be published in {layer_plan.target}, "
+                      + layer_plan.error)
+
+    ready = []
+    for plan in plans:
+        failed = [layer_plan.name for layer_plan in plan.layer_plans if layer_plan.error]
+        if failed:
+            print(f"{plan.label}: not deployed, shared layer {', '.join(failed)} "
+                  + "was not published")
+            continue
+        plan.lambda_data = plan.lambda_data.with_shared_layers(
+            layer_plan.arn for layer_plan in plan.layer_plans)
+        ready.append(plan)
+    return ready
+
+
+def get_function_configuration(function_name, qualifier=None):
+    """Returns the configuration of a lambda or of one of its aliases, None if it does not exist"""
+    params = {'FunctionName': function_name}
+    if qualifier:
+        params['Qualifier'] = qualifier
+    try:
+        return get_client('lambda').get_function_configuration(**params)
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ResourceNotFoundException':
+            return None
+        raise
 
 
-def create_lambda_bundle(function_name):
-    """this function will create the zip file of our lambda function"""
-    with open(function_name + '.py') as file_obj:
-        lines = file_obj.readlines()
-    
-    temp_file = open('lambda_function.py', 'w')
-    temp_file.writelines(lines)
-    temp_file.close()
-    
-    with ZipFile(function_name + '.zip', 'w') as zip_obj:
-        zip_obj.write('lambda_function.py')
+def get_configuration_changes(configuration, lambda_data):
+    """Returns the fields of a deployed configuration that differ from the config file"""
+    expected = {
+        'Handler': LAMBDA_HANDLER,
+        'Runtime': lambda_data.runtime,
+        'Role': lambda_data.role,
+        'Timeout': lambda_data.timeout,
+        'MemorySize': lambda_data.memory_size,
+    }
+    changes = [field for field, value in expected.items() if configuration.get(field) != value]
+    layers = [layer['Arn'] for layer in configuration.get('Layers', [])]
+    if layers != lambda_data.layers:
+        changes.append('Layers')
+    return changes
+
+
+def is_configuration_current(configuration, lambda_data):
+    """Checks if a published version has the configuration of the config file"""
+    return not get_configuration_changes(configuration, lambda_data)
 
-    os.remove('lambda_function.py')
 
-def publish_code(function_name):
+class DeployStateReader:
+    """
+    Reads the deployed state of the lambdas of a run. Policies and
+    subscription filters that many lambdas share are read once
+    """
+
+    def __init__(self, env):
+        self.env = env
+        # keyed by arn or by target, the reader is shared by every target
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def cached(self, key, read):
+        """
+        Returns the value of a key, the first caller reads it and concurrent
+        callers of the same key wait for that read (single flight)
+        """
+        with self.lock:
+            future = self.cache.get(key)
+            owner = future is None
+            if owner:
+                future = self.cache[key] = Future()
+        if owner:
+            try:
+                future.set_result(read())
+            except Exception as error:
+                future.set_exception(error)
+        return future.result()
+
+    def read(self, function_name, lambda_data):
+        state = {
+            'latest_configuration': get_function_configuration(function_name),
+            'alias_configuration': None,
+            'api_resource': False,
+            'api_stage': False,
+            'api_permission': False,
+            'lambda_log_permission': False,
+            'lambda_log_filter': False,
+            'api_log_permission': False,
+            'api_log_filter': False,
+            'provisioned_concurrency': None,
+        }
+        exists = state['latest_configuration'] is not None
+        if exists:
+            state['alias_configuration'] = get_function_configuration(function_name, self.env)
+        if state['alias_configuration'] is not None and lambda_data.provisioned_concurrency:
+            state['provisioned_concurrency'] = get_provisioned_concurrency(function_name, self.env)
+
+        if lambda_data.api_id:
+            api_object = ApiGateway(lambda_data.api_id)
+            state['api_resource'] = api_object.check_api_existence(function_name)
+            stage_summary = self.cached(('api_stage', api_object.target, lambda_data.api_id),
+                                        lambda: api_object.get_stage_summary(self.env))
+            state['api_stage'] = api_object.is_resource_deployed(stage_summary, function_name)
+            if state['alias_configuration'] is not None:
+                state['api_permission'] = api_object.has_permission(
+                    PolicyIndex.load(function_name, self.env))
+
+        if self.env == 'production':
+            if lambda_data.logs:
+                lambda_logs = LambdaCloudWatchLogs(function_name)
+                state['lambda_log_permission'] = lambda_logs.has_permission(
+                    self.cached(lambda_logs.failure_lambda_arn,
+                                lambda: PolicyIndex.load(lambda_logs.failure_lambda_arn)))
+                state['lambda_log_filter'] = exists and lambda_logs.is_subscription_filter_added()
+            if lambda_data.api_id:
+                api_logs = APICloudWatchLogs(lambda_data.api_id)
+                state['api_log_permission'] = api_logs.has_permission(
+                    self.cached(api_logs.failure_lambda_arn,
+                                lambda: PolicyIndex.load(api_logs.failure_lambda_arn)))
+                state['api_log_filter'] = self.cached(
+                    ('api_log_filter', api_logs.target, lambda_data.api_id),
+                    api_logs.is_subscription_filter_added)
+        return state
+
+
+class FunctionPlan:
+    """The changes needed to bring a deployed lambda to its configuration in one target"""
+
+    def __init__(self, function_name, env, description, lambda_data):
+        self.function_name = function_name
+        self.env = env
+        self.description = description
+        self.lambda_data = lambda_data
+        self.target = lambda_data.target
+        # the function name, with the region when a run deploys to several targets
+        self.label = function_name
+        self.bundle = None
+        self.import_times = None
+        self.actual = None
+        self.changes = []
+        self.error = None
+        self.layer_plans = []
+        self.layer_modules = []
+        # the journal entry the plan was restored from by a resumed run
+        self.journal_entry = None
+
+    def add(self, action, detail):
+        self.changes.append((action, detail))
+
+    def needs(self, action):
+        return any(change[0] == action for change in self.changes)
+
+
+def diff_deployment(plan, planned_api_logs):
+    """
+    Adds the changes of a lambda to its plan. The api log trigger is shared by
+    every lambda of an api, so it is planned once per target and api id
+    """
+    lambda_data = plan.lambda_data
+    actual = plan.actual
+    latest = actual['latest_configuration']
+    alias_configuration = actual['alias_configuration']
+    code_sha = plan.bundle.code_sha
+
+    if latest is None:
+        plan.add('create', 'lambda does not exist')
+    else:
+        changes = get_configuration_changes(latest, lambda_data)
+        fields = [field for field in changes if field != 'Layers']
+        if fields:
+            plan.add('configuration', ', '.join(fields))
+        if latest.get('CodeSha256') != code_sha:
+            plan.add('code', f"{latest.get('CodeSha256')} -> {code_sha}")
+        if 'Layers' in changes:
+            plan.add('layers', ', '.join(lambda_data.layers) or 'remove all layers')
+
+    if alias_configuration is None or alias_configuration.get('CodeSha256') != code_sha \
+            or not is_configuration_current(alias_configuration, lambda_data):
+        plan.add('publish', 'new version')
+        plan.add('alias', ('update ' if alias_configuration else 'create ') + plan.env)
+
+    if lambda_data.provisioned_concurrency and \
+            actual['provisioned_concurrency'] != lambda_data.provisioned_concurrency:
+        plan.add('provisioned_concurrency',
+                 f"{actual['provisioned_concurrency'] or 0} -> {lambda_data.provisioned_concurrency} "
+                 + f"on {plan.env}")
+
+    if lambda_data.api_id:
+        if not actual['api_resource']:
+            plan.add('api_resource', f"/{plan.function_name} on {lambda_data.api_id}")
+        if not actual['api_stage']:
+            plan.add('api_stage', f"deploy {lambda_data.api_id} to {plan.env}")
+        if not actual['api_permission']:
+            plan.add('api_permission', f"allow {lambda_data.api_id} to invoke {plan.env}")
+
+    if plan.env == 'production':
+        if lambda_data.logs:
+            if not actual['lambda_log_permission']:
+                plan.add('lambda_log_permission', 'allow logs to invoke LambdaFailure')
+            if not actual['lambda_log_filter']:
+                plan.add('lambda_log_filter', f"/aws/lambda/{plan.function_name}")
+        if lambda_data.api_id and (plan.target, lambda_data.api_id) not in planned_api_logs:
+            planned_api_logs.add((plan.target, lambda_data.api_id))
+            if not actual['api_log_permission']:
+                plan.add('api_log_permission', 'allow logs to invoke apiGatewayFailure')
+            if not actual['api_log_filter']:
+                plan.add('api_log_filter', f"API-Gateway-Execution-Logs_{lambda_data.api_id}")
+
+
+def get_target_plans(functions, env, regions=None):
+    """
+    Returns a plan per lambda and target, only the targets in regions when
+    regions are given
+    """
+    plans = [FunctionPlan(name, env, description, target_config)
+             for name, description, lambda_data in functions
+             for target_config in lambda_data.get_target_configs()
+             if not regions or target_config.target.region in regions]
+    if len({plan.target for plan in plans}) > 1:
+        for plan in plans:
+            plan.label = f"{plan.function_name}@{plan.target.region}"
+    return plans
+
+
+def plan_deployments(functions, env, concurrency=DEFAULT_CONCURRENCY, bundle_options=None,
+                     regions=None, journal=None):
+    """
+    Bundles the lambdas and reads their deployed state in every target
+    concurrently, then diffs the state against the configuration file.
+    functions is a list of (function name, description, lambda data). A
+    lambda is bundled once and the bundle is reused for all its targets.
+    With the journal of an interrupted run, the plans of the lambdas it
+    has an entry for are restored from it without reading their state
+    """
+    bundle_options = bundle_options or {}
+    reader = DeployStateReader(env)
+    plans = get_target_plans(functions, env, regions)
+
+    plan_shared_layers(plans)
+
+    def create_bundle(plan):
+        with TELEMETRY.stage(plan.function_name, 'bundle', 'bundle'):
+            bundle = create_lambda_bundle(plan.function_name, env, plan.lambda_data.runtime,
+                                          bundle_options.get('bytecode'), plan.layer_modules)
+            import_times = None
+            if bundle_options.get('import_report'):
+                import_times = {module: measure_import_time(module)
+                                for module in bundle.external_modules}
+        return bundle, import_times
+
+    def prepare(plan):
+        try:
+            plan.bundle, plan.import_times = bundles[get_bundle_key(plan)].result()
+            if journal is not None and journal.resume(plan):
+                return
+            with TELEMETRY.stage(plan.label, 'read_state', 'lambda'), CLIENTS.use(plan.target):
+                plan.actual = reader.read(plan.function_name, plan.lambda_data)
+        except Exception as error:
+            plan.error = f"{type(error).__name__}: {error}"
+
+    ready = [plan for plan in plans if plan.error is None]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # the bundles are submitted first so no worker waits on a bundle
+        # that is still queued
+        bundles = {}
+        for plan in ready:
+            if get_bundle_key(plan) not in bundles:
+                bundles[get_bundle_key(plan)] = executor.submit(create_bundle, plan)
+        list(executor.map(prepare, ready))
+
+    planned_api_logs = {(plan.target, plan.lambda_data.api_id) for plan in plans
+                        if plan.needs('api_log_permission') or plan.needs('api_log_filter')}
+    for plan in plans:
+        if plan.error is None and plan.journal_entry is None:
+            diff_deployment(plan, planned_api_logs)
+    return plans
+
+
+def get_bundle_key(plan):
+    """Plans with the same key get the same bundle"""
+    return plan.function_name, plan.lambda_data.runtime, tuple(plan.layer_modules)
+
+
+def display_plan(plans):
+    layer_plans = get_layer_plans(plans)
+    if layer_plans:
+        print("Shared layers:")
+        for layer_plan in layer_plans:
+            print(f"  {layer_plan.label.removeprefix('layer ')}: {layer_plan.get_status()}")
+    print("Deploy plan:")
+    for plan in plans:
+        if plan.error:
+            print(f"  {plan.label}: could not be planned, {plan.error}")
+            continue
+        status = f"{len(plan.changes)} change(s)" if plan.changes else 'up to date'
+        if plan.journal_entry:
+            status += ', ' + get_resume_status(plan.journal_entry)
+        print(f"  {plan.label}: {status}")
+        for line in plan.bundle.get_report(plan.import_times):
+            print("      " + line)
+        if not plan.lambda_data.api_id:
+            print("      API Id is empty, please update it in configuration file")
+        for action, detail in plan.changes:
+            print(f"    {action:<22} {detail}")
+    changed = len([plan for plan in plans if plan.changes])
+    print(f"{changed}/{len(plans)} functions have changes")
+
+
+def publish_code(function_name, bundle):
     """This function will publish our code on aws cloud"""
-    create_lambda_bundle(function_name)
-    
-    bytes_content = get_lambda_bundle_as_zip(function_name)
-    CLIENT.update_function_code(
+    get_client('lambda').update_function_code(
         FunctionName=function_name,
-        ZipFile=bytes_content
+        ZipFile=bundle
     )
 
 
 def publish_lambda_version(function_name, description):
-    response = CLIENT.publish_version(
+    response = get_client('lambda').publish_version(
         FunctionName=function_name,
         Description=description,
     )
     return response['Version']
 
 
-def update_alias(function_name, env, version):
+def update_alias(function_name, env, version, alias_exists):
     """A function that will create alias according to the env"""
 
-    # in this logic firstly we are checking if the alias already exists
-    # if that is the case then we update the alias to newer version, else
-    # we create a new alias for that version
-    aliases_list = []
-    all_aliases = CLIENT.list_aliases(
-        FunctionName=function_name
-    )['Aliases']
-    for alias in all_aliases:
-        aliases_list.append(alias['Name'])
-
-    if env in aliases_list:
-        CLIENT.update_alias(
+    # the plan already read the alias, if it exists we update it to the
+    # newer version, else we create a new alias for that version
+    if alias_exists:
+        get_client('lambda').update_alias(
             FunctionName=function_name,
             Name=env,
             FunctionVersion=version,
         )
     else:
-        CLIENT.create_alias(
+        get_client('lambda').create_alias(
             FunctionName=function_name,
             Name=env,
             FunctionVersion=version,
         )
 
-def deploy_api(function_name, env):
-    file_object = open(CONFIGURATION_FILE, 'r', encoding='UTF-8')
-    lambdas_data = json.load(file_object)
-    if function_name in lambdas_data:
-        api_id = lambdas_data[function_name]['ApiId']
-        if api_id:
-            print("Deploying API", api_id)
-            api_object = ApiGateway(api_id)
+def get_provisioned_concurrency(function_name, env):
+    """Returns the provisioned concurrency requested on an alias, None if there is none"""
+    try:
+        response = get_client('lambda').get_provisioned_concurrency_config(
+            FunctionName=function_name, Qualifier=env)
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ProvisionedConcurrencyConfigNotFoundException':
+            return None
+        raise
+    return response['RequestedProvisionedConcurrentExecutions']
 
-            if not api_object.check_api_existence(function_name):
-                api_object.create_api_resource(function_name)
 
-                for method in ['POST', 'OPTIONS']:
-                    api_object.create_resource_method(function_name, method)
-                    api_object.create_method_integration(function_name, method)
-                    api_object.create_method_response(function_name, method)
-                    api_object.create_integration_response(function_name, method)
+def set_provisioned_concurrency(function_name, env, concurrency):
+    get_client('lambda').put_provisioned_concurrency_config(
+        FunctionName=function_name,
+        Qualifier=env,
+        ProvisionedConcurrentExecutions=concurrency,
+    )
 
-                try:
-                    api_object.set_api_gateway_permissions(function_name, env)
-                except ClientError:
-                    pass
-                res = api_object.deploy_api(env)
-                print('API Deployed')
-            else:
-                print("Api resource already there")
-                try:
-                    api_object.set_api_gateway_permissions(function_name, env)
-                except ClientError:
-                    pass
-                api_object.deploy_api(env)
-        else:
-            print('---------API Id is empty, please update it in ' +
-                  'configuration file----------')
-
-def add_lambda_log_trigger(function_name, version_num):
-    file_object = open(CONFIGURATION_FILE, 'r', encoding='UTF-8')
-    lambdas_data = json.load(file_object)
-    if function_name in lambdas_data and 'logs' in lambdas_data[function_name]:
-        status = lambdas_data[function_name]['logs']
-        if status:
-            obj = LambdaCloudWatchLogs(function_name)
-            if not obj.is_permission_added():
-                obj.add_permission()
-                print("Permission Added on Lambda-Failure")
-            else:
-                print("Lambda Failure logs permission was already there")
-            obj.add_subscription_filter(version_num)
-            print("Subscription filter added in lambdaFailure")
-            
-def add_api_log_trigger(function_name):
-    file_object = open(CONFIGURATION_FILE, 'r', encoding='UTF-8')
-    lambdas_data = json.load(file_object)    
-    if function_name in lambdas_data:
-        api_id = lambdas_data[function_name]['ApiId']
-        if api_id:
-            obj = APICloudWatchLogs(api_id)
-            if not obj.is_permission_added():
-                obj.add_permission()
-                print("Permission Added on Apigateway-Failure")
-            else:
-                print("APIGateway logs Permission was already there")
-            obj.add_subscription_filter()
-            print("Subscription filter added in Apigateway-Failure")
-
-def clean_bundle(function_name):
-    os.remove(function_name + ".zip")
-    os.remove(function_name + "-temp.py")
-
-def attach_layer(function_name):
-    lambda_data = get_lambda_data(function_name)
-    if lambda_data.get('layers'):
-        CLIENT.update_function_configuration(
-            FunctionName= function_name,
-            Layers = lambda_data.get('layers')
+
+def get_warmup_payloads(lambda_data):
+    """Returns the warm-up events of a lambda, file names are read as json events"""
+    payloads = []
+    for payload in lambda_data.warmup_payloads:
+        if isinstance(payload, str):
+            with open(payload, 'r', encoding='UTF-8') as file_obj:
+                payload = json.load(file_obj)
+        payloads.append(payload)
+    return payloads
+
+
+def parse_invoke_report(log_result):
+    """Returns the Duration and Init Duration in ms of the REPORT line of an invoke log tail"""
+    durations = {'duration': None, 'init_duration': None}
+    log = base64.b64decode(log_result or '').decode('UTF-8', errors='replace')
+    for line in log.splitlines():
+        if not line.startswith('REPORT '):
+            continue
+        for field in line.split('\t'):
+            name, _, value = field.partition(': ')
+            if name.strip() == 'Duration':
+                durations['duration'] = float(value.split()[0])
+            elif name.strip() == 'Init Duration':
+                durations['init_duration'] = float(value.split()[0])
+    return durations
+
+
+def invoke_warmup_payloads(function_name, qualifier, payloads):
+    """
+    Invokes the version or alias with every payload, the first invoke of a
+    new version pays the cold start. Returns the init duration, the median
+    invoke duration and the errors of the payloads
+    """
+    init_duration = None
+    durations = []
+    errors = []
+    for index, payload in enumerate(payloads):
+        response = get_client('lambda').invoke(
+            FunctionName=function_name,
+            Qualifier=qualifier,
+            Payload=json.dumps(payload).encode('UTF-8'),
+            LogType='Tail',
         )
-        print("Layers attached to the lambda function")
+        body = response['Payload'].read().decode('UTF-8', errors='replace')
+        if response.get('FunctionError'):
+            errors.append(f"payload {index + 1}: {response['FunctionError']}, {body[:200]}")
+        report = parse_invoke_report(response.get('LogResult'))
+        if report['init_duration'] is not None and init_duration is None:
+            init_duration = report['init_duration']
+        if report['duration'] is not None:
+            durations.append(report['duration'])
+    # the cold invoke also pays for lazy imports, the warm ones show the steady state
+    warm_durations = durations[1:] or durations
+    duration = sorted(warm_durations)[len(warm_durations) // 2] if warm_durations else None
+    return {'init_duration': init_duration, 'duration': duration, 'errors': errors}
+
+
+def is_regression(current, previous):
+    if current is None or previous is None:
+        return False
+    return current - previous > max(WARMUP_REGRESSION_MS, previous * WARMUP_REGRESSION_RATIO)
+
+
+class WarmupHistory:
+    """
+    The warm-up measurements of the deployed versions of every lambda and env,
+    a new version is compared with the last measured version before it
+    """
+
+    def __init__(self, file_name=WARMUP_HISTORY_FILE):
+        self.file_name = file_name
+        self.entries = {}
+        if os.path.exists(file_name):
+            with open(file_name, 'r', encoding='UTF-8') as file_obj:
+                self.entries = json.load(file_obj)
+        self.results = []
+        self.lock = threading.Lock()
+
+    def record(self, plan, version, measurement):
+        """Stores a measurement and returns the regressions against the previous version"""
+        key = f"{plan.function_name}:{plan.env}"
+        if plan.target != DEFAULT_TARGET:
+            key += f":{plan.target.region}"
+        with self.lock:
+            entries = self.entries.setdefault(key, [])
+            previous = next((entry for entry in reversed(entries) if entry['version'] != version), None)
+            entry = dict(measurement, version=version, time=round(time.time()))
+            entries.append(entry)
+            del entries[:-WARMUP_HISTORY_LENGTH]
+            regressions = [field for field in ('init_duration', 'duration')
+                           if previous and is_regression(entry[field], previous[field])]
+            self.results.append((plan.label, entry, previous, regressions))
+        return previous, regressions
+
+    def save(self):
+        with open(self.file_name, 'w', encoding='UTF-8') as file_obj:
+            json.dump(self.entries, file_obj, indent=2)
+
+    def display_report(self):
+        if not self.results:
+            return
+
+        def format_ms(value):
+            return '-' if value is None else f"{value:.0f}"
+
+        print(f"{'function':<32} {'version':>8} {'init ms':>8} {'prev':>6} {'invoke ms':>10} "
+              + f"{'prev':>6}  regressions")
+        for function_name, entry, previous, regressions in sorted(self.results, key=lambda item: item[0]):
+            previous = previous or {}
+            print(f"{function_name:<32} {entry['version']:>8} {format_ms(entry['init_duration']):>8} "
+                  + f"{format_ms(previous.get('init_duration')):>6} {format_ms(entry['duration']):>10} "
+                  + f"{format_ms(previous.get('duration')):>6}  {', '.join(regressions) or '-'}")
+        regressed = [item for item in self.results if item[3]]
+        if regressed:
+            print(f"*** {len(regressed)} lambdas regressed against their previous version ***")
+
+
+def warm_up(plan, version, history):
+    """
+    Invokes the version the alias now points to and records its durations.
+    The version is invoked directly, provisioned concurrency on the alias
+    would serve the invokes from initialized environments
+    """
+    payloads = get_warmup_payloads(plan.lambda_data)
+    measurement = invoke_warmup_payloads(plan.function_name, version or plan.env, payloads)
+    previous, regressions = history.record(plan, version, measurement)
+    for error in measurement['errors']:
+        log_progress(f"Warm-up invoke failed, {error}")
+    init_duration = measurement['init_duration']
+    message = f"Warm-up of version {version}: init " + \
+        ('not measured' if init_duration is None else f"{init_duration:.0f} ms")
+    if previous:
+        message += f", previous version {previous['version']}"
+    log_progress(message)
+    for field in regressions:
+        log_progress(f"*** {field} regressed from {previous[field]:.0f} ms to "
+                     + f"{measurement[field]:.0f} ms ***")
+
+
+def deploy_api(plan, api_deployments=None):
+    """
+    Creates the api resource and permission of the lambda when the plan needs
+    them, the stage deployment is added to api_deployments when it is passed
+    so a batch deploys every stage once. A batch in merge mode also collects
+    the resource to add it with the ones of the other functions
+    """
+    function_name = plan.function_name
+    env = plan.env
+    api_id = plan.lambda_data.api_id
+    log_progress(f"Deploying API {api_id}")
+    api_object = ApiGateway(api_id)
+
+    if plan.needs('api_resource') and api_deployments is not None and api_deployments.merge:
+        api_deployments.add_resource(api_id, function_name, plan.label, plan.target)
+        log_progress('API resource added to the merged definition')
+    elif plan.needs('api_resource'):
+        api_object.create_api_resource(function_name)
+
+        for method in ['POST', 'OPTIONS']:
+            api_object.create_resource_method(function_name, method)
+            api_object.create_method_integration(function_name, method)
+            api_object.create_method_response(function_name, method)
+            api_object.create_integration_response(function_name, method)
     else:
-        print("Found no layers to attach, This will also remove any layer "
-              + "already attached to the lambda function")
+        log_progress("Api resource already there")
 
-def update_wait(function_name):
-    response = CLIENT.get_function_configuration(
-        FunctionName=function_name,
+    if plan.needs('api_permission'):
+        try:
+            api_object.set_api_gateway_permissions(function_name, env)
+        except ClientError:
+            pass
+
+    if plan.needs('api_stage'):
+        if api_deployments is not None:
+            api_deployments.add(api_id, env, plan.label, plan.target)
+            log_progress('API deployment scheduled')
+        else:
+            api_object.deploy_api(env)
+            log_progress('API Deployed')
+
+def add_lambda_log_trigger(plan, version_num):
+    obj = LambdaCloudWatchLogs(plan.function_name)
+    if plan.needs('lambda_log_permission'):
+        obj.add_permission()
+        log_progress("Permission Added on Lambda-Failure")
+    else:
+        log_progress("Lambda Failure logs permission was already there")
+    if plan.needs('lambda_log_filter'):
+        obj.add_subscription_filter(version_num)
+        log_progress("Subscription filter added in lambdaFailure")
+            
+def add_api_log_trigger(plan):
+    obj = APICloudWatchLogs(plan.lambda_data.api_id)
+    if plan.needs('api_log_permission'):
+        obj.add_permission()
+        log_progress("Permission Added on Apigateway-Failure")
+    else:
+        log_progress("APIGateway logs Permission was already there")
+    if plan.needs('api_log_filter'):
+        obj.add_subscription_filter()
+        log_progress("Subscription filter added in Apigateway-Failure")
+
+def attach_layer(lambda_data):
+    get_client('lambda').update_function_configuration(
+        FunctionName= lambda_data.name,
+        Layers = lambda_data.layers
     )
-    while response['LastUpdateStatus'] == LambdaStates.IN_PROGRESS:
-        response = CLIENT.get_function_configuration(
-            FunctionName=function_name,
-        )
-        
-def deploy_lambda(args):
-    function_name = args[0]
-    env = args[1]
-    description = args[2]
+    if lambda_data.layers:
+        log_progress("Layers attached to the lambda function")
+    else:
+        log_progress("Found no layers to attach, removed the layers "
+                     + "attached to the lambda function")
 
-    create_lambda_bundle(function_name)
-    print('Lambda Bundle Created')
+def wait_until_ready(function_name):
+    """Waits until the lambda is neither pending nor being updated"""
+    return WAITER.wait(function_name)
 
-    update_wait(function_name)
-    
-    publish_code(function_name)
-    print('Lambda Latest version updated with the new code')
 
-    retain_original_code(function_name)
+def log_progress(message):
+    """
+    Prints deploy progress, while the scheduler is deploying a function the
+    message is kept with that function and printed once it is finished
+    """
+    deployment = getattr(PROGRESS, 'deployment', None)
+    if deployment is None:
+        print(message)
+    else:
+        deployment.messages.append(message)
 
-    update_wait(function_name)
 
-    attach_layer(function_name)
+class DeployStage:
+    """A single step of a function deployment that uses one service"""
 
-    update_wait(function_name)
+    def __init__(self, name, service, action):
+        self.name = name
+        self.service = service
+        self.action = action
 
-    version = publish_lambda_version(function_name, description)
-    print(f'Lambda Version Created with id {version}')
 
-    update_alias(function_name, env, version)
-    print(f'Lambda Alias Updated to point to version {version}')
-    
-    deploy_api(function_name, env)
-    
-    if env == 'production':
-        add_lambda_log_trigger(function_name, version)
-        add_api_log_trigger(function_name)
+class FunctionDeployment:
+    """Progress and result of deploying a single lambda function"""
 
-    clean_bundle(function_name)
-    print("---------------------------------------------------")
+    def __init__(self, function_name, stages, target=None):
+        self.function_name = function_name
+        self.stages = stages
+        self.target = target or DEFAULT_TARGET
+        self.status = 'pending'
+        self.completed_stages = []
+        self.failed_stage = None
+        self.error = None
+        self.messages = []
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def duration(self):
+        if self.start_time is None or self.end_time is None:
+            return 0
+        return self.end_time - self.start_time
+
+
+class ApiDeploymentBatch:
+    """
+    Collects the api stages configured by a batch of functions so every
+    (target, api id, stage) is deployed once after all of its resources are
+    configured. In merge mode the api resources of the functions are
+    collected as well and added with one OpenAPI merge per rest api, instead
+    of about nine calls per function
+    """
+
+    def __init__(self, merge=False):
+        self.merge = merge
+        self.resources = {}
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def add_resource(self, api_id, resource_name, function_name, target=None):
+        with self.lock:
+            self.resources.setdefault((target or DEFAULT_TARGET, api_id), []).append(
+                (resource_name, function_name))
+
+    def add(self, api_id, stage_name, function_name, target=None):
+        with self.lock:
+            self.groups.setdefault((target or DEFAULT_TARGET, api_id, stage_name), []).append(function_name)
+
+    def merge_resources(self):
+        """Merges the collected resources of every api, returns the (stage, error) of failures"""
+        errors = {}
+        for (target, api_id), resources in self.resources.items():
+            try:
+                with TELEMETRY.stage(None, 'api_merge', 'apigateway'), CLIENTS.use(target):
+                    ApiGateway(api_id).merge_api_definition([name for name, _ in resources])
+                print(f"API {api_id} definition merged with {len(resources)} resource(s)")
+            except Exception as error:
+                print(f"API {api_id} definition merge failed: {error}")
+                for _, function_name in resources:
+                    errors[function_name] = ('api_merge', f"{type(error).__name__}: {error}")
+        self.resources = {}
+        return errors
+
+    def deploy(self):
+        """
+        Merges the collected resources, then deploys every group. Returns the
+        (stage, error) of each failed function
+        """
+        errors = self.merge_resources()
+        for (target, api_id, stage_name), function_names in self.groups.items():
+            try:
+                with TELEMETRY.stage(None, 'api_deployment', 'apigateway'), CLIENTS.use(target):
+                    ApiGateway(api_id).deploy_api(stage_name)
+                print(f"API {api_id} deployed to {stage_name} for {len(function_names)} function(s)")
+            except Exception as error:
+                print(f"API {api_id} deployment to {stage_name} failed: {error}")
+                for function_name in function_names:
+                    errors.setdefault(function_name, ('api_deployment', f"{type(error).__name__}: {error}"))
+        self.groups = {}
+        return errors
+
+
+def get_config_hash(plan):
+    """Hash of the configuration, layers and description a plan was made for"""
+    data = {
+        'configuration': plan.lambda_data.data,
+        'layers': plan.lambda_data.layers,
+        'description': plan.description,
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def get_resume_point(entry):
+    """
+    Returns the number of stages a resumed plan skips. An update stage only
+    counts once the wait after it completed, otherwise the update is sent
+    again rather than waiting on an update that may have failed
+    """
+    completed = entry['completed']
+    if 0 < completed < len(entry['stages']) and entry['stages'][completed] == 'wait':
+        completed -= 1
+    return completed
+
+
+def get_resume_status(entry):
+    if entry['status'] == 'succeeded':
+        return 'deployed by the interrupted run'
+    completed = entry['stages'][:get_resume_point(entry)]
+    if not completed:
+        return 'resumed from the start'
+    return 'resumed after ' + ', '.join(completed)
+
+
+class DeployJournal:
+    """
+    The stages every function of a deploy run completed, with its plan, bundle
+    hash and published version, saved after every stage. A resumed run
+    restores the plan of a function from its entry when its bundle and
+    configuration did not change and continues at its first stage that did
+    not complete
+    """
+
+    def __init__(self, env, file_name=DEPLOY_JOURNAL_FILE, entries=None):
+        self.env = env
+        self.file_name = file_name
+        self.entries = entries or {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, env, file_name=DEPLOY_JOURNAL_FILE):
+        """Returns the journal of the last run, None if there is none"""
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, 'r', encoding='UTF-8') as file_obj:
+            data = json.load(file_obj)
+        if data['env'] != env:
+            raise ConfigurationError(f"{file_name} is the journal of a {data['env']} deploy")
+        return cls(env, file_name, data['functions'])
+
+    def save(self):
+        """Replaces the file at once so an interrupted write keeps the previous journal"""
+        temp_name = self.file_name + '.tmp'
+        with open(temp_name, 'w', encoding='UTF-8') as file_obj:
+            json.dump({'env': self.env, 'functions': self.entries}, file_obj, indent=2)
+        os.replace(temp_name, self.file_name)
+
+    def resume(self, plan):
+        """
+        Restores a plan from its entry, returns False if there is none or the
+        bundle or configuration of the lambda changed since it was written.
+        A lambda whose create was not waited on is planned from its state,
+        it can not be created again
+        """
+        entry = self.entries.get(plan.label)
+        if entry is None or entry['region'] != plan.target.region \
+                or entry['code_sha'] != plan.bundle.code_sha \
+                or entry['config_hash'] != get_config_hash(plan):
+            return False
+        resume_point = get_resume_point(entry)
+        if entry['status'] != 'succeeded' and resume_point < entry['completed'] \
+                and entry['stages'][resume_point] == 'create':
+            return False
+        plan.journal_entry = entry
+        plan.actual = {
+            'alias_configuration': {'Version': entry['alias_version']} if entry['alias_exists'] else None,
+        }
+        if entry['status'] != 'succeeded':
+            plan.changes = [tuple(change) for change in entry['changes']]
+        return True
+
+    def start(self, plan, stages):
+        """
+        Records the stages of a plan and returns the ones left to run, a
+        restored plan skips the stages its entry completed as long as they
+        are still the first stages of the plan
+        """
+        names = [stage.name for stage in stages]
+        entry = plan.journal_entry
+        with self.lock:
+            resume_point = get_resume_point(entry) if entry else 0
+            if entry and names[:resume_point] == entry['stages'][:resume_point]:
+                stages = stages[resume_point:]
+                entry['completed'] = resume_point
+            else:
+                alias_configuration = plan.actual['alias_configuration']
+                alias_version = alias_configuration.get('Version') if alias_configuration else None
+                entry = {
+                    'function': plan.function_name,
+                    'region': plan.target.region,
+                    'code_sha': plan.bundle.code_sha,
+                    'config_hash': get_config_hash(plan),
+                    'changes': plan.changes,
+                    'alias_exists': alias_configuration is not None,
+                    'alias_version': alias_version,
+                    'version': alias_version,
+                    'completed': 0,
+                }
+            entry.update(stages=names, status='pending', failed_stage=None, error=None)
+            self.entries[plan.label] = entry
+            self.save()
+        return stages
+
+    def set_version(self, label, version):
+        with self.lock:
+            self.entries[label]['version'] = version
+            self.save()
+
+    def complete_stage(self, label):
+        with self.lock:
+            self.entries[label]['completed'] += 1
+            self.save()
+
+    def finish(self, deployment, status=None):
+        with self.lock:
+            self.entries[deployment.function_name].update(status=status or deployment.status,
+                                                          failed_stage=deployment.failed_stage,
+                                                          error=deployment.error)
+            self.save()
+
+
+class DeployScheduler:
+    """
+    Deploys functions concurrently on a bounded worker pool, every function
+    runs its stages in order and each stage waits for a free slot of its
+    service in the region of the function, AWS limits the calls of every
+    region apart. A failing function stops at the failed stage without
+    affecting the others. With a journal every completed stage is recorded
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, service_limits=None, journal=None,
+                 api_merge=False):
+        self.concurrency = concurrency
+        self.journal = journal
+        self.limits = dict(SERVICE_CONCURRENCY)
+        self.limits.update(service_limits or {})
+        self.semaphores = {}
+        self.lock = threading.Lock()
+        self.deployments = []
+        self.api_deployments = ApiDeploymentBatch(api_merge)
+
+    def add(self, function_name, stages, target=None):
+        self.deployments.append(FunctionDeployment(function_name, stages, target))
+
+    def get_semaphore(self, service, region):
+        with self.lock:
+            if (service, region) not in self.semaphores:
+                self.semaphores[(service, region)] = threading.Semaphore(self.limits[service])
+            return self.semaphores[(service, region)]
+
+    def run(self):
+        """Runs all deployments and returns True if all of them succeeded"""
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(self.run_deployment, self.deployments))
+        self.deploy_apis()
+        if self.journal is not None:
+            for deployment in self.deployments:
+                self.journal.finish(deployment)
+        self.display_summary()
+        return all(deployment.status == 'succeeded' for deployment in self.deployments)
+
+    def run_deployment(self, deployment):
+        PROGRESS.deployment = deployment
+        deployment.status = 'running'
+        deployment.start_time = time.time()
+        try:
+            for stage in deployment.stages:
+                deployment.failed_stage = stage.name
+                queued_since = time.time()
+                with self.get_semaphore(stage.service, deployment.target.region):
+                    with TELEMETRY.stage(deployment.function_name, stage.name,
+                                         stage.service, queued_since), CLIENTS.use(deployment.target):
+                        stage.action()
+                deployment.completed_stages.append(stage.name)
+                if self.journal is not None:
+                    self.journal.complete_stage(deployment.function_name)
+            deployment.failed_stage = None
+            deployment.status = 'succeeded'
+        except Exception as error:
+            deployment.status = 'failed'
+            deployment.error = f"{type(error).__name__}: {error}"
+        finally:
+            deployment.end_time = time.time()
+            PROGRESS.deployment = None
+            if self.journal is not None:
+                # succeeded only once its api stage is deployed as well
+                self.journal.finish(deployment, 'deployed' if deployment.status == 'succeeded' else None)
+            self.display_deployment(deployment)
+
+    def deploy_apis(self):
+        """Deploys the api stages of the batch and reports failures per function"""
+        errors = self.api_deployments.deploy()
+        for deployment in self.deployments:
+            if deployment.function_name in errors and deployment.status != 'failed':
+                deployment.status = 'failed'
+                deployment.failed_stage, deployment.error = errors[deployment.function_name]
+
+    def display_deployment(self, deployment):
+        with PRINT_LOCK:
+            print(f"{deployment.function_name} ({deployment.status}, {deployment.duration:.1f}s)")
+            for message in deployment.messages:
+                print("  " + message)
+            if deployment.error:
+                print(f"  Failed in stage {deployment.failed_stage}: {deployment.error}")
+            print("---------------------------------------------------")
+
+    def display_summary(self):
+        print("Deploy summary:")
+        for deployment in self.deployments:
+            line = f"  {deployment.function_name:<40} {deployment.status:<10} {deployment.duration:>7.1f}s"
+            if deployment.status == 'failed':
+                line += f"  {deployment.failed_stage}: {deployment.error}"
+            print(line)
+        succeeded = len([item for item in self.deployments if item.status == 'succeeded'])
+        print(f"{succeeded}/{len(self.deployments)} functions deployed")
+        targets = sorted({deployment.target for deployment in self.deployments}, key=str)
+        if len(targets) > 1:
+            self.display_target_summary(targets)
+
+    def display_target_summary(self, targets):
+        print("Per region:")
+        for target in targets:
+            deployments = [item for item in self.deployments if item.target == target]
+            failed = [item.function_name for item in deployments if item.status != 'succeeded']
+            line = f"  {str(target):<32} {len(deployments) - len(failed)}/{len(deployments)} deployed"
+            if failed:
+                line += "  failed: " + ', '.join(failed)
+            print(line)
+
+
+def get_deploy_stages(plan, api_deployments=None, warmup_history=None, journal=None):
+    """
+    Returns the stages that apply the changes of a deploy plan: create/update
+    the lambda, publish its code, point the alias to the new version and wire
+    the api and log triggers. The lambda is only waited on after a stage
+    that modified it. With a warm-up history the new version is invoked
+    once the alias points to it. The published version is kept in the
+    journal, a resumed plan starts from the version its entry recorded
+    """
+    function_name = plan.function_name
+    env = plan.env
+    lambda_data = plan.lambda_data
+    alias_configuration = plan.actual['alias_configuration']
+    state = {'version': alias_configuration.get('Version') if alias_configuration else None}
+    if plan.journal_entry:
+        state['version'] = plan.journal_entry['version']
+    stages = []
+
+    def wait():
+        wait_until_ready(function_name)
+
+    def add_update_stage(name, action):
+        stages.append(DeployStage(name, 'lambda', action))
+        stages.append(DeployStage('wait', 'wait', wait))
+
+    def create():
+        create_lambda_on_aws(lambda_data, function_name, plan.bundle.data)
+        log_progress("Lambda created on AWS")
+
+    def configure():
+        update_lambda_configuration(lambda_data)
+        log_progress("Lambda configuration updated")
+
+    def upload():
+        publish_code(function_name, plan.bundle.data)
+        log_progress('Lambda Latest version updated with the new code')
+
+    def publish():
+        state['version'] = publish_lambda_version(function_name, plan.description)
+        if journal is not None:
+            journal.set_version(plan.label, state['version'])
+        log_progress(f"Lambda Version Created with id {state['version']}")
+
+    def alias():
+        update_alias(function_name, env, state['version'], alias_configuration is not None)
+        log_progress(f"Lambda Alias Updated to point to version {state['version']}")
+
+    def provision():
+        set_provisioned_concurrency(function_name, env, lambda_data.provisioned_concurrency)
+        log_progress(f"Provisioned concurrency of {env} set to {lambda_data.provisioned_concurrency}")
+
+    def log_triggers():
+        if plan.needs('lambda_log_permission') or plan.needs('lambda_log_filter'):
+            add_lambda_log_trigger(plan, state['version'])
+        if plan.needs('api_log_permission') or plan.needs('api_log_filter'):
+            add_api_log_trigger(plan)
+
+    if plan.needs('create'):
+        add_update_stage('create', create)
+    if plan.needs('configuration'):
+        add_update_stage('configure', configure)
+    if plan.needs('code'):
+        add_update_stage('upload', upload)
+    if plan.needs('layers'):
+        add_update_stage('layers', lambda: attach_layer(lambda_data))
+    if plan.needs('publish'):
+        stages.append(DeployStage('publish', 'lambda', publish))
+    if plan.needs('alias'):
+        stages.append(DeployStage('alias', 'lambda', alias))
+    # the cold start is measured before provisioned concurrency initializes the version
+    if warmup_history is not None and plan.needs('alias') and plan.lambda_data.warmup_payloads:
+        stages.append(DeployStage('warmup', 'invoke',
+                                  lambda: warm_up(plan, state['version'], warmup_history)))
+    if plan.needs('provisioned_concurrency'):
+        stages.append(DeployStage('provisioned_concurrency', 'lambda', provision))
+    if any(plan.needs(action) for action in ('api_resource', 'api_permission', 'api_stage')):
+        stages.append(DeployStage('api', 'apigateway', lambda: deploy_api(plan, api_deployments)))
+    if any(plan.needs(action) for action in ('lambda_log_permission', 'lambda_log_filter',
+                                             'api_log_permission', 'api_log_filter')):
+        stages.append(DeployStage('log_triggers', 'logs', log_triggers))
+    return stages
+
+
+def apply_plans(plans, concurrency=DEFAULT_CONCURRENCY, plan_only=False, warmup=False,
+                journal=None, api_merge=False):
+    """
+    Deploys the lambdas of the plans that have changes, returns False if
+    the deployment was not confirmed. With warmup the new versions are
+    invoked and compared with the previous ones. With a journal only the
+    stages a restored plan did not complete are run. With api_merge the
+    api resources are added with one OpenAPI merge per rest api
+    """
+    changed = [plan for plan in plans if plan.error is None and plan.changes]
+    if plan_only:
+        return False
+    if not changed:
+        failed = len([plan for plan in plans if plan.error])
+        print(f"Nothing to deploy, {failed} lambdas could not be planned" if failed
+              else "Nothing to deploy, all lambdas are up to date")
+        return True
+    if not get_lambda_confirmation():
+        return False
+    changed = publish_shared_layers(changed)
+    if not changed:
+        return True
+    warmup_history = WarmupHistory() if warmup else None
+    scheduler = DeployScheduler(concurrency, journal=journal, api_merge=api_merge)
+    for plan in changed:
+        stages = get_deploy_stages(plan, scheduler.api_deployments, warmup_history, journal)
+        if journal is not None:
+            stages = journal.start(plan, stages)
+            # the batch of an interrupted run may not have merged the api
+            # resource or deployed the api stage
+            if 'api' not in [stage.name for stage in stages]:
+                api_id = plan.lambda_data.api_id
+                if plan.needs('api_resource') and api_merge:
+                    scheduler.api_deployments.add_resource(api_id, plan.function_name, plan.label,
+                                                           plan.target)
+                if plan.needs('api_stage'):
+                    scheduler.api_deployments.add(api_id, plan.env, plan.label, plan.target)
+        scheduler.add(plan.label, stages, plan.target)
+    scheduler.run()
+    if warmup_history is not None:
+        warmup_history.save()
+        warmup_history.display_report()
+    return True
+
+
+def get_source_paths(function_name, bundle):
+    """Returns the local files a bundle was built from"""
+    paths = {function_name + '.py'}
+    paths.update(file_name for file_name in bundle.sources if file_name != HANDLER_FILE)
+    return paths
 
 
-def validate_lambdas(lambdas_data):
+def get_modification_time(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class SourceWatcher:
+    """Polls the modification times of the sources of the watched lambdas"""
+
+    def __init__(self, plans):
+        self.paths = {}
+        self.modification_times = {}
+        for plan in plans:
+            self.track(plan)
+
+    def track(self, plan):
+        """Watches the sources of the current bundle of a lambda"""
+        self.paths[plan.label] = get_source_paths(plan.function_name, plan.bundle)
+        for path in self.paths[plan.label]:
+            if path not in self.modification_times:
+                self.modification_times[path] = get_modification_time(path)
+
+    def poll(self):
+        """Returns the paths that changed since the last poll"""
+        changed = set()
+        for path, modification_time in self.modification_times.items():
+            current = get_modification_time(path)
+            if current != modification_time:
+                self.modification_times[path] = current
+                changed.add(path)
+        return changed
+
+    def wait_for_changes(self):
+        """
+        Blocks until sources change and then until a poll finds no further
+        change, so the saves of an edit are deployed as one batch. Returns
+        the lambdas that use the changed sources
+        """
+        changed = set()
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            new_changes = self.poll()
+            if new_changes:
+                changed.update(new_changes)
+            elif changed:
+                return sorted(label for label, paths in self.paths.items() if paths & changed)
+
+
+def get_fast_plan(plan, bundle_options, bundles=None):
+    """
+    Plans a watched lambda whose sources changed, only the code update and
+    the alias move are planned, configuration and api changes are left to
+    a full deploy. bundles keeps the new bundles for the other targets
+    """
+    bundles = {} if bundles is None else bundles
+    if get_bundle_key(plan) not in bundles:
+        bundles[get_bundle_key(plan)] = create_lambda_bundle(
+            plan.function_name, plan.env, plan.lambda_data.runtime,
+            bundle_options.get('bytecode'), plan.layer_modules)
+    bundle = bundles[get_bundle_key(plan)]
+    fast_plan = FunctionPlan(plan.function_name, plan.env, plan.description, plan.lambda_data)
+    fast_plan.label = plan.label
+    fast_plan.bundle = bundle
+    fast_plan.layer_plans = plan.layer_plans
+    fast_plan.layer_modules = plan.layer_modules
+    fast_plan.actual = plan.actual
+    if bundle.code_sha != plan.bundle.code_sha:
+        fast_plan.add('code', f"{plan.bundle.code_sha} -> {bundle.code_sha}")
+        fast_plan.add('publish', 'new version')
+        fast_plan.add('alias', 'update ' + plan.env)
+    return fast_plan
+
+
+def redeploy_changed_sources(plans, labels, concurrency, bundle_options):
+    """Redeploys the code of the given watched lambdas, plans are keyed by their label"""
+    start_time = time.time()
+    scheduler = DeployScheduler(concurrency)
+    fast_plans = {}
+    bundles = {}
+    for label in labels:
+        try:
+            fast_plan = get_fast_plan(plans[label], bundle_options, bundles)
+        except Exception as error:
+            print(f"{label}: could not be bundled, {type(error).__name__}: {error}")
+            continue
+        if not fast_plan.changes:
+            print(f"{label}: bundle unchanged")
+            continue
+        fast_plans[label] = fast_plan
+        scheduler.add(label, get_deploy_stages(fast_plan), fast_plan.target)
+    if not fast_plans:
+        return
+
+    scheduler.run()
+    for deployment in scheduler.deployments:
+        if deployment.status == 'succeeded':
+            plans[deployment.function_name].bundle = fast_plans[deployment.function_name].bundle
+    print(f"Redeployed {len(fast_plans)} lambdas in {time.time() - start_time:.1f}s")
+
+
+def watch_lambdas(functions, env, concurrency=DEFAULT_CONCURRENCY, bundle_options=None,
+                  regions=None):
+    """
+    Redeploys the lambdas whose sources change until interrupted. The
+    deployed state is read once when watching starts, every batch after
+    that only updates the code and moves the alias
+    """
+    bundle_options = bundle_options or {}
+    plans = {plan.label: plan
+             for plan in plan_deployments(functions, env, concurrency, bundle_options, regions)
+             if plan.error is None}
+    for plan in plans.values():
+        if plan.changes:
+            print(f"{plan.label} has changes a watch redeploy does not apply: "
+                  + ', '.join(action for action, _ in plan.changes) + ", run a full deploy")
+
+    watcher = SourceWatcher(plans.values())
+    print(f"Watching the sources of {len(plans)} lambdas, press Ctrl+C to stop")
+    try:
+        while True:
+            labels = watcher.wait_for_changes()
+            print("Sources changed: " + ', '.join(labels))
+            redeploy_changed_sources(plans, labels, concurrency, bundle_options)
+            for label in labels:
+                watcher.track(plans[label])
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+
+def get_bundle_options(args):
+    return {
+        'bytecode': args.get('bytecode'),
+        'import_report': args.get('import_report'),
+    }
+
+
+def validate_lambdas(lambdas_data, env):
     """
     The function that will validate the json file of lambdas that we want to
     deploy, It will check that if all the lambdas mentioned are also
-    mentioned in configuration file
+    mentioned in configuration file with a valid configuration
     """
     validate = True
     for data in lambdas_data:
-        lambda_data = get_lambda_data(data.get('name'))
+        try:
+            lambda_data = get_lambda_data(data.get('name'), env)
+        except ConfigurationError as error:
+            print(f"*** Invalid configuration of lambda {error} ***")
+            validate = False
+            continue
         if not lambda_data:
             print(f"*** Lambda {data.get('name')} does not exist in "
                   + "configuration file, please add it in file ***")
@@ -598,6 +2851,24 @@ def validate_lambdas(lambdas_data):
     return validate
 
 
+def get_journal(env, resume):
+    """
+    Returns the journal a deploy records its stages in, the one of the last
+    run when resuming. Returns None if that journal is of another env
+    """
+    if not resume:
+        return DeployJournal(env)
+    try:
+        journal = DeployJournal.load(env)
+    except ConfigurationError as error:
+        print(f"*** Can not resume, {error} ***")
+        return None
+    if journal is None:
+        print(f"No {DEPLOY_JOURNAL_FILE} to resume, deploying from the start")
+        return DeployJournal(env)
+    return journal
+
+
 def deploy_lambdas(args):
     """
     this function is responsible for calling necessary functions to deploy
@@ -605,62 +2876,45 @@ def deploy_lambdas(args):
     check all the sufficent info and then deploy/create those lambdas
     """
     filename = args.get("lambdas_file")
-    file_obj = open(filename, 'r', encoding='UTF-8')
-    lambdas_data = json.load(file_obj).get('functions')
+    concurrency = args.get("concurrency") or DEFAULT_CONCURRENCY
+    with open(filename, 'r', encoding='UTF-8') as file_obj:
+        lambdas_data = json.load(file_obj).get('functions')
 
-    validate = validate_lambdas(lambdas_data)
+    validate = validate_lambdas(lambdas_data, args.get('env'))
 
     if validate:
         display_json_lambda_data(lambdas_data, args.get('env'))
-        if get_lambda_confirmation():
-            for data in lambdas_data:
-                lambda_data = get_lambda_data(data.get('name'))
-                func_data = [data.get('name'),
-                             args.get('env'),
-                             data.get('description')]
-
-                print(func_data[0])
-                if not check_lambda_existence(func_data[0]):
-                    create_lambda_on_aws(lambda_data, func_data[0])
-                    print("Lambda created on AWS")
-                else:
-                    update_lambda_configuration(lambda_data)
-                response = CLIENT.get_function_configuration(
-                        FunctionName=func_data[0],
-                    )
-                while response['State'] == LambdaStates.PENDING:
-                    response = CLIENT.get_function_configuration(
-                        FunctionName=func_data[0],
-                    )
-                change_env_in_code(func_data[0], func_data[1])
-                deploy_lambda(func_data)
-
-def check_lambda_existence(lambda_name):
-    """Checking if wether the given lambda exists on aws cloud"""
-    try:
-        CLIENT.get_function(
-            FunctionName=lambda_name,
-        )
-    except ClientError as error:
-        if (error.response['Error']['Code'] ==
-                'ResourceNotFoundException'):
-            return False
-    return True
-
-
-def create_lambda_on_aws(lambda_data, func_name):
-    CLIENT.create_function(
-        FunctionName=lambda_data.get('FunctionArn'),
-        Handler= "lambda_function.lambda_handler",
-        Runtime=lambda_data.get('Runtime'),
-        Role=lambda_data.get('Role'),
-        Timeout=lambda_data.get('Timeout'),
-        MemorySize=lambda_data.get('MemorySize'),
+        functions = [(data.get('name'), data.get('description'),
+                      get_lambda_data(data.get('name'), args.get('env')))
+                     for data in lambdas_data]
+        journal = get_journal(args.get('env'), args.get('resume'))
+        if journal is None:
+            return
+        plans = plan_deployments(functions, args.get('env'), concurrency,
+                                 get_bundle_options(args), args.get('regions'),
+                                 journal if args.get('resume') else None)
+        display_plan(plans)
+        confirmed = apply_plans(plans, concurrency, args.get('plan'), args.get('warmup'), journal,
+                                args.get('api_merge'))
+        if confirmed and args.get('watch'):
+            watch_lambdas(functions, args.get('env'), concurrency, get_bundle_options(args),
+                          args.get('regions'))
+        report_telemetry(args)
+
+
+def create_lambda_on_aws(lambda_data, func_name, bundle):
+    get_client('lambda').create_function(
+        FunctionName=lambda_data.function_arn,
+        Handler= LAMBDA_HANDLER,
+        Runtime=lambda_data.runtime,
+        Role=lambda_data.role,
+        Timeout=lambda_data.timeout,
+        MemorySize=lambda_data.memory_size,
         Code={
-            'ZipFile': get_lambda_bundle_as_zip(func_name)
+            'ZipFile': bundle
         },
         PackageType='Zip',
-        Layers= lambda_data.get('layers')
+        Layers= lambda_data.layers
     )
 
 
@@ -679,21 +2933,32 @@ def deploy_single_lambda(args, lambda_data):
                  vars(args).get('env'),
                  vars(args).get('description')]
     display_lambda_data(lambda_data, func_data[0], func_data[1], func_data[2])
-    if get_lambda_confirmation():
-        if not check_lambda_existence(func_data[0]):
-            create_lambda_on_aws(lambda_data, func_data[0])
-            print("Lambda created on AWS")
-        else:
-            update_lambda_configuration(lambda_data)
-        response = CLIENT.get_function_configuration(
-                FunctionName=func_data[0],
-            )
-        while response['State'] == LambdaStates.PENDING:
-            response = CLIENT.get_function_configuration(
-                FunctionName=func_data[0],
-            )
-        change_env_in_code(func_data[0], func_data[1])
-        deploy_lambda(func_data)
+    journal = get_journal(func_data[1], vars(args).get('resume'))
+    if journal is None:
+        return
+    plans = plan_deployments([(func_data[0], func_data[2], lambda_data)], func_data[1], 1,
+                             get_bundle_options(vars(args)), vars(args).get('regions'),
+                             journal if vars(args).get('resume') else None)
+    display_plan(plans)
+    apply_plans(plans, 1, vars(args).get('plan'), vars(args).get('warmup'), journal,
+                vars(args).get('api_merge'))
+    report_telemetry(vars(args))
+
+
+def get_policy_targets(env, regions=None):
+    """Returns the targets whose failure lambda policies are compacted"""
+    targets = get_configuration(env).get_targets() if os.path.exists(CONFIGURATION_FILE) else []
+    return [target for target in targets or [DEFAULT_TARGET]
+            if not regions or target.region in regions]
+
+
+def report_telemetry(args):
+    """Writes the deploy timeline and prints the per function timings if asked"""
+    file_name = args.get('timeline') or TIMELINE_FILE
+    TELEMETRY.write_report(file_name)
+    print(f"Deploy timeline written to {file_name}")
+    if args.get('timings'):
+        TELEMETRY.display_summary()
 
 
 def validate_arguments():
@@ -701,21 +2966,58 @@ def validate_arguments():
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-lambda')
     group.add_argument('-lambdas_file')
+    group.add_argument('-compact_policies', action='store_true',
+                       help="Replace the per function statements of the failure lambdas "
+                       + "with wildcard statements")
     parser.add_argument('-env', type=str, required=True,
                         help="The environment of lambda")
     parser.add_argument('-description', type=str, help="Description of lambda")
+    parser.add_argument('-concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help="Number of lambdas deployed at the same time")
+    parser.add_argument('-bytecode', action='store_true',
+                        help="Ship precompiled pyc files in the bundles")
+    parser.add_argument('-import_report', action='store_true',
+                        help="Measure the import time of modules the bundles need from the runtime")
+    parser.add_argument('-plan', action='store_true',
+                        help="Only print the changes a deploy would make")
+    parser.add_argument('-timeline', type=str, default=TIMELINE_FILE,
+                        help="File the json timeline of the deploy is written to")
+    parser.add_argument('-timings', action='store_true',
+                        help="Print where the time of every function went")
+    parser.add_argument('-warmup', action='store_true',
+                        help="Invoke the new versions with their warmup_payloads and flag "
+                        + "init and invoke duration regressions")
+    parser.add_argument('-watch', action='store_true',
+                        help="After deploying, redeploy the lambdas whose sources change")
+    parser.add_argument('-regions', type=str, nargs='+',
+                        help="Only deploy to the targets of these regions")
+    parser.add_argument('-api_merge', action='store_true',
+                        help="Add the api resources of all lambdas with one OpenAPI merge per "
+                        + "rest api instead of configuring them one call at a time")
+    parser.add_argument('-resume', action='store_true',
+                        help="Continue the deploy recorded in the journal from the stages "
+                        + "that did not complete")
     args = parser.parse_args()
+    if args.watch and not args.lambdas_file:
+        parser.error("-watch needs -lambdas_file")
+    if args.watch and args.env == 'production':
+        parser.error("-watch can not be used to deploy to production")
     return args
 
 
 def main():
     args = validate_arguments()
+    CLIENTS.configure(args.concurrency)
     if vars(args).get('lambda') and not vars(args).get('description'):
         print("usage: deploy.py [-h] (-lambda LAMBDA) -env ENV "
               + "-description DESCRIPTION")
         print("deploy.py: error: the following arguments are required: -description")
     elif vars(args).get('lambda') is not None:
-        lambda_data = get_lambda_data(vars(args).get('lambda'))
+        try:
+            lambda_data = get_lambda_data(vars(args).get('lambda'), vars(args).get('env'))
+        except ConfigurationError as error:
+            print(f"**** Invalid configuration of lambda {error} ****")
+            return
         if lambda_data:
             deploy_single_lambda(args, lambda_data)
         elif not lambda_data:
@@ -723,6 +3025,13 @@ def main():
                   + " file, Please add it in the file ****")
     elif vars(args).get('lambdas_file') is not None:
         deploy_lambdas(vars(args))
+    elif vars(args).get('compact_policies'):
+        targets = get_policy_targets(vars(args).get('env'), vars(args).get('regions'))
+        compact_failure_policies(targets, apply=False)
+        if not vars(args).get('plan'):
+            choice = input("Are you sure you want to compact these policies (Y/N): ")
+            if choice in ('y', 'Y'):
+                compact_failure_policies(targets)
 
 
 if __name__ == "__main__":
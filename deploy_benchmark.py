@@ -0,0 +1,174 @@
+"""
+Offline deploy benchmark, deploys synthetic lambdas_files of different
+sizes against aws_stand_in and reports the wall time and the AWS calls
+per function of a first deploy, an unchanged re-deploy and a code change
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from aws_stand_in import StandInServer, add_option_arguments, get_options
+
+DEPLOY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deploy.py')
+DEFAULT_SIZES = [10, 100, 500]
+FUNCTION_PREFIX = 'bench_fn_'
+FUNCTION_SOURCE = '''import json
+import environment
+ENVIRONMENT = environment.ENVIRONMENT
+REVISION = {revision}
+
+
+def lambda_handler(event, context):
+    return {{'statusCode': 200, 'body': json.dumps({{'env': ENVIRONMENT, 'revision': REVISION}})}}
+'''
+
+
+def write_functions(directory, size, apis, revision):
+    """Writes the sources, configurations.json and lambdas.json of a synthetic deploy"""
+    configurations = {}
+    functions = []
+    for index in range(size):
+        function_name = f"{FUNCTION_PREFIX}{index:04}"
+        with open(os.path.join(directory, function_name + '.py'), 'w', encoding='UTF-8') as file_obj:
+            file_obj.write(FUNCTION_SOURCE.format(revision=revision))
+        configurations[function_name] = {
+            'FunctionArn': function_name,
+            'Runtime': 'python3.11',
+            'Role': 'arn:aws:iam::384060451980:role/deploy-benchmark',
+            'Timeout': 30,
+            'MemorySize': 256,
+            'ApiId': f"benchapi{index % apis}",
+            'logs': True,
+        }
+        functions.append({'name': function_name, 'description': f"benchmark revision {revision}"})
+
+    with open(os.path.join(directory, 'configurations.json'), 'w', encoding='UTF-8') as file_obj:
+        json.dump(configurations, file_obj)
+    with open(os.path.join(directory, 'lambdas.json'), 'w', encoding='UTF-8') as file_obj:
+        json.dump({'functions': functions}, file_obj)
+
+
+def get_stand_in_stats(endpoint_url):
+    with urllib.request.urlopen(endpoint_url + '/_stand_in/stats') as response:
+        return json.load(response)
+
+
+def run_deploy(directory, endpoint_url, env, concurrency):
+    """Runs deploy.py against the stand-in and returns its output, wall time and timeline"""
+    environment = dict(os.environ,
+                       AWS_ENDPOINT_URL=endpoint_url,
+                       AWS_ACCESS_KEY_ID='benchmark',
+                       AWS_SECRET_ACCESS_KEY='benchmark',
+                       AWS_DEFAULT_REGION='us-west-2',
+                       AWS_CONFIG_FILE=os.devnull,
+                       AWS_SHARED_CREDENTIALS_FILE=os.devnull)
+    environment.pop('AWS_PROFILE', None)
+    timeline_file = os.path.join(directory, 'deploy_timeline.json')
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, DEPLOY_FILE, '-lambdas_file', 'lambdas.json',
+                             '-env', env, '-concurrency', str(concurrency),
+                             '-timeline', timeline_file],
+                            cwd=directory, env=environment, input='y\n',
+                            capture_output=True, text=True, check=False)
+    wall_time = time.perf_counter() - start_time
+    timeline = None
+    if os.path.exists(timeline_file):
+        with open(timeline_file, 'r', encoding='UTF-8') as file_obj:
+            timeline = json.load(file_obj)
+    return result, wall_time, timeline
+
+
+def count_calls(before, after, operation):
+    return after['calls'].get(operation, 0) - before['calls'].get(operation, 0)
+
+
+def summarize(name, size, result, wall_time, timeline, before, after):
+    calls = after['total_calls'] - before['total_calls']
+    match = re.search(r'(\d+)/(\d+) functions deployed', result.stdout)
+    deployed = f"{match.group(1)}/{match.group(2)}" if match else \
+        ('0 changed' if 'Nothing to deploy' in result.stdout else 'error')
+    retries = sum(call['retries'] for call in timeline['calls']) if timeline else 0
+    return {
+        'size': size,
+        'pass': name,
+        'wall_time': wall_time,
+        'calls': calls,
+        'calls_per_function': calls / size,
+        # a plan reads the alias policy of every function and the shared
+        # failure lambda policies once
+        'policy_reads': count_calls(before, after, 'lambda.get_policy'),
+        # and the stage of every rest api once
+        'stage_reads': count_calls(before, after, 'apigateway.get_stage'),
+        'throttled': after['throttled'] - before['throttled'],
+        'retries': retries,
+        'deployed': deployed,
+        'returncode': result.returncode,
+    }
+
+
+def run_size(server, size, args):
+    """Runs the passes of one deploy size in a fresh directory and stand-in state"""
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='deploy_benchmark_') as directory:
+        server.stand_in.reset()
+        passes = [('initial', 1), ('unchanged', 1), ('code_change', 2)]
+        for name, revision in passes:
+            write_functions(directory, size, args.apis, revision)
+            before = get_stand_in_stats(server.endpoint_url)
+            result, wall_time, timeline = run_deploy(directory, server.endpoint_url,
+                                                     args.env, args.concurrency)
+            after = get_stand_in_stats(server.endpoint_url)
+            rows.append(summarize(name, size, result, wall_time, timeline, before, after))
+            if result.returncode != 0:
+                print(result.stdout[-2000:] + result.stderr[-2000:])
+    return rows
+
+
+def display_rows(rows):
+    print(f"{'size':>5} {'pass':<12} {'wall s':>8} {'calls':>7} {'calls/fn':>9} "
+          + f"{'policies':>9} {'stages':>7} {'throttled':>10} {'retries':>8}  deployed")
+    for row in rows:
+        print(f"{row['size']:>5} {row['pass']:<12} {row['wall_time']:>8.2f} {row['calls']:>7} "
+              + f"{row['calls_per_function']:>9.1f} {row['policy_reads']:>9} {row['stage_reads']:>7} "
+              + f"{row['throttled']:>10} "
+              + f"{row['retries']:>8}  {row['deployed']}")
+
+
+def validate_arguments():
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument('-sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Number of functions of every benchmark deploy")
+    parser.add_argument('-concurrency', type=int, default=8,
+                        help="Concurrency deploy.py is run with")
+    parser.add_argument('-apis', type=int, default=4,
+                        help="Number of rest apis the functions are spread over")
+    parser.add_argument('-env', type=str, default='staging')
+    parser.add_argument('-output', type=str, help="Json file the results are written to")
+    add_option_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = validate_arguments()
+    server = StandInServer(get_options(args))
+    server.start()
+    rows = []
+    try:
+        for size in args.sizes:
+            rows.extend(run_size(server, size, args))
+    finally:
+        server.stop()
+    display_rows(rows)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as file_obj:
+            json.dump(rows, file_obj, indent=2)
+
+
+if __name__ == "__main__":
+    main()
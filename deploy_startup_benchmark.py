@@ -0,0 +1,76 @@
+"""
+Startup benchmark for the deploy.py CLI, times the commands that return
+before anything is deployed and lists the slowest imports
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+DEPLOY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deploy.py')
+# name: arguments passed to deploy.py
+COMMANDS = {
+    'help': ['-h'],
+    'argument_error': ['-env', 'staging'],
+}
+
+
+def time_command(python, arguments, runs):
+    """Returns the wall time of every run of the command in ms"""
+    durations = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run([python, DEPLOY_FILE] + arguments, capture_output=True, check=False)
+        durations.append((time.perf_counter() - start_time) * 1000)
+    return durations
+
+
+def get_import_times(python, arguments):
+    """Returns (cumulative ms, module) of every import of a command"""
+    result = subprocess.run([python, '-X', 'importtime', DEPLOY_FILE] + arguments,
+                            capture_output=True, text=True, check=False)
+    import_times = []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            import_times.append((int(fields[1]) / 1000, fields[2].strip()))
+    return import_times
+
+
+def display_timings(name, durations):
+    ordered = sorted(durations)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<16} min {ordered[0]:>7.1f}  median {statistics.median(ordered):>7.1f}  "
+          + f"p95 {p95:>7.1f} ms")
+
+
+def display_imports(import_times, top):
+    """Prints the slowest top level imports"""
+    top_level = [item for item in import_times if '.' not in item[1].lstrip()]
+    print("Slowest imports of deploy.py -h:")
+    for cumulative, module in sorted(top_level, reverse=True)[:top]:
+        print(f"  {module:<32} {cumulative:>7.1f} ms")
+    loaded = {module.strip() for _, module in import_times}
+    print("boto3 imported at startup: " + ('yes' if 'boto3' in loaded else 'no'))
+
+
+def validate_arguments():
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument('-runs', type=int, default=20, help="Runs per command")
+    parser.add_argument('-python', type=str, default=sys.executable,
+                        help="Interpreter deploy.py is run with")
+    parser.add_argument('-top', type=int, default=10, help="Number of imports listed")
+    return parser.parse_args()
+
+
+def main():
+    args = validate_arguments()
+    for name, arguments in COMMANDS.items():
+        display_timings(name, time_command(args.python, arguments, args.runs))
+    display_imports(get_import_times(args.python, COMMANDS['help']), args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Turns the FILTER_USAGE lines logged by product-get-batch into Postgres
+index recommendations and optionally benchmarks them against a local
+Postgres database
+"""
+import argparse
+import json
+import re
+import statistics
+import time
+
+USAGE_LOG_MARKER = 'FILTER_USAGE '
+# share of requests a column has to appear in together with a visibility
+# filter on is_hidden before a partial index is recommended
+PARTIAL_INDEX_THRESHOLD = 0.8
+EQUALITY_OPERATORS = ('__exact', '__in', '__notexact', '__isnull', '__is', '__not')
+RANGE_OPERATORS = ('__greaterthanrequals', '__lessthanrequals')
+# columns already indexed by the primary key of their table
+PRIMARY_KEY_COLUMNS = {'product': ['id']}
+INDEX_DEFINITION_PATTERN = re.compile(r'USING (\w+) \((.*?)\)( WHERE .*)?$')
+
+# The has_access_to join always aggregates visible shares only
+STATIC_RECOMMENDATIONS = [
+    {
+        'name': 'shared_products_visible_product_id_idx',
+        'sql': 'CREATE INDEX IF NOT EXISTS shared_products_visible_product_id_idx '
+               + 'ON shared_products (product_id) WHERE is_hidden IS NOT TRUE',
+        'reason': 'has_access_to aggregates shared_products WHERE is_hidden is not True',
+        'attributes': ['has_access_to', 'is_shared']
+    }
+]
+
+
+class UsageStats:
+    """Aggregated usage of a single attribute and operator pair"""
+
+    def __init__(self, entry):
+        self.attribute = entry['attribute']
+        self.operator = entry['operator']
+        self.table = entry['table']
+        self.column = entry['column']
+        self.data_type = entry['type']
+        self.derived = entry.get('derived', False)
+        self.latencies = []
+        self.visible_only = 0
+
+    def add(self, latency_ms, visible_only):
+        self.latencies.append(latency_ms)
+        if visible_only:
+            self.visible_only += 1
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    @property
+    def total_latency(self):
+        return sum(self.latencies)
+
+    @property
+    def p95_latency(self):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def is_visible_only(filters):
+    """Checks if a request filtered out hidden products"""
+    for entry in filters:
+        if entry['table'] == 'product' and entry['column'] == 'is_hidden':
+            value = entry.get('value')
+            if (entry['operator'] in ('__exact', '__is') and value == 'false') or \
+                    (entry['operator'] in ('__not', '__notexact') and value == 'true'):
+                return True
+    return False
+
+
+def read_usage_logs(file_names):
+    """Reads FILTER_USAGE lines from exported lambda logs"""
+    usage = {}
+    requests = 0
+    for file_name in file_names:
+        with open(file_name, 'r', encoding='UTF-8') as file_obj:
+            for line in file_obj:
+                if USAGE_LOG_MARKER not in line:
+                    continue
+                record = json.loads(line.split(USAGE_LOG_MARKER, 1)[1])
+                requests += 1
+                visible_only = is_visible_only(record['filters'])
+                seen = set()
+                for entry in record['filters']:
+                    key = (entry['attribute'], entry['operator'])
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    if key not in usage:
+                        usage[key] = UsageStats(entry)
+                    usage[key].add(record['latency_ms'], visible_only)
+    return usage, requests
+
+
+def get_index_definition(stats):
+    """Returns the index method, the indexed expression and the kind of lookup for a filter"""
+    if stats.operator == '__contains':
+        return 'gin', f"{stats.column} jsonb_path_ops", 'containment'
+    if stats.operator == '__like':
+        return 'gin', f"{stats.column} gin_trgm_ops", 'pattern'
+    if stats.operator in EQUALITY_OPERATORS:
+        return 'btree', stats.column, 'equality'
+    if stats.operator in RANGE_OPERATORS:
+        return 'btree', stats.column, 'range'
+    return None, None, None
+
+
+def read_existing_indexes(dsn):
+    """
+    Returns the table, method and leading expression of the indexes of the
+    database that are not partial, a recommendation they lead with is redundant
+    """
+    # psycopg2 is only needed when a database is passed
+    import psycopg2
+
+    connection = psycopg2.connect(dsn)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tablename, indexdef FROM pg_indexes WHERE schemaname = current_schema()')
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+
+    existing = set()
+    for table, definition in rows:
+        match = INDEX_DEFINITION_PATTERN.search(definition)
+        if match is None or match.group(3):
+            continue
+        existing.add((table, match.group(1), normalize_expression(match.group(2).split(',')[0])))
+    return existing
+
+
+def normalize_expression(expression):
+    return ' '.join(expression.replace('"', '').lower().split())
+
+
+def recommend_indexes(usage, requests, min_count, existing=()):
+    """
+    Builds index recommendations ordered by the latency they affect, columns
+    of a primary key or with an existing index are skipped
+    """
+    recommendations = {}
+    ordered_usage = sorted(usage.values(), key=lambda item: item.total_latency, reverse=True)
+    for stats in ordered_usage:
+        # derived tables are subqueries, they can only be indexed on their source tables
+        if stats.derived or stats.count < min_count:
+            continue
+        if stats.table == 'product' and stats.column == 'is_hidden':
+            continue
+        if stats.column in PRIMARY_KEY_COLUMNS.get(stats.table, []):
+            continue
+        method, expression, kind = get_index_definition(stats)
+        if method is None or (stats.table, method, normalize_expression(expression)) in existing:
+            continue
+
+        where = ''
+        if stats.table == 'product' and stats.visible_only / stats.count >= PARTIAL_INDEX_THRESHOLD:
+            where = ' WHERE is_hidden IS NOT TRUE'
+        name = f"{stats.table}_{stats.column}_{method}{'_visible' if where else ''}_idx"
+        if name in recommendations:
+            recommendations[name]['attributes'].append(stats.attribute + stats.operator)
+            recommendations[name]['requests'] += stats.count
+            continue
+
+        sql = f"CREATE INDEX IF NOT EXISTS {name} ON {stats.table} USING {method} ({expression}){where}"
+        recommendations[name] = {
+            'name': name,
+            'sql': sql,
+            'reason': f"{kind} filter {stats.attribute}{stats.operator} used in {stats.count} of {requests} requests, "
+                      + f"p95 {stats.p95_latency:.0f} ms",
+            'attributes': [stats.attribute + stats.operator],
+            'requests': stats.count,
+            'extension': 'pg_trgm' if expression.endswith('gin_trgm_ops') else None
+        }
+
+    return list(recommendations.values()) + STATIC_RECOMMENDATIONS
+
+
+def display_recommendations(recommendations):
+    """Prints the recommendations as a sql script"""
+    extensions = {item.get('extension') for item in recommendations if item.get('extension')}
+    for extension in sorted(extensions):
+        print(f"CREATE EXTENSION IF NOT EXISTS {extension};")
+    for item in recommendations:
+        print(f"-- {item['reason']}")
+        print(item['sql'] + ';')
+
+
+def read_queries(file_name):
+    """Reads benchmark queries separated by semicolons"""
+    with open(file_name, 'r', encoding='UTF-8') as file_obj:
+        return [query.strip() for query in file_obj.read().split(';') if query.strip()]
+
+
+def time_queries(cursor, queries, runs):
+    """Returns the median execution time of every query in ms"""
+    timings = []
+    for query in queries:
+        durations = []
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            cursor.execute(query)
+            cursor.fetchall()
+            durations.append((time.perf_counter() - start_time) * 1000)
+        timings.append(statistics.median(durations))
+    return timings
+
+
+def run_benchmark(dsn, recommendations, queries, runs, keep):
+    """
+    Times the queries, creates the recommended indexes, times them again and
+    drops the indexes unless they should be kept
+    """
+    # psycopg2 is only needed for the benchmark
+    import psycopg2
+
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            before = time_queries(cursor, queries, runs)
+            for extension in {item.get('extension') for item in recommendations if item.get('extension')}:
+                cursor.execute(f"CREATE EXTENSION IF NOT EXISTS {extension}")
+            for item in recommendations:
+                cursor.execute(item['sql'])
+            cursor.execute('ANALYZE')
+            after = time_queries(cursor, queries, runs)
+            if not keep:
+                for item in recommendations:
+                    cursor.execute(f"DROP INDEX IF EXISTS {item['name']}")
+    finally:
+        connection.close()
+
+    print("---------------------------------------------------")
+    print(f"{'query':>5} {'before ms':>12} {'after ms':>12} {'speedup':>8}")
+    for index, (before_ms, after_ms) in enumerate(zip(before, after)):
+        speedup = before_ms / after_ms if after_ms else 0
+        print(f"{index:>5} {before_ms:>12.2f} {after_ms:>12.2f} {speedup:>7.1f}x")
+
+
+def validate_arguments():
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument('-logs', nargs='+', required=True,
+                        help="Exported product-get-batch log files")
+    parser.add_argument('-min_count', type=int, default=1,
+                        help="Minimum number of requests using a filter")
+    parser.add_argument('-dsn', type=str, help="Local postgres to benchmark against")
+    parser.add_argument('-queries', type=str,
+                        help="File of ; separated queries used for the benchmark")
+    parser.add_argument('-runs', type=int, default=5, help="Runs per query")
+    parser.add_argument('-keep', action='store_true',
+                        help="Keep the indexes created by the benchmark")
+    args = parser.parse_args()
+    if args.dsn and not args.queries:
+        parser.error("-queries is required with -dsn")
+    return args
+
+
+def main():
+    args = validate_arguments()
+    usage, requests = read_usage_logs(args.logs)
+    if not requests:
+        print("No FILTER_USAGE lines found in the logs")
+        return
+    existing = read_existing_indexes(args.dsn) if args.dsn else set()
+    recommendations = recommend_indexes(usage, requests, args.min_count, existing)
+    display_recommendations(recommendations)
+    if args.dsn:
+        run_benchmark(args.dsn, recommendations, read_queries(args.queries),
+                      args.runs, args.keep)
+
+
+if __name__ == "__main__":
+    main()
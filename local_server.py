@@ -0,0 +1,205 @@
+"""
+Long running HTTP server that serves product-get-batch outside of lambda.
+The lambda module is loaded once, so the database client and the compiled
+filter cache are shared by every request, and identical requests that are
+in flight at the same time are coalesced into a single database call
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+LAMBDA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'product-get-batch.py')
+MAX_BODY_SIZE = 10 * 1024 * 1024
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error'
+}
+
+
+class BadRequestError(Exception):
+    """The request line or a header could not be parsed"""
+
+
+def load_lambda_module(file_name):
+    """Imports the lambda source file as a module"""
+    spec = importlib.util.spec_from_file_location('product_get_batch', file_name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def configure_db_pool(module, workers):
+    """
+    Replaces the data api client of the lambda module with one that pools a
+    connection per worker, botocore keeps 10 by default
+    """
+    module.RDS_CLIENT = boto3.client('rds-data', config=Config(max_pool_connections=max(workers, 10)))
+
+
+class RequestCoalescer:
+    """
+    Runs the handler in a worker pool, concurrent calls with the same
+    event share the result of the first one (single flight). Exports have
+    side effects so every export request runs on its own
+    """
+
+    def __init__(self, handler, workers):
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.in_flight = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def handle(self, event):
+        loop = asyncio.get_running_loop()
+        if 'export' in event:
+            self.executed += 1
+            return await loop.run_in_executor(self.executor, self.handler, event, None)
+
+        key = json.dumps(event, sort_keys=True)
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = loop.run_in_executor(self.executor, self.handler, event, None)
+        self.in_flight[key] = future
+        self.executed += 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self.in_flight.pop(key, None)
+
+
+class LocalServer:
+    """Minimal HTTP/1.1 server, POST / invokes the lambda handler"""
+
+    def __init__(self, coalescer):
+        self.coalescer = coalescer
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except BadRequestError as error:
+                    await self.write_response(writer, 400, {'error': str(error)}, False)
+                    break
+                if request is None:
+                    break
+                status, body, keep_alive = await self.route(*request)
+                await self.write_response(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """
+        Returns method, path, headers and body of the next request, raises
+        BadRequestError if it can not be parsed
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise BadRequestError('Malformed request line')
+        method, path, version = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if b':' not in line:
+                raise BadRequestError('Malformed header line')
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise BadRequestError('Invalid Content-Length') from None
+        if length > MAX_BODY_SIZE:
+            return method, path, headers, None
+        body = await reader.readexactly(length) if length else b''
+        headers['version'] = version
+        return method, path, headers, body
+
+    async def route(self, method, path, headers, body):
+        keep_alive = headers.get('version') == 'HTTP/1.1' and \
+            headers.get('connection', '').lower() != 'close'
+        if path == '/health':
+            return 200, {'status': 'ok', 'executed': self.coalescer.executed,
+                         'coalesced': self.coalescer.coalesced}, keep_alive
+        if path != '/':
+            return 404, {'error': 'Not found'}, keep_alive
+        if method != 'POST':
+            return 405, {'error': 'Only POST is supported'}, keep_alive
+        if body is None:
+            return 413, {'error': 'Request body too large'}, False
+
+        try:
+            event = json.loads(body or b'{}')
+        except ValueError:
+            return 400, {'error': 'Request body is not valid json'}, keep_alive
+
+        try:
+            response = await self.coalescer.handle(event)
+        except Exception as error:
+            print('Exception Occured ', error)
+            return 500, {'error': str(error)}, keep_alive
+        return 200, response, keep_alive
+
+    async def write_response(self, writer, status, body, keep_alive):
+        payload = json.dumps(body).encode('UTF-8')
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+
+async def serve(host, port, workers, lambda_file):
+    module = load_lambda_module(lambda_file)
+    configure_db_pool(module, workers)
+    server = LocalServer(RequestCoalescer(module.lambda_handler, workers))
+    tcp_server = await asyncio.start_server(server.handle_connection, host, port)
+    print(f"Serving {lambda_file} on http://{host}:{port}")
+    async with tcp_server:
+        await tcp_server.serve_forever()
+
+
+def validate_arguments():
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument('-host', type=str, default='0.0.0.0')
+    parser.add_argument('-port', type=int, default=8080)
+    parser.add_argument('-workers', type=int, default=16,
+                        help="Handler calls that can run at the same time")
+    parser.add_argument('-lambda_file', type=str, default=LAMBDA_FILE)
+    return parser.parse_args()
+
+
+def main():
+    args = validate_arguments()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.lambda_file))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,17 @@
 This lambda returns all product related data
 in batch
 """
+import abc
+import copy
 import environment
 import re
 from distutils.util import strtobool
 import json
-import ast
+import functools
+import gzip
+import os
+import time
+import uuid
 import boto3 
 from helper import Helper
 
@@ -16,14 +22,37 @@ RDS_CLIENT = boto3.client('rds-data')
 if ENVIRONMENT == 'staging':
     CLUSTER_ARN = ''
     BUCKET_URL = 'https://d3ckjemso196la.cloudfront.net/product_assets/thumbnail/'
+    EXPORT_BUCKET = ''
 if ENVIRONMENT == 'production':
     CLUSTER_ARN = ''
     BUCKET_URL = 'https://d48f7equ64qjl.cloudfront.net/product_assets/thumbnail/'
+    EXPORT_BUCKET = ''
 
 SECRET_ARN = ''
 
 BASE_TABLE = 'product'
 
+# Bulk export settings, rows are fetched in pages of product ids and flushed
+# to the object store as gzipped NDJSON part files. Exports are written to
+# EXPORT_BUCKET, or to the local directory PRODUCT_EXPORT_LOCAL_PATH when it
+# is set for testing. The destination is never taken from the request
+EXPORT_PREFIX = 'product_exports'
+EXPORT_LOCAL_PATH = os.environ.get('PRODUCT_EXPORT_LOCAL_PATH')
+EXPORT_DESTINATION_OPTIONS = ['bucket', 'local_path', 'prefix']
+# set by the export itself, the job id of an asynchronous export is passed to
+# its own invocation in EXPORT_JOB_ID_KEY next to the request
+EXPORT_INTERNAL_OPTIONS = ['job_id']
+EXPORT_JOB_ID_KEY = 'export_job_id'
+EXPORT_PAGE_SIZE = 1000
+EXPORT_ROWS_PER_PART = 5000
+
+# int_arr lists longer than this are sent as a single array parameter
+# instead of being inlined in the query as an IN (...) list
+INLINE_INT_LIST_LIMIT = 20
+
+# Number of compiled filter strings kept per container
+COMPILED_FILTER_CACHE_SIZE = 256
+
 KEYWORDS = {
     '__exact': '=',
     '__in': ' IN ',
@@ -60,6 +89,17 @@ NESTED_QUERY_TABLE = {
     
 }
 
+"""
+Aggregating nested queries restricted to a page of products, used by the
+second phase of paginated queries
+"""
+PAGED_NESTED_QUERY_TABLE = {
+    'has_access_to' : """(SELECT product_id, string_agg('"'||customer_username||'"', ', ') AS has_access, true as is_shared
+    FROM   shared_products
+    WHERE is_hidden is not True and {page_condition}
+    GROUP  BY product_id) as has_access_to"""
+}
+
 """
 Dependant table format:
 table_name: [join type, join_attributes]
@@ -79,6 +119,18 @@ DEPENDANT_TABLES = {
     'project_products': ['LEFT OUTER', 'product_id', 'product.id', '']
 }
 
+"""
+Dependant tables that can return more than one row per product, they are
+only treated as one to one when their join condition filter is passed
+"""
+FAN_OUT_TABLES = ['shared_products', 'arrangement_data', 'collab_products', 'scene_products',
+                  'project_products', 'product_user_assets', 'product_company_assets']
+
+# With nest_fan_out the required fields of a fan out table are aggregated
+# into one list per product by a subquery joined under the table name with
+# this suffix
+AGGREGATED_TABLE_SUFFIX = '_lists'
+
 CONVERSIONS = {
     'date_conversion': "TO_CHAR(%s,\'DD Month YYYY\')",
     'json_conversion': "%s::jsonb",
@@ -209,17 +261,86 @@ CUSTOM_JSON_PARSING = {
     'dimensions' : get_dimensions
 }
 
-def lambda_handler(event, _):
+class ObjectStore(abc.ABC):
+    """
+    Minimal object store interface used by the bulk export mode
+    """
+
+    @abc.abstractmethod
+    def put_object(self, key, body, content_type):
+        pass
+
+    @abc.abstractmethod
+    def get_object(self, key):
+        """Return the body of an object, None when it does not exist"""
+
+
+class S3ObjectStore(ObjectStore):
+    """
+    Object store backed by an s3 bucket
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.client = boto3.client('s3')
+
+    def put_object(self, key, body, content_type):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body,
+                               ContentType=content_type)
+
+    def get_object(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+
+class LocalObjectStore(ObjectStore):
+    """
+    Object store backed by a local directory, used for testing exports
+    without s3
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def put_object(self, key, body, content_type):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file_obj:
+            file_obj.write(body)
+
+    def get_object(self, key):
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file_obj:
+            return file_obj.read()
+
+
+def lambda_handler(event, context):
     """
     Return data according to the filters passed
     """
     print(event)
     post_request_data = event
-    
+    # only an asynchronous export invoking itself passes a job id
+    export_job_id = post_request_data.pop(EXPORT_JOB_ID_KEY, None)
+
     response = {}
-    validation_result, filter_string, filter_tables = run_validation_check(post_request_data)
-    if validation_result is None:
-        response_data = get_data_in_batch(post_request_data, filter_string, filter_tables)
+    filter_usage = []
+    query_parameters = []
+    validation_result, filter_string, filter_tables = run_validation_check(post_request_data, filter_usage,
+                                                                           query_parameters)
+    if validation_result is None and 'export' in post_request_data:
+        start_time = time.perf_counter()
+        response = run_export(post_request_data, filter_string, filter_tables, context, query_parameters,
+                              export_job_id)
+        record_filter_usage(filter_usage, (time.perf_counter() - start_time) * 1000)
+    elif validation_result is None:
+        start_time = time.perf_counter()
+        response_data = get_data_in_batch(post_request_data, filter_string, filter_tables, query_parameters)
+        record_filter_usage(filter_usage, (time.perf_counter() - start_time) * 1000)
         if 'compress_response' in post_request_data and post_request_data['compress_response']:
             response = Helper.compress_data(response_data)
         else:
@@ -229,7 +350,7 @@ def lambda_handler(event, _):
         response = validation_result
     return response
 
-def run_validation_check(post_request_data):
+def run_validation_check(post_request_data, filter_usage=None, query_parameters=None):
     """
     Check if validation passes
     """
@@ -265,14 +386,46 @@ def run_validation_check(post_request_data):
             order_attr = order_attr.replace('asc', '').replace('desc', '').replace(' ','')
             attribute_value = next((attr for attr in ATTRIBUTES if attr[1] == order_attr), None)
             if attribute_value is None:
-                return f"{order_attr} is not a valid attribute in order_by.", ""
-
-    error_message, filter_string, filter_fields = parse_and_validate_filters_strings(post_request_data['filter_string'])
+                return f"{order_attr} is not a valid attribute in order_by.", "", []
+
+    if 'export' in post_request_data:
+        export_error = validate_export_options(post_request_data['export'])
+        if export_error is not None:
+            return export_error, "", []
+
+    if 'nest_fan_out' in post_request_data and not isinstance(post_request_data['nest_fan_out'], bool):
+        return "nest_fan_out should be a boolean", "", []
+
+    (error_message, filter_string, filter_fields), compiled_usage, compiled_parameters = \
+        compile_filter_string(post_request_data['filter_string'])
+    # the compiled filter is cached, every request gets its own copies
+    if filter_usage is not None:
+        filter_usage.extend(copy.deepcopy(compiled_usage))
+    if query_parameters is not None:
+        query_parameters.extend(copy.deepcopy(compiled_parameters))
+    if isinstance(filter_fields, dict):
+        filter_fields = dict(filter_fields)
+        aggregated_tables = get_aggregated_tables(post_request_data, filter_fields)
+        for order_field in get_order_fields(post_request_data['order_by']):
+            if any(table in aggregated_tables for table in get_field_tables([order_field])):
+                return f"{order_field} cannot be used in order_by with nest_fan_out.", "", []
     
     return error_message, filter_string, filter_fields
 
 
-def get_data_in_batch(post_request_data, filter_string, filter_tables):
+@functools.lru_cache(maxsize=COMPILED_FILTER_CACHE_SIZE)
+def compile_filter_string(filters_string):
+    """
+    Parse and validate a filter string once per container, returns the
+    parsed filters along with their usage entries and query parameters
+    """
+    filter_usage = []
+    query_parameters = []
+    result = parse_and_validate_filters_strings(filters_string, filter_usage, query_parameters)
+    return result, tuple(filter_usage), tuple(query_parameters)
+
+
+def get_data_in_batch(post_request_data, filter_string, filter_tables, query_parameters=None):
     """
     Construct query according to:
     - required fields
@@ -281,18 +434,139 @@ def get_data_in_batch(post_request_data, filter_string, filter_tables):
     """
     required_fields = post_request_data['required_fields']
     order_by = post_request_data['order_by']
+
+    if can_use_two_phase_query(post_request_data, filter_tables):
+        return fetch_paginated_data(post_request_data, filter_string, filter_tables, query_parameters)
     
     query = query_construction(required_fields, filter_string, order_by, filter_tables, post_request_data)
    
-    return fetch_data_from_db(query, required_fields)
+    return fetch_data_from_db(query, required_fields, query_parameters,
+                              get_aggregated_tables(post_request_data, filter_tables))
+
+
+def get_order_fields(order_by):
+    """
+    Return attribute names used in order by condition
+    """
+    return [order_attr.replace('asc', '').replace('desc', '').replace(' ', '')
+            for order_attr in order_by.split(',')]
+
+
+def get_field_tables(fields):
+    """
+    Return dependant tables that need to be joined for the fields
+    """
+    tables = []
+    for attr in ATTRIBUTES:
+        if attr[1] in fields:
+            for table in attr[4]:
+                if table not in tables:
+                    tables.append(table)
+    return tables
+
+
+def is_one_to_one_table(table, filter_fields):
+    """
+    Check if joining the table returns at most one row per product
+    """
+    if table not in FAN_OUT_TABLES:
+        return True
+    join_filter = DEPENDANT_TABLES[table][3]
+    return join_filter != '' and filter_fields.get(join_filter) is not None
+
+
+def get_aggregated_tables(post_request_data, filter_fields):
+    """
+    Return the fan out tables of the required fields that are aggregated
+    into one list per product, only when nest_fan_out is passed
+    """
+    if not post_request_data.get('nest_fan_out'):
+        return []
+    return [table for table in get_field_tables(post_request_data['required_fields'])
+            if not is_one_to_one_table(table, filter_fields)]
+
+
+def get_inner_join_fields(fields):
+    """
+    Return the fields that need an inner joined table, joining them can
+    drop products
+    """
+    return [field for field in fields
+            if any(DEPENDANT_TABLES[table][0].lower() == 'inner' for table in get_field_tables([field]))]
+
+
+def can_use_two_phase_query(post_request_data, filter_fields):
+    """
+    A paginated query can be split in an id query and a data query
+    when neither the required fields nor the ordering fan out products.
+    The id has to be required, the rows of the data query are then distinct
+    per product like the rows of the single query
+    """
+    if 'pagination_filters' not in post_request_data:
+        return False
+    if 'id' not in post_request_data['required_fields']:
+        return False
+    if get_pagination_parameters(post_request_data['pagination_filters']) == '':
+        return False
+
+    fields = post_request_data['required_fields'] + get_order_fields(post_request_data['order_by'])
+    return all(is_one_to_one_table(table, filter_fields) for table in get_field_tables(fields))
+
+
+def fetch_paginated_data(post_request_data, filter_string, filter_fields, query_parameters=None):
+    """
+    Fetch a page in two phases, first the ordered page of product ids
+    using only the joins needed by filters, ordering and the inner joins of
+    the required fields, then the required fields for just those ids
+    """
+    required_fields = post_request_data['required_fields']
+    order_by = post_request_data['order_by']
+    order_fields = get_order_fields(order_by)
+
+    id_attributes = [f"{BASE_TABLE}.id"]
+    for order_field in order_fields:
+        attribute_value = next(attr for attr in ATTRIBUTES if attr[1] == order_field)
+        order_attribute = f"{attribute_value[3]}.{attribute_value[0]}"
+        if order_attribute not in id_attributes:
+            id_attributes.append(order_attribute)
+
+    pagination = get_pagination_parameters(post_request_data['pagination_filters'])
+    id_query = f"select DISTINCT {','.join(id_attributes)} from {BASE_TABLE} " \
+               f"{add_joins(order_fields + get_inner_join_fields(required_fields), filter_fields)}" \
+               f"{filter_string} {add_order_by(order_by)}{pagination}"
+    id_records = execute_query(id_query, query_parameters or []).get('records', [])
+    product_ids = [record[0]['longValue'] for record in id_records]
+    if not product_ids:
+        return []
+
+    # only the join filters of the required tables are needed in this phase
+    join_filters = [DEPENDANT_TABLES[table][3] for table in get_field_tables(required_fields)]
+    join_filter_fields = {key: value for key, value in filter_fields.items() if key in join_filters}
+
+    page_parameters = []
+    page_condition = compile_int_list_condition(f"{BASE_TABLE}.id", product_ids, page_parameters)
+    nested_tables = dict(NESTED_QUERY_TABLE)
+    for table, nested_query in PAGED_NESTED_QUERY_TABLE.items():
+        nested_condition = compile_int_list_condition('product_id', product_ids, page_parameters)
+        nested_tables[table] = nested_query.format(page_condition=nested_condition)
+    query = f"select DISTINCT {get_attributes(required_fields)} from {BASE_TABLE} " \
+            f"{add_joins(required_fields, join_filter_fields, nested_tables)} where {page_condition}"
+    records = execute_query(query, page_parameters)['records']
+
+    # id is the first attribute so the first column restores the page order
+    page_order = {product_id: index for index, product_id in enumerate(product_ids)}
+    records.sort(key=lambda record: page_order[record[0]['longValue']])
+    return generate_response(records, required_fields)
 
 
 def query_construction(required_fields, filters, order_by, filter_tables, post_request_data):
     """
-    Only add necessary joins when certain fields are required
+    Only add necessary joins when certain fields are required, with
+    nest_fan_out the fan out tables are joined as one row of lists per product
     """
-    attributes = get_attributes(required_fields)
-    query_joins = add_joins(required_fields, filter_tables)
+    aggregated_tables = get_aggregated_tables(post_request_data, filter_tables)
+    attributes = get_attributes(required_fields, aggregated_tables)
+    query_joins = add_joins(required_fields, filter_tables, aggregated_tables=aggregated_tables)
     query_filters = filters
 
     order_by = add_order_by(order_by)
@@ -310,30 +584,61 @@ def query_construction(required_fields, filters, order_by, filter_tables, post_r
     return query
 
 
-def add_joins(required_fields, filter_fields):
+def add_joins(required_fields, filter_fields, nested_tables=None, aggregated_tables=()):
     """
     Add joins according to required fields 
-    passed in payload
+    passed in payload, aggregated tables are only joined as they are
+    when their fields are filtered on
     """
+    nested_tables = nested_tables or NESTED_QUERY_TABLE
     existing_joins = []
     join_condition = ''
     for attr in ATTRIBUTES:
         if (attr[1] in required_fields or attr[1] in filter_fields) and BASE_TABLE not in attr[4]:
             for table in attr[4]:
+                if table in aggregated_tables and attr[1] not in filter_fields:
+                    continue
                 if table not in existing_joins:
                     existing_joins.append(table)
                     table_value = table
-                    if table in NESTED_QUERY_TABLE:
-                        table_value = NESTED_QUERY_TABLE[table]
+                    if table in nested_tables:
+                        table_value = nested_tables[table]
                     join_condition = f" {join_condition} {DEPENDANT_TABLES[table][0]} join {table_value}\
                     on {table}.{DEPENDANT_TABLES[table][1]} = {DEPENDANT_TABLES[table][2]}"
 
                     if DEPENDANT_TABLES[table][3] != '' and filter_fields[DEPENDANT_TABLES[table][3]] is not None:
                         join_condition = f"{join_condition} and {filter_fields[DEPENDANT_TABLES[table][3]]}"
+
+    for table in aggregated_tables:
+        join_condition = f"{join_condition} {get_aggregated_join(table, required_fields, nested_tables)}"
     
     return join_condition
 
 
+def get_aggregated_join(table, required_fields, nested_tables):
+    """
+    Return the join of a fan out table grouped by product, every required
+    attribute of the table is aggregated into a json list. All lists are
+    ordered by the same distinct rows so their items line up
+    """
+    attributes = [attr for attr in ATTRIBUTES if attr[3] == table and attr[1] in required_fields]
+    join_attribute = DEPENDANT_TABLES[table][1]
+    columns = []
+    for column in [join_attribute] + [attr[0] for attr in attributes]:
+        if column not in columns:
+            columns.append(column)
+    distinct_columns = ','.join(f"{table}.{column}" for column in columns)
+    ordering = ','.join(f"{table}.{column}" for column in columns[1:])
+    aggregates = ','.join(f"jsonb_agg({get_attribute_value(attr)} order by {ordering}) as {attr[1]}"
+                          for attr in attributes)
+    aggregated_table = table + AGGREGATED_TABLE_SUFFIX
+
+    return f"{DEPENDANT_TABLES[table][0]} join (select {table}.{join_attribute},{aggregates} " \
+           f"from (select DISTINCT {distinct_columns} from {nested_tables.get(table, table)}) as {table} " \
+           f"group by {table}.{join_attribute}) as {aggregated_table} " \
+           f"on {aggregated_table}.{join_attribute} = {DEPENDANT_TABLES[table][2]}"
+
+
 def add_order_by(order_by):
     """
     Add order_by condition in query according to
@@ -360,10 +665,12 @@ def add_order_by(order_by):
     return order_by_condition
 
 
-def parse_and_validate_filters_strings(filters_string):
+def parse_and_validate_filters_strings(filters_string, filter_usage=None, query_parameters=None):
     """
     Add filters in where clause of query according to
-    filters passed in payload
+    filters passed in payload, every compiled condition is
+    appended to filter_usage when a list is passed and large
+    integer lists are added to query_parameters when a list is passed
     """
     error_message = None
     filter_fields = {}
@@ -407,7 +714,11 @@ def parse_and_validate_filters_strings(filters_string):
                         else: 
                             error_message = f"{check_type} is an invalid operation."
                             return error_message, "", []
-                        if check_type == '__in':
+                        if check_type == '__in' and query_parameters is not None and \
+                                next(attr for attr in ATTRIBUTES if attr[1] == attribute)[2] == 'int_arr':
+                            int_list = parse_int_list(value.replace("'", '').replace('"', ''))
+                            condition = compile_int_list_condition(attribute_value, int_list, query_parameters)
+                        elif check_type == '__in':
                             condition = condition.replace('[', '(').replace(']', ')')
                         elif check_type == '__isnull':
                             condition = condition.replace('true', ' NULL ').replace('false', ' not NULL ')
@@ -415,6 +726,8 @@ def parse_and_validate_filters_strings(filters_string):
                         if check_type == '__exact':
                             if attribute in filter_fields:
                                 filter_fields[attribute] = condition
+                        if filter_usage is not None:
+                            filter_usage.append(get_filter_usage_entry(attribute, check_type, value))
 
                         filters_string = filters_string.replace(original_condition, condition)
                     else:
@@ -430,6 +743,62 @@ def parse_and_validate_filters_strings(filters_string):
         return error_message, "", []
 
 
+def parse_int_list(list_string):
+    """
+    Parse a list string like [1, 2, 3] into a list of integers,
+    raises ValueError for anything else
+    """
+    list_string = list_string.strip()
+    if not list_string.startswith('[') or not list_string.endswith(']'):
+        raise ValueError(f"{list_string} is not a list")
+    items = list_string[1:-1].split(',')
+    if len(items) == 1 and items[0].strip() == '':
+        return []
+    return [int(item) for item in items]
+
+
+def compile_int_list_condition(attribute_value, int_list, query_parameters):
+    """
+    Return an IN condition for short integer lists, longer or empty lists
+    are passed as a single array parameter so the query text stays small
+    """
+    if 0 < len(int_list) <= INLINE_INT_LIST_LIMIT:
+        return f"{attribute_value} IN ({', '.join(str(item) for item in int_list)})"
+
+    parameter_name = f"int_list_{len(query_parameters)}"
+    query_parameters.append({
+        'name': parameter_name,
+        'value': {'stringValue': '{' + ','.join(str(item) for item in int_list) + '}'}
+    })
+    return f"{attribute_value} = ANY(CAST(:{parameter_name} AS bigint[]))"
+
+
+def get_filter_usage_entry(attribute, check_type, value):
+    """
+    Describe a compiled filter condition for usage statistics, the value
+    is only kept for booleans so the logs never contain user data
+    """
+    attribute_data = next(attr for attr in ATTRIBUTES if attr[1] == attribute)
+    entry = {
+        'attribute': attribute,
+        'operator': check_type,
+        'table': attribute_data[3],
+        'column': attribute_data[0],
+        'type': attribute_data[2],
+        'derived': attribute_data[3] in NESTED_QUERY_TABLE
+    }
+    if attribute_data[2] == 'bool':
+        entry['value'] = value.strip('\'" ').lower()
+    return entry
+
+
+def record_filter_usage(filter_usage, latency_ms):
+    """
+    Log the filters used by a request and its latency for the index advisor
+    """
+    print('FILTER_USAGE ' + json.dumps({'filters': filter_usage, 'latency_ms': round(latency_ms, 2)}))
+
+
 def validate_filter_condition(post_request_data):
     """
     Validate filter condition and convert to valid condition
@@ -460,9 +829,7 @@ def validate_filter_condition(post_request_data):
                 return error_message, ""
         elif value[2] == 'int_arr':
             try:
-                second_part = ast.literal_eval(second_part)
-                res = [int(x) for x in second_part]
-                validated_value = res
+                validated_value = parse_int_list(second_part)
             except ValueError:
                 validated_value = ''
                 error_message = f"{first_part} is an invalid list string."
@@ -490,40 +857,242 @@ def validate_filter_condition(post_request_data):
         return error_message, ""
 
 
-def fetch_data_from_db(query, required_fields):
+def fetch_data_from_db(query, required_fields, param_set=None, aggregated_tables=()):
     """
     Fetch response from database using try exception
     """
     response_data = []
+    param_set = param_set or []
 
     # try fetching the data in single query
     try:
-        response = execute_query(query, [])
-        response_data = generate_response(response['records'], required_fields)
+        response = execute_query(query, param_set)
+        response_data = generate_response(response['records'], required_fields, aggregated_tables)
         
         return response_data
 
     except Exception as e:
         print('Exception Occured ', e)
-        count = get_total_rows_to_be_returned(query, [])
+        count = get_total_rows_to_be_returned(query, param_set)
         records_per_query = 1000
         offset = 0
         response = []
 
         while offset <= count: # at this point offset will be the records already fetched
             sql_query = query + ' limit {limit} offset {offset}'.format(limit=records_per_query, offset=offset)
-            res = execute_query(sql_query, [])
+            res = execute_query(sql_query, param_set)
             response.extend(res['records'])
             offset = offset + records_per_query
         
-        response_data.extend(generate_response(response, required_fields))
+        response_data.extend(generate_response(response, required_fields, aggregated_tables))
             
         return response_data
 
 
-def generate_response(query_response, required_fields):
+def validate_export_options(export_options):
+    """
+    Check that the export options passed in payload are usable
+    """
+    if not isinstance(export_options, dict):
+        return "export should be an object"
+    for option in EXPORT_DESTINATION_OPTIONS + EXPORT_INTERNAL_OPTIONS:
+        if option in export_options:
+            return f"export {option} cannot be set in the request"
+    if 'async' in export_options and export_options['async'] is not True:
+        return "export async can only be true"
+    if 'rows_per_part' in export_options:
+        rows_per_part = export_options['rows_per_part']
+        if not isinstance(rows_per_part, int) or isinstance(rows_per_part, bool) or rows_per_part < 1:
+            return "export rows_per_part should be a positive integer"
+    if not EXPORT_LOCAL_PATH and not EXPORT_BUCKET:
+        return "No bucket configured for export"
+    return None
+
+
+def get_export_store():
+    """
+    Return the object store the export parts are written to
+    """
+    if EXPORT_LOCAL_PATH:
+        return LocalObjectStore(EXPORT_LOCAL_PATH)
+    return S3ObjectStore(EXPORT_BUCKET)
+
+
+def get_export_key(job_id, file_name):
+    """
+    Return object key of a file that belongs to an export job
+    """
+    return f"{EXPORT_PREFIX}/{job_id}/{file_name}"
+
+
+def write_export_manifest(store, job_id, manifest):
+    """
+    Write the manifest of an export job, it holds the status of the job
+    """
+    store.put_object(get_export_key(job_id, 'manifest.json'),
+                     json.dumps(dict(manifest, job_id=job_id)).encode('UTF-8'), 'application/json')
+
+
+def run_export(post_request_data, filter_string, filter_tables, context, query_parameters=None,
+               export_job_id=None):
+    """
+    Export the complete result set as part files, either in this invocation
+    or in a separate asynchronous invocation identified by a job id
+    """
+    if export_job_id is not None:
+        if not is_submitted_export_job(get_export_store(), export_job_id):
+            return f"{export_job_id} is not a submitted export job"
+        return export_data_in_parts(post_request_data, filter_string, filter_tables, export_job_id,
+                                    query_parameters)
+
+    if post_request_data['export'].get('async'):
+        if context is None:
+            return "async export needs a lambda context to invoke itself"
+        return submit_export_job(post_request_data, context)
+
+    return export_data_in_parts(post_request_data, filter_string, filter_tables, str(uuid.uuid4()),
+                                query_parameters)
+
+
+def is_submitted_export_job(store, job_id):
     """
-    Create and return response data
+    Check that a job id was generated by submit_export_job and that the job
+    has not run yet, so a job id can never point outside of the export prefix
+    """
+    try:
+        if str(uuid.UUID(job_id)) != job_id:
+            return False
+    except (TypeError, ValueError, AttributeError):
+        return False
+    manifest = store.get_object(get_export_key(job_id, 'manifest.json'))
+    return manifest is not None and json.loads(manifest).get('status') == 'submitted'
+
+
+def submit_export_job(post_request_data, context):
+    """
+    Invoke this lambda again asynchronously to run the export and return
+    the job id along with the key of its manifest, which is written with the
+    submitted status right away. A failed invoke fails the job
+    """
+    job_id = str(uuid.uuid4())
+    export_options = dict(post_request_data['export'])
+    export_options.pop('async')
+    payload = dict(post_request_data)
+    payload['export'] = export_options
+    payload[EXPORT_JOB_ID_KEY] = job_id
+
+    store = get_export_store()
+    write_export_manifest(store, job_id, {'status': 'submitted'})
+    manifest = {'status': 'submitted'}
+    try:
+        boto3.client('lambda').invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps(payload)
+        )
+    except Exception as e:
+        manifest = {'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+        write_export_manifest(store, job_id, manifest)
+
+    return dict(manifest, job_id=job_id, manifest_key=get_export_key(job_id, 'manifest.json'))
+
+
+def export_data_in_parts(post_request_data, filter_string, filter_tables, job_id, query_parameters=None):
+    """
+    Page through the query results and write them to the object store as
+    gzipped NDJSON parts, then write and return the manifest of parts.
+    A failed export writes a manifest with the failed status
+    """
+    store = get_export_store()
+    try:
+        manifest = write_export_parts(store, post_request_data, filter_string, filter_tables, job_id,
+                                      query_parameters)
+    except Exception as e:
+        write_export_manifest(store, job_id, {'status': 'failed', 'error': f"{type(e).__name__}: {e}"})
+        raise
+    write_export_manifest(store, job_id, manifest)
+    return dict(manifest, job_id=job_id)
+
+
+def add_filter_condition(filter_string, condition):
+    """
+    Return the where clause of the filters with a condition that has to hold as well
+    """
+    return f" where ({filter_string.removeprefix(' where ')}) and {condition}"
+
+
+def write_export_parts(store, post_request_data, filter_string, filter_tables, job_id, query_parameters=None):
+    """
+    Write the export parts and return the manifest. Products are paged by
+    keyset on their id, so every page holds all rows of its products and
+    a page costs the same at any depth. The pages come in product id order,
+    the rows of a page in the order the database returns them
+    """
+    export_options = post_request_data['export']
+    rows_per_part = export_options.get('rows_per_part', EXPORT_ROWS_PER_PART)
+    required_fields = post_request_data['required_fields']
+    aggregated_tables = get_aggregated_tables(post_request_data, filter_tables)
+    attributes = get_attributes(required_fields, aggregated_tables)
+    query_joins = add_joins(required_fields, filter_tables, aggregated_tables=aggregated_tables)
+
+    parts = []
+    rows = []
+    last_id = None
+    while True:
+        id_parameters = list(query_parameters or [])
+        id_filter = filter_string
+        if last_id is not None:
+            id_filter = add_filter_condition(filter_string, f"{BASE_TABLE}.id > :export_after_id")
+            id_parameters.append({'name': 'export_after_id', 'value': {'longValue': last_id}})
+        id_query = f"select DISTINCT {BASE_TABLE}.id from {BASE_TABLE} {query_joins}{id_filter} " \
+                   f"order by {BASE_TABLE}.id limit {EXPORT_PAGE_SIZE}"
+        id_records = execute_query(id_query, id_parameters).get('records', [])
+        product_ids = [record[0]['longValue'] for record in id_records]
+        if not product_ids:
+            break
+
+        page_parameters = list(query_parameters or [])
+        page_condition = compile_int_list_condition(f"{BASE_TABLE}.id", product_ids, page_parameters)
+        query = f"select DISTINCT {attributes} from {BASE_TABLE} {query_joins}" \
+                f"{add_filter_condition(filter_string, page_condition)}"
+        records = execute_query(query, page_parameters).get('records', [])
+        rows.extend(generate_response(records, required_fields, aggregated_tables))
+
+        while len(rows) >= rows_per_part:
+            parts.append(write_export_part(store, job_id, len(parts), rows[:rows_per_part]))
+            rows = rows[rows_per_part:]
+
+        if len(product_ids) < EXPORT_PAGE_SIZE:
+            break
+        last_id = product_ids[-1]
+
+    if rows:
+        parts.append(write_export_part(store, job_id, len(parts), rows))
+
+    return {
+        'status': 'completed',
+        'format': 'ndjson',
+        'compression': 'gzip',
+        'total_rows': sum(part['rows'] for part in parts),
+        'parts': parts
+    }
+
+
+def write_export_part(store, job_id, part_number, rows):
+    """
+    Write a single compressed NDJSON part and return its manifest entry
+    """
+    lines = ''.join(json.dumps(row) + '\n' for row in rows)
+    body = gzip.compress(lines.encode('UTF-8'))
+    key = get_export_key(job_id, f"part-{part_number:05d}.ndjson.gz")
+    store.put_object(key, body, 'application/x-ndjson')
+    return {'key': key, 'rows': len(rows), 'bytes': len(body)}
+
+
+def generate_response(query_response, required_fields, aggregated_tables=()):
+    """
+    Create and return response data, the fields of aggregated tables
+    are returned as lists
     """
     response_data = {}
     response = []
@@ -532,7 +1101,10 @@ def generate_response(query_response, required_fields):
         i = 0
         for attr in ATTRIBUTES:
             if attr[1] in required_fields:
-                if 'isNull' not in db_record[i]:
+                if attr[3] in aggregated_tables:
+                    values = json.loads(db_record[i]['stringValue']) if 'isNull' not in db_record[i] else []
+                    response_data[attr[1]] = [get_aggregated_value(attr, value) for value in values]
+                elif 'isNull' not in db_record[i]:
                     if 'longValue' in db_record[i]:
                         response_data[attr[1]] = db_record[i]['longValue']
                     if 'doubleValue' in db_record[i]:
@@ -566,6 +1138,20 @@ def generate_response(query_response, required_fields):
     return response
 
 
+def get_aggregated_value(attribute, value):
+    """
+    Convert an item of an aggregated list the same way generate_response
+    converts a column value
+    """
+    if value is None:
+        return False if attribute[2] == 'bool' else ''
+    if attribute[2] == 'float':
+        return str(value)
+    if attribute[2] in ['str', 'date', 'decimal']:
+        return f"{attribute[5]}{value}"
+    return value
+
+
 def get_pagination_parameters(pagination_filters):
     """
     Get limit and offset parameters
@@ -624,7 +1210,7 @@ def parse_special_jsons(attribute_name, data):
     return parsed_value
 
 
-def get_attributes(required_fields):
+def get_attributes(required_fields, aggregated_tables=()):
     """
     Get attributes for DB queries according to
     attribute_filters passed
@@ -635,13 +1221,24 @@ def get_attributes(required_fields):
     i = 0
     for attribute in ATTRIBUTES:
         if attribute[1] in required_fields:
-            #BaseTableName.table_attribute
-            attribute_value = f"{attribute[3]}.{attribute[0]}"
-            #conversion attribute
-            if attribute[6] != '':
-                attribute_value = CONVERSIONS[attribute[6]] % (attribute_value)
-            attributes.append(attribute_value)
+            if attribute[3] in aggregated_tables:
+                #list aggregated by the subquery of the table
+                attributes.append(f"{attribute[3]}{AGGREGATED_TABLE_SUFFIX}.{attribute[1]}")
+            else:
+                attributes.append(get_attribute_value(attribute))
             i = i + 1
 
     attributes_string = ','.join(attributes)
     return attributes_string
+
+
+def get_attribute_value(attribute):
+    """
+    Get the select expression of an attribute
+    """
+    #BaseTableName.table_attribute
+    attribute_value = f"{attribute[3]}.{attribute[0]}"
+    #conversion attribute
+    if attribute[6] != '':
+        attribute_value = CONVERSIONS[attribute[6]] % (attribute_value)
+    return attribute_value
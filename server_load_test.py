@@ -0,0 +1,96 @@
+"""
+Load test for local_server.py, sends the same payloads from many
+connections and reports throughput and tail latency
+"""
+import argparse
+import asyncio
+import json
+import time
+
+
+async def send_request(reader, writer, host, payload):
+    """
+    Sends a single POST request on a keep-alive connection, returns None if
+    the server closed the connection
+    """
+    head = (f"POST / HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n")
+    writer.write(head.encode('latin-1') + payload)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        return None
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        if name.lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+
+async def run_client(host, port, payloads, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    index = 0
+    try:
+        while time.perf_counter() < deadline:
+            payload = payloads[index % len(payloads)]
+            index += 1
+            start_time = time.perf_counter()
+            status = await send_request(reader, writer, host, payload)
+            if status == 200:
+                latencies.append((time.perf_counter() - start_time) * 1000)
+            else:
+                errors.append(status or 'closed')
+            if status is None:
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+    finally:
+        writer.close()
+
+
+def percentile(ordered, value):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * value))]
+
+
+async def run_load_test(host, port, payloads, concurrency, duration):
+    latencies = []
+    errors = []
+    start_time = time.perf_counter()
+    deadline = start_time + duration
+    await asyncio.gather(*[run_client(host, port, payloads, deadline, latencies, errors)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start_time
+
+    ordered = sorted(latencies)
+    print(f"Requests: {len(latencies)} ok, {len(errors)} failed in {elapsed:.1f}s")
+    if ordered:
+        print(f"Throughput: {len(ordered) / elapsed:.1f} req/s")
+        print(f"Latency ms: p50 {percentile(ordered, 0.5):.1f}, p95 {percentile(ordered, 0.95):.1f}, "
+              + f"p99 {percentile(ordered, 0.99):.1f}, max {ordered[-1]:.1f}")
+
+
+def validate_arguments():
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument('-payloads', type=str, required=True,
+                        help="Json file with a list of request payloads")
+    parser.add_argument('-host', type=str, default='127.0.0.1')
+    parser.add_argument('-port', type=int, default=8080)
+    parser.add_argument('-concurrency', type=int, default=32)
+    parser.add_argument('-duration', type=float, default=30, help="Seconds to run")
+    return parser.parse_args()
+
+
+def main():
+    args = validate_arguments()
+    with open(args.payloads, 'r', encoding='UTF-8') as file_obj:
+        payloads = [json.dumps(payload).encode('UTF-8') for payload in json.load(file_obj)]
+    asyncio.run(run_load_test(args.host, args.port, payloads, args.concurrency, args.duration))
+
+
+if __name__ == "__main__":
+    main()
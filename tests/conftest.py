@@ -0,0 +1,31 @@
+"""
+The scripts live at the root of the repository and are imported from there,
+product-get-batch.py is loaded from its file since its name is not a module name
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture
+def product_get_batch(monkeypatch, tmp_path):
+    """
+    Loads a fresh product-get-batch module that exports to a temporary
+    directory. environment and helper come from the lambda layer
+    """
+    pytest.importorskip('boto3')
+    pytest.importorskip('environment')
+    pytest.importorskip('helper')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', os.environ.get('AWS_DEFAULT_REGION', 'us-west-2'))
+    spec = importlib.util.spec_from_file_location('product_get_batch',
+                                                  os.path.join(REPO_DIR, 'product-get-batch.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.EXPORT_LOCAL_PATH = str(tmp_path)
+    module.print = lambda *args, **kwargs: None
+    return module
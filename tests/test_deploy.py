@@ -0,0 +1,98 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import REPO_DIR
+
+pytest.importorskip('boto3')
+
+from aws_stand_in import StandInOptions, StandInServer  # noqa: E402
+from deploy_benchmark import write_functions  # noqa: E402
+
+FUNCTIONS = 3
+# operations of a plan, a rerun without changes calls nothing else
+READ_OPERATIONS = {
+    'apigateway.get_deployment', 'apigateway.get_resources', 'apigateway.get_stage',
+    'lambda.get_function_configuration', 'lambda.get_policy', 'logs.describe_subscription_filters',
+}
+
+
+@pytest.fixture
+def server():
+    options = StandInOptions(latency=1, jitter=0, pending=10, update=10, seed=7)
+    server = StandInServer(options)
+    server.start()
+    try:
+        yield server
+    finally:
+        server.stop()
+
+
+def run_deploy(directory, server, *args):
+    environment = dict(os.environ,
+                       AWS_ENDPOINT_URL=server.endpoint_url,
+                       AWS_ACCESS_KEY_ID='test',
+                       AWS_SECRET_ACCESS_KEY='test',
+                       AWS_DEFAULT_REGION='us-west-2',
+                       AWS_CONFIG_FILE=os.devnull,
+                       AWS_SHARED_CREDENTIALS_FILE=os.devnull)
+    environment.pop('AWS_PROFILE', None)
+    result = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'deploy.py'),
+                             '-lambdas_file', 'lambdas.json', '-env', 'production', *args],
+                            cwd=directory, env=environment, input='y\n',
+                            capture_output=True, text=True, check=False)
+    assert result.returncode == 0, result.stdout[-2000:] + result.stderr[-2000:]
+    return result.stdout
+
+
+def get_calls(server):
+    return dict(server.stand_in.get_stats()['calls'])
+
+
+def get_new_calls(before, after):
+    return {operation: count - before.get(operation, 0) for operation, count in after.items()
+            if count != before.get(operation, 0)}
+
+
+def test_rerun_without_changes_only_reads(server, tmp_path):
+    write_functions(tmp_path, FUNCTIONS, 1, 1)
+    assert f"{FUNCTIONS}/{FUNCTIONS} functions deployed" in run_deploy(tmp_path, server)
+
+    before = get_calls(server)
+    output = run_deploy(tmp_path, server)
+    calls = get_new_calls(before, get_calls(server))
+
+    assert "Nothing to deploy, all lambdas are up to date" in output
+    assert set(calls) <= READ_OPERATIONS
+    # one alias policy per function, the two shared failure lambda policies
+    # and the stage of the api are read once
+    assert calls['lambda.get_policy'] == FUNCTIONS + 2
+    assert calls['apigateway.get_stage'] == 1
+    assert calls['apigateway.get_deployment'] == 1
+
+
+def test_resume_after_failed_update(server, tmp_path):
+    write_functions(tmp_path, FUNCTIONS, 1, 1)
+    run_deploy(tmp_path, server)
+
+    write_functions(tmp_path, FUNCTIONS, 1, 2)
+    server.stand_in.options.update_failure = 1.0
+    failed = run_deploy(tmp_path, server)
+    assert f"0/{FUNCTIONS} functions deployed" in failed
+
+    server.stand_in.options.update_failure = 0.0
+    resumed = run_deploy(tmp_path, server, '-resume')
+    assert f"{FUNCTIONS}/{FUNCTIONS} functions deployed" in resumed
+    assert "Nothing to deploy, all lambdas are up to date" in run_deploy(tmp_path, server)
+
+
+def test_deploy_plans_a_missing_api_stage(server, tmp_path):
+    write_functions(tmp_path, FUNCTIONS, 1, 1)
+    run_deploy(tmp_path, server)
+    server.stand_in.get('us-west-2').rest_apis['benchapi0']['stages'].clear()
+
+    assert 'deploy benchapi0 to production' in run_deploy(tmp_path, server, '-plan')
+    run_deploy(tmp_path, server)
+    assert "Nothing to deploy, all lambdas are up to date" in run_deploy(tmp_path, server)
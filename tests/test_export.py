@@ -0,0 +1,177 @@
+import gzip
+import json
+import os
+import re
+
+import pytest
+
+PRODUCT_IDS = list(range(1, 9))
+EXPORT_REQUEST = {
+    'required_fields': ['id', 'name'],
+    'filter_string': '(customer_username__exact=bob)||(is_hidden__exact=false)',
+    'order_by': 'id desc',
+}
+
+
+class FakeDatabase:
+    """Answers the id and page queries of an export from a list of product ids"""
+
+    def __init__(self, product_ids, page_size):
+        self.product_ids = product_ids
+        self.page_size = page_size
+        self.queries = []
+
+    def execute_query(self, query, parameters=None):
+        parameters = parameters or []
+        self.queries.append((query, parameters))
+        values = {parameter['name']: parameter['value'] for parameter in parameters}
+        if query.startswith('select DISTINCT product.id from'):
+            after = values.get('export_after_id', {}).get('longValue', 0)
+            ids = [product_id for product_id in self.product_ids if product_id > after]
+            return {'records': [[{'longValue': product_id}] for product_id in ids[:self.page_size]]}
+        inline = re.search(r'product\.id IN \(([^)]*)\)', query)
+        if inline:
+            ids = [int(item) for item in inline.group(1).split(',')]
+        else:
+            name = re.search(r'ANY\(CAST\(:(\w+) AS bigint\[\]\)\)', query).group(1)
+            ids = [int(item) for item in values[name]['stringValue'].strip('{}').split(',')]
+        return {'records': [[{'longValue': product_id}, {'stringValue': f"name {product_id}"}]
+                            for product_id in ids]}
+
+
+class FakeLambdaClient:
+    def __init__(self, error=None):
+        self.error = error
+        self.payloads = []
+
+    def invoke(self, **kwargs):
+        if self.error:
+            raise self.error
+        self.payloads.append(json.loads(kwargs['Payload']))
+
+
+class FakeContext:
+    invoked_function_arn = 'arn:aws:lambda:us-west-2:384060451980:function:product-get-batch'
+
+
+@pytest.fixture
+def database(product_get_batch, monkeypatch):
+    monkeypatch.setattr(product_get_batch, 'EXPORT_PAGE_SIZE', 3)
+    fake = FakeDatabase(PRODUCT_IDS, 3)
+    monkeypatch.setattr(product_get_batch, 'execute_query', fake.execute_query)
+    return fake
+
+
+def use_lambda_client(module, monkeypatch, client):
+    monkeypatch.setattr(module.boto3, 'client', lambda service_name, **kwargs: client)
+
+
+def read_part(root, key):
+    with gzip.open(os.path.join(root, key)) as file_obj:
+        return [json.loads(line) for line in file_obj.read().splitlines()]
+
+
+def read_manifest(root, job_id):
+    with open(os.path.join(root, 'product_exports', job_id, 'manifest.json'), encoding='UTF-8') as file_obj:
+        return json.load(file_obj)
+
+
+def test_export_pages_by_product_id(product_get_batch, database):
+    response = product_get_batch.lambda_handler(dict(EXPORT_REQUEST, export={'rows_per_part': 5}), None)
+
+    assert response['status'] == 'completed'
+    assert response['total_rows'] == len(PRODUCT_IDS)
+    root = product_get_batch.EXPORT_LOCAL_PATH
+    assert [[row['id'] for row in read_part(root, part['key'])] for part in response['parts']] == \
+        [[1, 2, 3, 4, 5], [6, 7, 8]]
+    id_queries = [(query, parameters) for query, parameters in database.queries
+                  if query.startswith('select DISTINCT product.id from')]
+    assert [parameters[-1]['value'] for _, parameters in id_queries[1:]] == \
+        [{'longValue': 3}, {'longValue': 6}]
+    assert all(query.endswith('order by product.id limit 3') for query, _ in id_queries)
+    assert read_manifest(root, response['job_id']) == response
+
+
+def test_export_page_passes_long_id_lists_as_bigint_array(product_get_batch, database, monkeypatch):
+    monkeypatch.setattr(product_get_batch, 'INLINE_INT_LIST_LIMIT', 2)
+    big_id = 2 ** 31 + 5
+    database.product_ids = [1, 2, big_id]
+
+    response = product_get_batch.lambda_handler(dict(EXPORT_REQUEST, export={}), None)
+
+    assert response['total_rows'] == 3
+    page_query, page_parameters = database.queries[1]
+    assert 'product.id = ANY(CAST(:int_list_0 AS bigint[]))' in page_query
+    assert page_parameters[-1]['value'] == {'stringValue': f"{{1,2,{big_id}}}"}
+
+
+def test_failed_export_writes_failed_manifest(product_get_batch, monkeypatch):
+    def fail(query, parameters=None):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(product_get_batch, 'execute_query', fail)
+    with pytest.raises(RuntimeError):
+        product_get_batch.lambda_handler(dict(EXPORT_REQUEST, export={}), None)
+
+    root = product_get_batch.EXPORT_LOCAL_PATH
+    (job_id,) = os.listdir(os.path.join(root, 'product_exports'))
+    manifest = read_manifest(root, job_id)
+    assert manifest['status'] == 'failed'
+    assert manifest['error'] == 'RuntimeError: database unavailable'
+
+
+def test_async_export_runs_its_submitted_job_once(product_get_batch, database, monkeypatch):
+    client = FakeLambdaClient()
+    use_lambda_client(product_get_batch, monkeypatch, client)
+
+    submitted = product_get_batch.lambda_handler(dict(EXPORT_REQUEST, export={'async': True}), FakeContext())
+
+    root = product_get_batch.EXPORT_LOCAL_PATH
+    assert submitted['status'] == 'submitted'
+    assert read_manifest(root, submitted['job_id'])['status'] == 'submitted'
+    (payload,) = client.payloads
+    assert payload['export'] == {}
+    assert payload[product_get_batch.EXPORT_JOB_ID_KEY] == submitted['job_id']
+
+    completed = product_get_batch.lambda_handler(dict(payload), None)
+    assert completed['status'] == 'completed'
+    assert completed['job_id'] == submitted['job_id']
+    assert read_manifest(root, submitted['job_id'])['status'] == 'completed'
+
+    replayed = product_get_batch.lambda_handler(dict(payload), None)
+    assert replayed == f"{submitted['job_id']} is not a submitted export job"
+
+
+def test_async_export_fails_its_job_when_the_invoke_fails(product_get_batch, monkeypatch):
+    use_lambda_client(product_get_batch, monkeypatch, FakeLambdaClient(RuntimeError('throttled')))
+
+    response = product_get_batch.lambda_handler(dict(EXPORT_REQUEST, export={'async': True}), FakeContext())
+
+    assert response['status'] == 'failed'
+    manifest = read_manifest(product_get_batch.EXPORT_LOCAL_PATH, response['job_id'])
+    assert manifest['status'] == 'failed'
+    assert manifest['error'] == 'RuntimeError: throttled'
+
+
+def test_async_export_needs_a_lambda_context(product_get_batch):
+    response = product_get_batch.lambda_handler(dict(EXPORT_REQUEST, export={'async': True}), None)
+    assert response == "async export needs a lambda context to invoke itself"
+
+
+@pytest.mark.parametrize('export_options, message', [
+    ({'bucket': 'other'}, "export bucket cannot be set in the request"),
+    ({'job_id': '../../outside'}, "export job_id cannot be set in the request"),
+    ({'async': False}, "export async can only be true"),
+    ({'rows_per_part': 0}, "export rows_per_part should be a positive integer"),
+])
+def test_export_rejects_request_options(product_get_batch, database, export_options, message):
+    assert product_get_batch.lambda_handler(dict(EXPORT_REQUEST, export=export_options), None) == message
+    assert database.queries == []
+
+
+def test_export_rejects_job_ids_it_did_not_submit(product_get_batch, database):
+    request = dict(EXPORT_REQUEST, export={})
+    request[product_get_batch.EXPORT_JOB_ID_KEY] = '../../outside'
+
+    assert product_get_batch.lambda_handler(request, None) == "../../outside is not a submitted export job"
+    assert database.queries == []